@@ -3,9 +3,17 @@ from osgeo import gdal
 
 import numpy as np
 
+import math
 import os
 import subprocess
 
+LANDUSE_EXCLUDE = (0, 255)
+# cells read at once, the peak memory is some tens of bytes per cell.
+MAX_CELLS = 1 << 20
+# the masks are rasterized in process, older gdal (1.6, ArcGIS 9.3) can
+# only cut out the mapsheets with gdalwarp.
+CAN_RASTERIZE = hasattr(gdal, 'RasterizeLayer')
+
 
 def get_mapsheets(mask_fc, i_mapsheets, mapsheets_key, workspace):
     """
@@ -57,7 +65,21 @@ def get_mapsheets_gdal(mask_fc, i_mapsheets, mapsheets_key):
 
 def get_array_from_grid(mask_fc, mapsheet, input_grid, extent, workspace, NODATA=-9999):
     """ Return height array with values outside mask set to NODATA. """
-    output_tiff = os.path.join(workspace, mapsheet)
+    output_tiff = warp_grid(mask_fc, mapsheet, input_grid, extent, workspace, NODATA=NODATA)
+
+    # Read created tiff and close dataset
+    output_dataset = gdal.Open(output_tiff)
+    output_array = output_dataset.ReadAsArray()
+    output_dataset = None
+    os.remove(output_tiff)
+    
+    return output_array
+
+
+def warp_grid(mask_fc, name, input_grid, extent, workspace, NODATA=-9999):
+    """ Return the path of a tiff in workspace with the extent of
+    input_grid, values outside mask set to NODATA, made by gdalwarp. """
+    output_tiff = os.path.join(workspace, name)
     turtle_base_dir = os.environ['TURTLE_BASE_DIR']
     
     gdal_dir = os.path.join(turtle_base_dir, 'gdal')
@@ -79,13 +101,166 @@ def get_array_from_grid(mask_fc, mapsheet, input_grid, extent, workspace, NODATA
     else:
         print stdout
 
-    # Read created tiff and close dataset
-    output_dataset = gdal.Open(output_tiff)
-    output_array = output_dataset.ReadAsArray()
-    output_dataset = None
-    os.remove(output_tiff)
-    
-    return output_array
+    return output_tiff
+
+def get_window(geotransform, raster_size, extent):
+    """ Return (xoff, yoff, xsize, ysize) of the cells of a north-up grid
+    that cover extent, clipped to the grid. """
+    x0, dx, _, y0, _, dy = geotransform
+    xmin, ymin, xmax, ymax = [float(v) for v in extent.split(' ')]
+    xoff = max(int(math.floor((xmin - x0) / dx + 1e-6)), 0)
+    xend = min(int(math.ceil((xmax - x0) / dx - 1e-6)), raster_size[0])
+    yoff = max(int(math.floor((ymax - y0) / dy + 1e-6)), 0)
+    yend = min(int(math.ceil((ymin - y0) / dy - 1e-6)), raster_size[1])
+    return xoff, yoff, max(xend - xoff, 0), max(yend - yoff, 0)
+
+
+def read_window(band, window):
+    """ Return the values of band in window, read with ReadAsArray windows
+    that do not cross the blocks of the band. """
+    xoff, yoff, xsize, ysize = window
+    block_x, block_y = band.GetBlockSize()
+    x_ranges = [(max(x, xoff), min(x + block_x, xoff + xsize))
+                for x in range(xoff - xoff % block_x, xoff + xsize, block_x)]
+    rows = []
+    for y in range(yoff - yoff % block_y, yoff + ysize, block_y):
+        ystart, yend = max(y, yoff), min(y + block_y, yoff + ysize)
+        rows.append(np.hstack([band.ReadAsArray(xstart, ystart, xend - xstart, yend - ystart)
+                               for xstart, xend in x_ranges]))
+    return np.vstack(rows)
+
+
+def iter_block_windows(band, window, max_cells):
+    """ Yield the windows of at most max_cells cells, or of one native block
+    of band when that is larger, that cover window row by row. The windows
+    do not cross the blocks of the band. """
+    xoff, yoff, xsize, ysize = window
+    if not xsize or not ysize:
+        return
+    block_x, block_y = band.GetBlockSize()
+    if xsize * block_y <= max_cells:
+        step_y = max_cells // (xsize * block_y) * block_y
+        x_ranges = [(xoff, xoff + xsize)]
+    else:
+        step_y = block_y
+        step_x = max(max_cells // (block_x * block_y), 1) * block_x
+        x_ranges = [(max(x, xoff), min(x + step_x, xoff + xsize))
+                    for x in range(xoff - xoff % block_x, xoff + xsize, step_x)]
+    for y in range(yoff - yoff % block_y, yoff + ysize, step_y):
+        ystart, yend = max(y, yoff), min(y + step_y, yoff + ysize)
+        for xstart, xend in x_ranges:
+            yield xstart, ystart, xend - xstart, yend - ystart
+
+
+def rasterize_mask(mask_layer, geotransform, projection, shape):
+    """ Return boolean array of shape, True in the cells of the grid whose
+    centre lies in the polygons of mask_layer. """
+    mask_dataset = gdal.GetDriverByName('MEM').Create('', shape[1], shape[0], 1, gdal.GDT_Byte)
+    mask_dataset.SetGeoTransform(geotransform)
+    mask_dataset.SetProjection(projection)
+    gdal.RasterizeLayer(mask_dataset, [1], mask_layer, burn_values=[1])
+    mask = mask_dataset.ReadAsArray() == 1
+    mask_dataset = None
+    return mask
+
+
+def rasterize_zones(zone_layer, geotransform, projection, shape):
+    """ Return int32 array of shape with the ZONE of the polygons of
+    zone_layer in the cells of the grid whose centre lies in them, 0
+    elsewhere. """
+    zone_dataset = gdal.GetDriverByName('MEM').Create('', shape[1], shape[0], 1, gdal.GDT_Int32)
+    zone_dataset.SetGeoTransform(geotransform)
+    zone_dataset.SetProjection(projection)
+    # only the polygons near the grid are rasterized
+    x0, dx, _, y0, _, dy = geotransform
+    zone_layer.SetSpatialFilterRect(x0, y0 + shape[0] * dy, x0 + shape[1] * dx, y0)
+    gdal.RasterizeLayer(zone_dataset, [1], zone_layer, options=['ATTRIBUTE=ZONE'])
+    zone_layer.SetSpatialFilter(None)
+    zones = zone_dataset.ReadAsArray()
+    zone_dataset = None
+    return zones
+
+
+def get_zone_layer(zones_fc, zone_field):
+    """ Return (datasource, layer, zones) with the polygons of zones_fc in
+    an in memory layer, numbered in the integer field ZONE. zones[number - 1]
+    is the zone_field value of the polygons with that number; features with
+    the same value get the same number. """
+    zones_dataset = ogr.Open(zones_fc)
+    zones_layer = zones_dataset.GetLayer(0)
+    datasource = ogr.GetDriverByName('Memory').CreateDataSource('')
+    layer = datasource.CreateLayer('zones', zones_layer.GetSpatialRef(), ogr.wkbUnknown)
+    layer.CreateField(ogr.FieldDefn('ZONE', ogr.OFTInteger))
+    numbers = {}
+    zones = []
+    for zones_feature in zones_layer:
+        geometry = zones_feature.GetGeometryRef()
+        if geometry is None:
+            continue
+        zone = zones_feature.GetField(zone_field)
+        if zone not in numbers:
+            zones.append(zone)
+            numbers[zone] = len(zones)
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('ZONE', numbers[zone])
+        feature.SetGeometry(geometry.Clone())
+        layer.CreateFeature(feature)
+    zones_dataset = None
+    return datasource, layer, zones
+
+
+def iter_grid_blocks(dataset, extent, max_cells=MAX_CELLS, NODATA=-9999):
+    """ Yield (array, geotransform) of the blocks of iter_block_windows
+    that cover the extent (the whole grid if None) at the resolution of
+    dataset, with values without data set to NODATA. """
+    geotransform = dataset.GetGeoTransform()
+    raster_size = (dataset.RasterXSize, dataset.RasterYSize)
+    if extent is None:
+        window = (0, 0) + raster_size
+    else:
+        window = get_window(geotransform, raster_size, extent)
+    x0, dx, _, y0, _, dy = geotransform
+    band = dataset.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    for block in iter_block_windows(band, window, max_cells):
+        xoff, yoff, xsize, ysize = block
+        array = read_window(band, block)
+        if array.dtype.kind != 'f':
+            array = array.astype(np.float32)
+        if nodata is not None:
+            array[array == nodata] = NODATA
+        yield array, (x0 + xoff * dx, dx, 0, y0 + yoff * dy, 0, dy)
+
+
+def sample_grid(dataset, geotransform, shape, fill=0):
+    """ Return the values of dataset at the cell centres of the grid given
+    by geotransform and shape (nearest neighbour), fill outside dataset. """
+    gx0, gdx, _, gy0, _, gdy = geotransform
+    x0, dx, _, y0, _, dy = dataset.GetGeoTransform()
+    cols = np.floor((gx0 + (np.arange(shape[1]) + 0.5) * gdx - x0) / dx).astype(int)
+    rows = np.floor((gy0 + (np.arange(shape[0]) + 0.5) * gdy - y0) / dy).astype(int)
+    valid_cols = np.logical_and(cols >= 0, cols < dataset.RasterXSize)
+    valid_rows = np.logical_and(rows >= 0, rows < dataset.RasterYSize)
+    band = dataset.GetRasterBand(1)
+    if not valid_cols.any() or not valid_rows.any():
+        return np.zeros(shape, dtype=np.uint8) + fill
+
+    cols, rows = cols[valid_cols], rows[valid_rows]
+    window = (int(cols.min()), int(rows.min()),
+              int(cols.max() - cols.min()) + 1, int(rows.max() - rows.min()) + 1)
+    array = read_window(band, window)
+    result = np.zeros(shape, dtype=array.dtype) + fill
+    result[np.ix_(valid_rows, valid_cols)] = array[np.ix_(rows - window[1], cols - window[0])]
+    return result
+
+
+def open_grid(input_grid):
+    """ Return gdal dataset of input_grid. """
+    dataset = gdal.Open(input_grid)
+    if dataset is None:
+        raise Exception('%s could not be opened' % input_grid)
+    return dataset
+
 
 def reclassify_conversion(conversion):
     r_conv = np.zeros(max(conversion.keys()) + 1, dtype=np.uint16)
@@ -97,8 +272,6 @@ def reclassify_array(array, conversion, NODATA=-9999):
     """
     """
     c = reclassify_conversion(conversion)
-    nbw_array = np.ones(array.shape) * NODATA
-    
     nbw_array = c[array]
     #for k, v in conversion.items():
     #    nbw_array[array == k] = v
@@ -106,6 +279,11 @@ def reclassify_array(array, conversion, NODATA=-9999):
     return nbw_array
     
     
+def get_bins(streefpeil, maxpeil, step=0.01):
+    """ Return the bin edges of the histograms from streefpeil to maxpeil. """
+    return np.arange(streefpeil, maxpeil + step, step)
+
+
 def get_groundcurve(histogram, bins_right, MAX=None):
     """ Return x, y of ground curve. """
     percentile_x = np.cumsum(histogram) / float(histogram.sum()) * 100
@@ -117,57 +295,284 @@ def get_groundcurve(histogram, bins_right, MAX=None):
     return curve_x, curve_y
 
 
-def main(mask_fc, mapsheets, landgebruik, hoogtekaart, streefpeil, maxpeil, conversion, workspace):
-    mapsheets_key = 'BLADNR'
-    NODATA = -9999
-    
-    # Bin settings
-    BIN_MIN = streefpeil
-    BIN_MAX = maxpeil
-    BIN_STEP = 0.01
-    
-    LANDUSE_EXCLUDE = (0, 255)
+def bin_index(values, bins):
+    """ Return the bin of every value as np.histogram counts it with these
+    equally spaced bin edges, len(bins) - 1 for values outside them. """
+    # compare in double precision like np.histogram, not in the precision
+    # of the grid.
+    values = np.asarray(values, dtype=np.float64)
+    n = bins.size - 1
+    index = np.floor((values - bins[0]) / (bins[1] - bins[0])).astype(np.intp)
+    np.clip(index, 0, n - 1, out=index)
+    # the edges of np.arange are not exact multiples of the step.
+    index -= values < bins[index]
+    index += values >= bins[index + 1]
+    index[values == bins[-1]] = n - 1
+    index[~np.logical_and(values >= bins[0], values <= bins[-1])] = n
+    return index
 
-    # Initialize the histogram
-    bins = np.arange(BIN_MIN, BIN_MAX + BIN_STEP, BIN_STEP)
-    bins_right = bins[1:]
-    histogram = np.zeros(bins.size - 1, dtype=np.uint64)
+
+def get_mapsheet_histograms(heights, landuses, bins):
+    """ Return the histogram of heights and a dictionary with the
+    histograms per landuse (the landuse of every height, or None) of all
+    landuses present except LANDUSE_EXCLUDE, counted in one bincount of
+    the combined (landuse, bin) index. """
+    n = bins.size - 1
+    index = bin_index(heights, bins)
+    if landuses is None:
+        return np.bincount(index, minlength=n + 1)[:n], {}
+
+    landuses = landuses.astype(np.intp)
+    size = landuses.max() + 1 if landuses.size else 0
+    counts = np.bincount(landuses * (n + 1) + index, minlength=size * (n + 1))
+    counts = counts.reshape(size, n + 1)
+    histogram = counts[:, :n].sum(axis=0)
+    histogram_per_landuse = {}
+    for landuse in np.flatnonzero(counts.any(axis=1)):
+        if landuse in LANDUSE_EXCLUDE:
+            continue
+        histogram_per_landuse[int(landuse)] = counts[landuse, :n]
+    return histogram, histogram_per_landuse
+
+
+def get_histograms(mask_fc, mapsheets, landgebruik, hoogtekaart, conversion, workspace, bins, in_process=True, NODATA=-9999, max_cells=MAX_CELLS):
+    """ Return (max_value, histogram_total, histogram_per_landuse) of the
+    mapsheets, a list of (mapsheet, extent). max_value is None without
+    mapsheets. The mapsheets are read and counted in blocks of at most
+    max_cells cells. """
+    max_value = None
     histogram_total = {}
     histogram_per_landuse = {}
-    max_value = streefpeil
+    landuse_dataset = None
+    if in_process:
+        height_dataset = open_grid(hoogtekaart)
+        if landgebruik != '#':
+            landuse_dataset = open_grid(landgebruik)
+        mask_dataset = ogr.Open(mask_fc)
+        mask_layer = mask_dataset.GetLayer(0)
     # Loop mapsheets and add to histogram
-    for (mapsheet, extent) in get_mapsheets(mask_fc, mapsheets, mapsheets_key, workspace):
-        # Get data and index mask
-        height_array = get_array_from_grid(mask_fc, mapsheet, hoogtekaart, extent, workspace, NODATA=NODATA)
-        max_array = np.max(height_array)
-        if max_array > max_value:
-            max_value = max_array
-        
-        index_mask = height_array != NODATA
-        
-        # Determine histogram for this mapsheet and add to total histogram
-        if not 0 in histogram_total.keys():
-            histogram_total[0] = np.histogram(height_array[height_array != NODATA], bins=bins)[0]
+    for (mapsheet, extent) in mapsheets:
+        if in_process:
+            blocks = iter_grid_blocks(height_dataset, extent, max_cells, NODATA=NODATA)
         else:
-            histogram_total[0] += np.histogram(height_array[height_array != NODATA], bins=bins)[0]
-        if landgebruik != '#':
-            landuse_array = get_array_from_grid(mask_fc, mapsheet, landgebruik, extent, workspace, NODATA=NODATA)
-            nbw_array = reclassify_array(landuse_array, conversion, NODATA=NODATA)
-            # Determine histogram per landuse
-            mapsheet_histogram_per_landuse = {}
-            landuses = np.unique(nbw_array[index_mask])
-    
-            for landuse in landuses:
-                if landuse in LANDUSE_EXCLUDE:
+            # the grids are cut out and resampled to the same tiffs
+            height_tiff = warp_grid(mask_fc, mapsheet, hoogtekaart, extent, workspace, NODATA=NODATA)
+            height_dataset = open_grid(height_tiff)
+            if landgebruik != '#':
+                landuse_tiff = warp_grid(mask_fc, mapsheet + '_landgebruik', landgebruik, extent, workspace, NODATA=NODATA)
+                landuse_dataset = open_grid(landuse_tiff)
+            blocks = iter_grid_blocks(height_dataset, None, max_cells, NODATA=NODATA)
+
+        for height_array, geotransform in blocks:
+            if in_process:
+                mask = rasterize_mask(mask_layer, geotransform, height_dataset.GetProjection(), height_array.shape)
+                height_array[~mask] = NODATA
+            max_array = np.max(height_array)
+            if max_value is None or max_array > max_value:
+                max_value = max_array
+
+            index_mask = height_array != NODATA
+            heights = height_array[index_mask]
+
+            # Determine the histograms of this block in one pass and add
+            # them to the total histograms
+            if landuse_dataset is not None:
+                # only the cells in index_mask are used, so the landuse
+                # is not masked.
+                landuse_array = sample_grid(landuse_dataset, geotransform, height_array.shape)
+                nbw_array = reclassify_array(landuse_array[index_mask], conversion, NODATA=NODATA)
+            else:
+                nbw_array = None
+            block_histogram, block_histogram_per_landuse = get_mapsheet_histograms(heights, nbw_array, bins)
+            add_histograms(histogram_total, {0: block_histogram})
+            add_histograms(histogram_per_landuse, block_histogram_per_landuse)
+
+        if not in_process:
+            height_dataset = None
+            os.remove(height_tiff)
+            if landuse_dataset is not None:
+                landuse_dataset = None
+                os.remove(landuse_tiff)
+
+    return max_value, histogram_total, histogram_per_landuse
+
+
+def get_zonal_histograms(zones_fc, zone_field, mapsheets, landgebruik, hoogtekaart, conversion, streefpeilen, maxpeil, NODATA=-9999, max_cells=MAX_CELLS):
+    """ Return dictionaries (max_values, histograms_total,
+    histograms_per_landuse) with the results of get_histograms for every
+    zone_field value of the polygons in zones_fc that has a streefpeil in
+    streefpeilen and heights in the mapsheets.
+
+    Every mapsheet window is read once for all zones, in blocks of at most
+    max_cells cells: the zones are rasterized into a zone grid of the
+    block, its cells are sorted by zone and the histograms of every zone
+    are counted from its own bins. A cell belongs to one zone only, so the
+    polygons should not overlap. """
+    max_values = {}
+    histograms_total = {}
+    histograms_per_landuse = {}
+    zone_bins = {}
+    height_dataset = open_grid(hoogtekaart)
+    if landgebruik != '#':
+        landuse_dataset = open_grid(landgebruik)
+    zone_datasource, zone_layer, zones = get_zone_layer(zones_fc, zone_field)
+    for (mapsheet, extent) in mapsheets:
+        for height_array, geotransform in iter_grid_blocks(height_dataset, extent, max_cells, NODATA=NODATA):
+            zone_array = rasterize_zones(zone_layer, geotransform, height_dataset.GetProjection(), height_array.shape)
+            index_mask = np.logical_and(zone_array != 0, height_array != NODATA)
+            zone_numbers = zone_array[index_mask]
+            order = np.argsort(zone_numbers, kind='mergesort')
+            zone_numbers = zone_numbers[order]
+            heights = height_array[index_mask][order]
+            if landgebruik != '#':
+                landuse_array = sample_grid(landuse_dataset, geotransform, height_array.shape)
+                nbw_array = reclassify_array(landuse_array[index_mask][order], conversion, NODATA=NODATA)
+            else:
+                nbw_array = None
+
+            # zone_numbers is sorted, so every zone is one slice of the cells
+            bounds = np.concatenate(([0], np.flatnonzero(np.diff(zone_numbers)) + 1, [zone_numbers.size]))
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if start == end:
                     continue
-                index_landuse = nbw_array == landuse
-                mapsheet_histogram_per_landuse[int(landuse)] = np.histogram(
-                    height_array[np.logical_and(index_mask, index_landuse)], bins)[0]
-                if landuse in histogram_per_landuse:
-                    histogram_per_landuse[landuse] += mapsheet_histogram_per_landuse[landuse]
+                zone = zones[zone_numbers[start] - 1]
+                if zone not in zone_bins:
+                    if zone not in streefpeilen:
+                        continue
+                    zone_bins[zone] = get_bins(float(streefpeilen[zone]), maxpeil)
+                zone_heights = heights[start:end]
+                max_array = zone_heights.max()
+                if zone not in max_values or max_array > max_values[zone]:
+                    max_values[zone] = max_array
+                if nbw_array is None:
+                    zone_landuses = None
                 else:
-                    histogram_per_landuse[landuse] = mapsheet_histogram_per_landuse[landuse]
-        
+                    zone_landuses = nbw_array[start:end]
+                block_histogram, block_histogram_per_landuse = get_mapsheet_histograms(
+                    zone_heights, zone_landuses, zone_bins[zone])
+                add_histograms(histograms_total.setdefault(zone, {}), {0: block_histogram})
+                add_histograms(histograms_per_landuse.setdefault(zone, {}), block_histogram_per_landuse)
+    zone_datasource = None
+
+    return max_values, histograms_total, histograms_per_landuse
+
+
+def add_histograms(histograms, partial):
+    """ Add the histograms in the dictionary partial to the ones with the
+    same key in histograms. """
+    for landuse, histogram in partial.iteritems():
+        if landuse in histograms:
+            histograms[landuse] += histogram
+        else:
+            histograms[landuse] = histogram
+
+
+def merge_histograms(partials, max_value):
+    """ Return (max_value, histogram_total, histogram_per_landuse), the sum
+    of the partial results of get_histograms, with max_value at least the
+    given one. """
+    histogram_total = {}
+    histogram_per_landuse = {}
+    for partial_max, partial_total, partial_per_landuse in partials:
+        if partial_max is not None and partial_max > max_value:
+            max_value = partial_max
+        add_histograms(histogram_total, partial_total)
+        add_histograms(histogram_per_landuse, partial_per_landuse)
+    return max_value, histogram_total, histogram_per_landuse
+
+
+def merge_zonal_histograms(partials):
+    """ Return (max_values, histograms_total, histograms_per_landuse), the
+    sum of the partial results of get_zonal_histograms. """
+    max_values = {}
+    histograms_total = {}
+    histograms_per_landuse = {}
+    for partial_max, partial_total, partial_per_landuse in partials:
+        for zone, max_value in partial_max.iteritems():
+            if zone not in max_values or max_value > max_values[zone]:
+                max_values[zone] = max_value
+        for histograms, partial in ((histograms_total, partial_total),
+                                    (histograms_per_landuse, partial_per_landuse)):
+            for zone, zone_histograms in partial.iteritems():
+                add_histograms(histograms.setdefault(zone, {}), zone_histograms)
+    return max_values, histograms_total, histograms_per_landuse
+
+
+def split_mapsheets(mapsheets, count):
+    """ Return mapsheets divided into count contiguous shards. """
+    bounds = [len(mapsheets) * i // count for i in range(count + 1)]
+    return [mapsheets[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def map_pool(function, jobs, processes):
+    """ Return the results of function for every job, computed by a pool of
+    processes. """
+    import multiprocessing
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(function, jobs)
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return results
+
+
+def _get_histograms(args):
+    return get_histograms(*args)
+
+
+def _get_zonal_histograms(args):
+    return get_zonal_histograms(*args)
+
+
+def get_histograms_parallel(mask_fc, mapsheets, landgebruik, hoogtekaart, conversion, workspace, bins, processes, in_process=True, NODATA=-9999, max_cells=MAX_CELLS, shards_per_process=4):
+    """ Return the partial results of get_histograms for contiguous shards
+    of mapsheets, computed by a pool of processes. """
+    shards = split_mapsheets(mapsheets, min(len(mapsheets), processes * shards_per_process))
+    jobs = [(mask_fc, shard, landgebruik, hoogtekaart, conversion,
+             workspace, bins, in_process, NODATA, max_cells)
+            for shard in shards]
+    return map_pool(_get_histograms, jobs, processes)
+
+
+def get_zonal_histograms_parallel(zones_fc, zone_field, mapsheets, landgebruik, hoogtekaart, conversion, streefpeilen, maxpeil, processes, NODATA=-9999, max_cells=MAX_CELLS, shards_per_process=4):
+    """ Return the partial results of get_zonal_histograms for contiguous
+    shards of mapsheets, computed by a pool of processes. """
+    shards = split_mapsheets(mapsheets, min(len(mapsheets), processes * shards_per_process))
+    jobs = [(zones_fc, zone_field, shard, landgebruik, hoogtekaart, conversion,
+             streefpeilen, maxpeil, NODATA, max_cells)
+            for shard in shards]
+    return map_pool(_get_zonal_histograms, jobs, processes)
+
+
+def main(mask_fc, mapsheets, landgebruik, hoogtekaart, streefpeil, maxpeil, conversion, workspace, in_process=True, processes=None, max_cells=MAX_CELLS):
+    """ Return ground curves of the mask, total and per landuse.
+
+    With in_process the mapsheet windows are read from the grids at their
+    own resolution and masked in memory, otherwise, or when gdal cannot
+    rasterize, every mapsheet and grid is cut out and resampled by a
+    gdalwarp subprocess. Either way they are read in blocks of at most
+    max_cells cells. With processes > 1 the mapsheets are divided over a
+    pool of processes and their histograms are summed afterwards. """
+    mapsheets_key = 'BLADNR'
+    NODATA = -9999
+    in_process = in_process and CAN_RASTERIZE
+    
+    # Initialize the histogram
+    bins = get_bins(streefpeil, maxpeil)
+    bins_right = bins[1:]
+    mapsheet_extents = get_mapsheets(mask_fc, mapsheets, mapsheets_key, workspace)
+    if processes and processes > 1 and len(mapsheet_extents) > 1:
+        partials = get_histograms_parallel(mask_fc, mapsheet_extents, landgebruik, hoogtekaart, conversion,
+                                           workspace, bins, processes, in_process=in_process, NODATA=NODATA,
+                                           max_cells=max_cells)
+    else:
+        partials = [get_histograms(mask_fc, mapsheet_extents, landgebruik, hoogtekaart, conversion,
+                                   workspace, bins, in_process=in_process, NODATA=NODATA, max_cells=max_cells)]
+    max_value, histogram_total, histogram_per_landuse = merge_histograms(partials, streefpeil)
 
     # Determine ground curves
     groundcurve = {}
@@ -181,5 +586,42 @@ def main(mask_fc, mapsheets, landgebruik, hoogtekaart, streefpeil, maxpeil, conv
     return groundcurve, groundcurve_per_landuse
 
 
+def main_zonal(zones_fc, zone_field, mapsheets, landgebruik, hoogtekaart, streefpeilen, maxpeil, conversion, workspace, processes=None, max_cells=MAX_CELLS):
+    """ Return dictionaries with the ground curves of main, total and per
+    landuse, for every zone_field value of the polygons in zones_fc, from
+    one in process read of the mapsheets that intersect them. streefpeilen
+    holds the streefpeil per zone, zones without one or without heights are
+    left out. Needs a gdal that can rasterize, see CAN_RASTERIZE. """
+    mapsheets_key = 'BLADNR'
+    NODATA = -9999
+    if not CAN_RASTERIZE:
+        raise Exception('gdal.RasterizeLayer not available, use main per zone')
+
+    mapsheet_extents = get_mapsheets(zones_fc, mapsheets, mapsheets_key, workspace)
+    if processes and processes > 1 and len(mapsheet_extents) > 1:
+        partials = get_zonal_histograms_parallel(zones_fc, zone_field, mapsheet_extents, landgebruik, hoogtekaart,
+                                                 conversion, streefpeilen, maxpeil, processes, NODATA=NODATA,
+                                                 max_cells=max_cells)
+    else:
+        partials = [get_zonal_histograms(zones_fc, zone_field, mapsheet_extents, landgebruik, hoogtekaart,
+                                         conversion, streefpeilen, maxpeil, NODATA=NODATA, max_cells=max_cells)]
+    max_values, histograms_total, histograms_per_landuse = merge_zonal_histograms(partials)
+
+    # Determine ground curves per zone
+    groundcurves = {}
+    groundcurves_per_landuse = {}
+    for zone, histogram_total in histograms_total.iteritems():
+        streefpeil = float(streefpeilen[zone])
+        bins_right = get_bins(streefpeil, maxpeil)[1:]
+        max_value = max(max_values[zone], streefpeil)
+        groundcurves[zone] = {}
+        for landuse, histogram in histogram_total.iteritems():
+            groundcurves[zone][landuse] = get_groundcurve(histogram, bins_right, MAX=max_value)
+        groundcurves_per_landuse[zone] = {}
+        for landuse, histogram in histograms_per_landuse[zone].iteritems():
+            groundcurves_per_landuse[zone][landuse] = get_groundcurve(histogram, bins_right, MAX=None)
+
+    return groundcurves, groundcurves_per_landuse
+
 if __name__ == '__main__':
     exit(main())
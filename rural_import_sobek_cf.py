@@ -13,6 +13,7 @@ from turtlebase import mainutils
 import shapefile
 import nens.sobek
 import time
+import numpy
 
 log = logging.getLogger(__name__)
 NO_DATA_VALUE = -9999
@@ -34,6 +35,24 @@ def add_to_csv(output_csv, csv_data, write_or_append):
     csv_file.close()
 
 
+def write_links(writer, links, network_coords):
+    """
+    Writes sobek links (ident, from_node, to_node) as two point lines to a
+    shapefile writer with the fields ident, from point, from type, to point
+    and to type. All lines and records are added in one go.
+    """
+    if not links:
+        return
+    xy = numpy.array([network_coords[from_node[1]] + network_coords[to_node[1]]
+                      for ident, from_node, to_node in links], dtype=float)
+    writer.lines(xy.reshape(-1, 2), numpy.arange(0, 2 * len(links) + 1, 2))
+    writer.recordColumns([[ident for ident, from_node, to_node in links],
+                          [from_node[1] for ident, from_node, to_node in links],
+                          [from_node[0] for ident, from_node, to_node in links],
+                          [to_node[1] for ident, from_node, to_node in links],
+                          [to_node[0] for ident, from_node, to_node in links]])
+
+
 def create_shapefiles(gp, config, sobek_network_dict,
                       sobek_object, output_fc, profile_dict):
     '''
@@ -177,29 +196,24 @@ def main():
         #RR Network
         if RR_Network == True:
             log.info("Read RR Features")
-            rr_nodes = shapefile.Writer(shapefile.POINT)
+            rr_nodes_shp = os.path.join(workspace, 'rr_nodes.shp')
+            rr_nodes = shapefile.Writer(shapefile.POINT, target=rr_nodes_shp)
             rr_nodes.field('GPGIDENT')
             rr_nodes.field('SBKIDENT')
             rr_nodes.field('TYPE')
 
-            if '3B_UNPAVED' in available_types:
-                for i, (ident, x, y) in enumerate(sobek_network_dict['3B_UNPAVED']):
-                        rr_nodes.point(float(x), float(y))
-                        rr_nodes.record(ident, ident, '3B_UNPAVED')
-
-            if '3B_PAVED' in available_types:
-                for i, (ident, x, y) in enumerate(sobek_network_dict['3B_PAVED']):
-                        rr_nodes.point(float(x), float(y))
-                        rr_nodes.record(ident, ident, '3B_PAVED')
-                        
+            nodes = []
+            for node_type in ['3B_UNPAVED', '3B_PAVED', '3B_GREENHOUSE']:
+                if node_type in available_types:
+                    for ident, x, y in sobek_network_dict[node_type]:
+                        nodes.append((ident, float(x), float(y), node_type))
 
-            if '3B_GREENHOUSE' in available_types:
-                for i, (ident, x, y) in enumerate(sobek_network_dict['3B_GREENHOUSE']):
-                        rr_nodes.point(float(x), float(y))
-                        rr_nodes.record(ident, ident, '3B_GREENHOUSE')
+            if nodes:
+                idents, xs, ys, node_types = zip(*nodes)
+                rr_nodes.points(numpy.column_stack([xs, ys]))
+                rr_nodes.recordColumns([idents, idents, node_types])
 
-            rr_nodes_shp = os.path.join(workspace, 'rr_nodes.shp')
-            rr_nodes.save(rr_nodes_shp)
+            rr_nodes.close()
 
             #RRCF Connection Nodes
             rrcf_connections = shapefile.Writer(shapefile.POINT)            
@@ -215,21 +229,16 @@ def main():
             rrcf_connections.save(rrcf_connections_shp)
 
             # RR Network
-            rr_line = shapefile.Writer(shapefile.POLYLINE)
+            rr_lines_shp = os.path.join(workspace, "rr_lines.shp")
+            rr_line = shapefile.Writer(shapefile.POLYLINE, target=rr_lines_shp)
             rr_line.field('RRIDENT')
             rr_line.field('FROM_POINT')
             rr_line.field('FROM_TYPE')
             rr_line.field('TO_POINT')
             rr_line.field('TO_TYPE')
 
-            for i, (ident, from_node, to_node) in enumerate(sobek_network_dict['3B_LINK']):
-                x1, y1 = network_coords[from_node[1]]
-                x2, y2= network_coords[to_node[1]]
-                rr_line.line(parts=[[[float(x1), float(y1)],[float(x2),float(y2)]]])
-                rr_line.record(ident, from_node[1], from_node[0], to_node[1], to_node[0])
-                
-            rr_lines_shp = os.path.join(workspace, "rr_lines.shp")
-            rr_line.save(rr_lines_shp)
+            write_links(rr_line, sobek_network_dict['3B_LINK'], network_coords)
+            rr_line.close()
 
             #append rr features
             log.info(" - append rrcf_connections to hydrobase")
@@ -246,21 +255,16 @@ def main():
         # CF Network
         # - channel
         log.info(' - copy channels')
-        channel = shapefile.Writer(shapefile.POLYLINE)
+        channel_shp = os.path.join(workspace, "channel.shp")
+        channel = shapefile.Writer(shapefile.POLYLINE, target=channel_shp)
         channel.field('OVKIDENT')
         channel.field('FROM_POINT')
         channel.field('FROM_TYPE')
         channel.field('TO_POINT')
         channel.field('TO_TYPE')
 
-        for i, (ident, from_node, to_node) in enumerate(sobek_network_dict['SBK_CHANNEL']):
-            x1, y1 = network_coords[from_node[1]]
-            x2, y2= network_coords[to_node[1]]
-            channel.line(parts=[[[float(x1), float(y1)],[float(x2),float(y2)]]])
-            channel.record(ident, from_node[1], from_node[0], to_node[1], to_node[0])
-            
-        channel_shp = os.path.join(workspace, "channel.shp")
-        channel.save(channel_shp)
+        write_links(channel, sobek_network_dict['SBK_CHANNEL'], network_coords)
+        channel.close()
 
         #append channels
         log.info(" - append channels to hydrobase")
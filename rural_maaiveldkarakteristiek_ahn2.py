@@ -189,6 +189,18 @@ def main():
         row = rows.next()
         mvcurve_dict = {}        
         maxpeil = float(config.get('maaiveldkarakteristiek', 'max_hoogte'))
+        processes = 1
+        if config.has_option('maaiveldkarakteristiek', 'processes'):
+            processes = int(config.get('maaiveldkarakteristiek', 'processes'))
+        zonal = False
+        if config.has_option('maaiveldkarakteristiek', 'zonal'):
+            zonal = int(config.get('maaiveldkarakteristiek', 'zonal')) == 1
+        if zonal and not maaiveldcurve.CAN_RASTERIZE:
+            log.warning(" - this gdal cannot rasterize the areas: determining the curves per area")
+            zonal = False
+        max_cells = maaiveldcurve.MAX_CELLS
+        if config.has_option('maaiveldkarakteristiek', 'max_cells'):
+            max_cells = int(config.get('maaiveldkarakteristiek', 'max_cells'))
         
         if landgebruik != '#':
             nbw_dict = {}
@@ -201,16 +213,27 @@ def main():
             nbw_grasland = int(config.get('maaiveldkarakteristiek', 'nbw_grasland'))
             grasland_procent = int(config.get('maaiveldkarakteristiek', 'grasland_procent'))
 
+        if zonal:
+            log.info(" - determining curves of all areas in one pass")
+            curves, curves_per_landuse = maaiveldcurve.main_zonal(peilgebieden_shp, gpgident, kaartbladen_prj, landgebruik, hoogtekaart, streefpeilen, maxpeil, conversion, workspace_shp, processes=processes, max_cells=max_cells)
+
         while row:
             gpg_value = row.getValue(gpgident)
             log.info(" - processing area %s" %  gpg_value)
-            gpg_lyr = turtlebase.arcgis.get_random_layer_name()
-            gp.MakeFeatureLayer_management(peilgebieden_shp, gpg_lyr, "%s = '%s'" % ('"' + gpgident + '"', gpg_value))
-            tmp_gpg = turtlebase.arcgis.get_random_file_name(workspace_shp, '.shp')
-            gp.Select_analysis(gpg_lyr, tmp_gpg)
-        
             streefpeil = float(streefpeilen[gpg_value])
-            curve, curve_per_landuse = maaiveldcurve.main(tmp_gpg, kaartbladen_prj, landgebruik, hoogtekaart, streefpeil, maxpeil, conversion, workspace_shp)
+            if zonal:
+                if not gpg_value in curves:
+                    log.warning(" - no height data for area %s" % gpg_value)
+                    row = rows.next()
+                    continue
+                curve, curve_per_landuse = curves[gpg_value], curves_per_landuse[gpg_value]
+            else:
+                gpg_lyr = turtlebase.arcgis.get_random_layer_name()
+                gp.MakeFeatureLayer_management(peilgebieden_shp, gpg_lyr, "%s = '%s'" % ('"' + gpgident + '"', gpg_value))
+                tmp_gpg = turtlebase.arcgis.get_random_file_name(workspace_shp, '.shp')
+                gp.Select_analysis(gpg_lyr, tmp_gpg)
+                curve, curve_per_landuse = maaiveldcurve.main(tmp_gpg, kaartbladen_prj, landgebruik, hoogtekaart, streefpeil, maxpeil, conversion, workspace_shp, processes=processes, max_cells=max_cells)
+                gp.delete(tmp_gpg)
             mvcurve_dict[gpg_value] = {gpgident: gpg_value}
             
             for i in mv_procent.split(', '):
@@ -248,7 +271,6 @@ def main():
                     nbw_dict[gpg_value]['DFLT_I_GR'] = NODATA
                     nbw_dict[gpg_value]['DFLT_O_GR'] = NODATA
                 
-            gp.delete(tmp_gpg)
             row = rows.next()
             
         if landgebruik != '#':
@@ -9,12 +9,19 @@ Compatible with Python versions 2.4-3.x
 
 __version__ = "1.2.0"
 
-from struct import pack, unpack, calcsize, error
+from struct import pack, unpack, unpack_from, calcsize, error
 import os
 import sys
 import time
 import array
+import hashlib
+import mmap
 import tempfile
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for the bulk (array based) methods.
+    numpy = None
 
 #
 # Constants for shape types
@@ -182,6 +189,496 @@ class _ShapeRecord:
         self.shape = shape
         self.record = record
 
+class _ShapeArrays:
+    """Columnar geometry of a whole shapefile. All vertices live in one
+    contiguous float64 array and every record is described by offsets into
+    it, so a file can be decoded without creating any per-vertex objects.
+
+    shapeTypes   -- int32 array with the shape type of each record
+    bboxes       -- float64 array (numRecords, 4), NaN for null shapes
+    points       -- float64 array (numPoints, 2) with all x,y values
+    z, m         -- float64 arrays (numPoints,) or None if not present
+    parts        -- int32 array with the start of every part as an index
+                    into points
+    partTypes    -- int32 array (multipatch only) or None
+    pointOffsets -- record i owns points[pointOffsets[i]:pointOffsets[i+1]]
+    partOffsets  -- record i owns parts[partOffsets[i]:partOffsets[i+1]]
+
+    Indexing or iterating returns regular _Shape objects whose points,
+    z and m values are views on the arrays above."""
+    def __init__(self, shapeTypes, bboxes, points, parts, pointOffsets,
+                 partOffsets, partTypes=None, z=None, m=None):
+        self.shapeTypes = shapeTypes
+        self.bboxes = bboxes
+        self.points = points
+        self.parts = parts
+        self.pointOffsets = pointOffsets
+        self.partOffsets = partOffsets
+        self.partTypes = partTypes
+        self.z = z
+        self.m = m
+
+    def __len__(self):
+        return len(self.shapeTypes)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("Shape index out of range.")
+        shapeType = int(self.shapeTypes[i])
+        shape = _Shape(shapeType)
+        start, end = self.pointOffsets[i], self.pointOffsets[i + 1]
+        shape.points = self.points[start:end]
+        if shapeType in (3,5,8,13,15,18,23,25,28,31):
+            shape.bbox = self.bboxes[i]
+        if shapeType in (3,5,13,15,23,25,31):
+            pstart, pend = self.partOffsets[i], self.partOffsets[i + 1]
+            shape.parts = _Array('i', (self.parts[pstart:pend] - start).tolist())
+            if shapeType == 31 and self.partTypes is not None:
+                shape.partTypes = _Array('i', self.partTypes[pstart:pend].tolist())
+        if self.z is not None and shapeType in (11,13,15,18,31):
+            shape.z = self.z[start:end]
+        if self.m is not None and shapeType in (11,13,15,18,21,23,25,28,31):
+            shape.m = self.m[start:end]
+        return shape
+
+def _typeMask(shapeTypes, types):
+    """Returns a boolean array telling which shapeTypes are in types."""
+    table = numpy.zeros(max(32, int(shapeTypes.max()) + 1), bool)
+    table[list(types)] = True
+    return table[shapeTypes]
+
+def _gather(raw, offsets, start, size, dtype):
+    """Fetches 'size' bytes at offset + start for every offset from the
+    uint8 array raw and reinterprets them as dtype. Positions past the
+    end of the buffer are clamped, the caller masks those records."""
+    index = numpy.minimum(offsets[:, None] + start + numpy.arange(size), len(raw) - 1)
+    return raw[index].view(dtype)
+
+def _headerBboxes(raw, offsets):
+    """Returns the shape types and the bounding boxes of the records at
+    the given offsets of the uint8 array raw, read from the record headers
+    only. Points get a zero size box, null shapes NaN."""
+    n = len(offsets)
+    shapeTypes = _gather(raw, offsets, 8, 4, '<i4').reshape(n).astype(numpy.int32)
+    bboxes = _gather(raw, offsets, 12, 32, '<f8').reshape(n, 4)
+    isPoint = _typeMask(shapeTypes, (1,11,21))
+    bboxes[isPoint, 2:] = bboxes[isPoint, :2]
+    bboxes[~(isPoint | _typeMask(shapeTypes, (3,5,8,13,15,18,23,25,28,31)))] = numpy.nan
+    return shapeTypes, bboxes
+
+def _shapeArrays(shp, offsets, readM=True):
+    """Decodes the shp records starting at the given byte offsets of the
+    buffer 'shp' (bytes, mmap or anything else numpy.frombuffer accepts)
+    into a _ShapeArrays object. Record headers are gathered in bulk and
+    every coordinate array is copied with a single numpy operation per
+    record instead of one unpack() per vertex. 'readM' follows the Reader
+    rule of only reading measures if the header measure range is set."""
+    if numpy is None:
+        raise ShapefileException("Reading shapes as arrays requires numpy.")
+    raw = numpy.frombuffer(shp, numpy.uint8)
+    offsets = numpy.asarray(offsets, dtype=numpy.int64)
+    n = len(offsets)
+    if n == 0:
+        return _ShapeArrays(numpy.zeros(0, numpy.int32),
+                            numpy.zeros((0, 4), numpy.float64),
+                            numpy.zeros((0, 2), numpy.float64),
+                            numpy.zeros(0, numpy.int32),
+                            numpy.zeros(1, numpy.int64),
+                            numpy.zeros(1, numpy.int64))
+    # Shape type, bbox and the part and point counts sit at fixed positions
+    # after the 8 byte record header, fetch them for all records at once.
+    shapeTypes, bboxes = _headerBboxes(raw, offsets)
+    counts = _gather(raw, offsets, 44, 8, '<i4').reshape(n, 2)
+    hasBox = _typeMask(shapeTypes, (3,5,8,13,15,18,23,25,28,31))
+    hasParts = _typeMask(shapeTypes, (3,5,13,15,23,25,31))
+    isMulti = _typeMask(shapeTypes, (8,18,28))
+    isPoint = _typeMask(shapeTypes, (1,11,21))
+    numParts = numpy.where(hasParts, counts[:, 0], 0)
+    numPoints = numpy.where(hasParts, counts[:, 1], 0)
+    numPoints[isMulti] = counts[isMulti, 0]
+    numPoints[isPoint] = 1
+    pointOffsets = numpy.zeros(n + 1, numpy.int64)
+    numpy.cumsum(numPoints, out=pointOffsets[1:])
+    partOffsets = numpy.zeros(n + 1, numpy.int64)
+    numpy.cumsum(numParts, out=partOffsets[1:])
+    points = numpy.empty((pointOffsets[-1], 2), numpy.float64)
+    parts = numpy.empty(partOffsets[-1], numpy.int32)
+    partTypes = z = m = None
+    if (shapeTypes == 31).any():
+        partTypes = numpy.zeros(partOffsets[-1], numpy.int32)
+    if _typeMask(shapeTypes, (11,13,15,18,31)).any():
+        z = numpy.empty(pointOffsets[-1], numpy.float64)
+        z.fill(numpy.nan)
+    if _typeMask(shapeTypes, (11,13,15,18,21,23,25,28,31)).any():
+        m = numpy.empty(pointOffsets[-1], numpy.float64)
+        m.fill(numpy.nan)
+    # Single points are fixed size records: gather them in one go.
+    if isPoint.any():
+        first = pointOffsets[:-1][isPoint]
+        points[first] = bboxes[isPoint, :2]
+        zm = _gather(raw, offsets[isPoint], 28, 16, '<f8')
+        pointZ = shapeTypes[isPoint] == 11
+        pointM = shapeTypes[isPoint] == 21
+        if z is not None:
+            z[first[pointZ]] = zm[pointZ, 0]
+        if m is not None:
+            m[first[pointZ]] = zm[pointZ, 1]
+            m[first[pointM]] = zm[pointM, 0]
+    # Multipoint and part based records, one bulk copy per array.
+    for i in numpy.flatnonzero(hasParts | isMulti):
+        shapeType = shapeTypes[i]
+        nParts = int(numParts[i])
+        nPoints = int(numPoints[i])
+        start = int(pointOffsets[i])
+        end = start + nPoints
+        pos = int(offsets[i]) + 48
+        if hasParts[i]:
+            pos += 4
+            parts[partOffsets[i]:partOffsets[i + 1]] = start + \
+                numpy.frombuffer(shp, '<i4', nParts, pos)
+            pos += 4 * nParts
+            if shapeType == 31:
+                partTypes[partOffsets[i]:partOffsets[i + 1]] = \
+                    numpy.frombuffer(shp, '<i4', nParts, pos)
+                pos += 4 * nParts
+        points[start:end] = numpy.frombuffer(shp, '<f8', 2 * nPoints, pos).reshape(nPoints, 2)
+        pos += 16 * nPoints
+        if shapeType in (13,15,18,31):
+            z[start:end] = numpy.frombuffer(shp, '<f8', nPoints, pos + 16)
+            pos += 16 + 8 * nPoints
+        if readM and shapeType in (13,15,18,23,25,28,31):
+            m[start:end] = numpy.frombuffer(shp, '<f8', nPoints, pos + 16)
+    if m is not None:
+        # Measure values less than -10e38 are nodata values according to the spec
+        m[m <= -10e38] = numpy.nan
+    return _ShapeArrays(shapeTypes, bboxes, points, parts, pointOffsets,
+                        partOffsets, partTypes, z, m)
+
+def _concatShapeArrays(chunks):
+    """Joins _ShapeArrays objects of consecutive record ranges into one,
+    shifting the part and point offsets of every chunk."""
+    chunks = [c for c in chunks if len(c)] or chunks[:1]
+    if len(chunks) == 1:
+        return chunks[0]
+    numPoints = [int(c.pointOffsets[-1]) for c in chunks]
+    numParts = [int(c.partOffsets[-1]) for c in chunks]
+    pointBase = numpy.cumsum([0] + numPoints[:-1])
+    partBase = numpy.cumsum([0] + numParts[:-1])
+    def optional(name, sizes, dtype, fill):
+        # z, m and partTypes are only present in chunks that contain them.
+        if not [c for c in chunks if getattr(c, name) is not None]:
+            return None
+        values = []
+        for c, size in zip(chunks, sizes):
+            value = getattr(c, name)
+            if value is None:
+                value = numpy.empty(size, dtype)
+                value.fill(fill)
+            values.append(value)
+        return numpy.concatenate(values)
+    return _ShapeArrays(
+        numpy.concatenate([c.shapeTypes for c in chunks]),
+        numpy.concatenate([c.bboxes for c in chunks]),
+        numpy.concatenate([c.points for c in chunks]),
+        numpy.concatenate([c.parts + base for c, base in
+                           zip(chunks, pointBase)]).astype(numpy.int32),
+        numpy.concatenate([chunks[0].pointOffsets[:1]] + [c.pointOffsets[1:] + base
+                          for c, base in zip(chunks, pointBase)]),
+        numpy.concatenate([chunks[0].partOffsets[:1]] + [c.partOffsets[1:] + base
+                          for c, base in zip(chunks, partBase)]),
+        optional('partTypes', numParts, numpy.int32, 0),
+        optional('z', numPoints, numpy.float64, numpy.nan),
+        optional('m', numPoints, numpy.float64, numpy.nan))
+
+def _shapeArraysChunk(args):
+    """Process pool worker: decodes the records at 'offsets' of the shp file
+    'shpName'. Only the byte range spanned by the chunk is read."""
+    shpName, offsets, end, readM = args
+    start = offsets[0]
+    f = open(shpName, "rb")
+    try:
+        f.seek(start)
+        buf = f.read(end - start)
+    finally:
+        f.close()
+    return _shapeArrays(buf, [offset - start for offset in offsets], readM)
+
+def _dbfColumn(values, fieldType, decimal):
+    """Converts a numpy array of raw fixed width dbf values of one field
+    to a typed array. Numbers become float64 with NULLs (blanks or an
+    overflow marker) as NaN, integer fields without NULLs become int64.
+    Dates and logicals are returned as stripped byte strings and text as
+    stripped strings."""
+    # Trailing nul bytes are already dropped by numpy's bytes type.
+    values = numpy.char.strip(values)
+    if fieldType in ('N', 'F'):
+        valid = (values != b('')) & (numpy.char.find(values, b('*')) < 0)
+        column = numpy.empty(len(values), numpy.float64)
+        column.fill(numpy.nan)
+        try:
+            column[valid] = values[valid].astype(numpy.float64)
+        except ValueError:
+            # Fall back to one by one conversion for malformed values.
+            for i in numpy.flatnonzero(valid):
+                try:
+                    column[i] = float(values[i])
+                except ValueError:
+                    pass
+        if not decimal and valid.all():
+            column = column.astype(numpy.int64)
+        return column
+    elif fieldType in ('D', 'L'):
+        return values
+    elif PYTHON3:
+        return numpy.char.decode(values, 'utf-8')
+    return values
+
+def _scatterWords(out, base, offsets, words):
+    """Copies the rows of the uint32 array words (one row per element)
+    into out, element k of record i going to word base[i] + width *
+    (k - offsets[i]). Elements of a record are stored back to back."""
+    total, width = words.shape
+    counts = numpy.diff(offsets)
+    pos = numpy.repeat(base - width * offsets[:-1], counts) + width * numpy.arange(total)
+    out[pos[:, None] + numpy.arange(width)] = words
+
+def _words(values, columns):
+    """Returns values as little endian float64 or int32 data split into
+    rows of 'columns' 4 byte words."""
+    return numpy.ascontiguousarray(values).view(numpy.uint32).reshape(-1, columns)
+
+def _shpPayload(shapeType, xy, pointOffsets, parts, partOffsets, z, m, firstRecNum):
+    """Encodes many shp records of the same type at once. xy, z and m hold
+    the vertices of all records, record i owns xy[pointOffsets[i]:
+    pointOffsets[i+1]] and its parts start at the (global) indices
+    parts[partOffsets[i]:partOffsets[i+1]]. Every record is laid out
+    exactly like Writer.__shpRecord() does and all fields are 4 byte
+    aligned, so the records are assembled in one uint32 buffer with a few
+    scatter operations. Returns the payload, the byte offset of every
+    record within it, the content lengths (16-bit words) and the bbox,
+    z and m extremes of the batch."""
+    n = len(pointOffsets) - 1
+    numPoints = numpy.diff(pointOffsets)
+    if (numPoints < 1).any():
+        raise ShapefileException("Every shape needs at least one point.")
+    hasZ = shapeType in (11,13,15,18)
+    hasM = shapeType in (11,13,15,18,21,23,25,28)
+    zRange = [float(z.min()), float(z.max())]
+    mRange = [min(0.0, float(m.min())), max(0.0, float(m.max()))]
+    bbox = [float(xy[:, 0].min()), float(xy[:, 1].min()),
+            float(xy[:, 0].max()), float(xy[:, 1].max())]
+    recNums = numpy.arange(firstRecNum, firstRecNum + n)
+    if shapeType in (1,11,21):
+        fmt = [('recNum', '>i4'), ('length', '>i4'), ('shapeType', '<i4'),
+               ('x', '<f8'), ('y', '<f8')]
+        if hasZ:
+            fmt.append(('z', '<f8'))
+        if hasM:
+            fmt.append(('m', '<f8'))
+        records = numpy.zeros(n, fmt)
+        records['recNum'] = recNums
+        records['length'] = (records.dtype.itemsize - 8) // 2
+        records['shapeType'] = shapeType
+        records['x'] = xy[:, 0]
+        records['y'] = xy[:, 1]
+        if hasZ:
+            records['z'] = z
+        if hasM:
+            records['m'] = m
+        starts = numpy.arange(n, dtype=numpy.int64) * records.dtype.itemsize
+        return (records.tobytes(), starts, records['length'].astype(numpy.int64),
+                bbox, zRange, mRange)
+    hasParts = shapeType in (3,5,13,15,23,25)
+    head = [('recNum', '>i4'), ('length', '>i4'), ('shapeType', '<i4'),
+            ('bbox', '<f8', (4,))]
+    if hasParts:
+        head.append(('numParts', '<i4'))
+        numParts = numpy.diff(partOffsets)
+    else:
+        numParts = numpy.zeros(n, numpy.int64)
+    head.append(('numPoints', '<i4'))
+    headers = numpy.zeros(n, head)
+    headWords = headers.dtype.itemsize // 4
+    # Record sizes and positions in 4 byte words.
+    sizes = headWords + numParts + 4 * numPoints
+    if hasZ:
+        sizes += 4 + 2 * numPoints
+    if hasM:
+        sizes += 4 + 2 * numPoints
+    starts = numpy.zeros(n, numpy.int64)
+    numpy.cumsum(sizes[:-1], out=starts[1:])
+    first = pointOffsets[:-1]
+    headers['recNum'] = recNums
+    headers['length'] = 2 * sizes - 4
+    headers['shapeType'] = shapeType
+    headers['bbox'] = numpy.column_stack([
+        numpy.minimum.reduceat(xy[:, 0], first), numpy.minimum.reduceat(xy[:, 1], first),
+        numpy.maximum.reduceat(xy[:, 0], first), numpy.maximum.reduceat(xy[:, 1], first)])
+    if hasParts:
+        headers['numParts'] = numParts
+    headers['numPoints'] = numPoints
+    out = numpy.zeros(int(sizes.sum()), numpy.uint32)
+    out[starts[:, None] + numpy.arange(headWords)] = _words(headers, headWords)
+    base = starts + headWords
+    if hasParts:
+        local = parts - numpy.repeat(first, numParts)
+        _scatterWords(out, base, partOffsets, _words(local.astype('<i4'), 1))
+    base = base + numParts
+    _scatterWords(out, base, pointOffsets, _words(xy, 4))
+    base = base + 4 * numPoints
+    for values, present, low in ((z, hasZ, False), (m, hasM, True)):
+        if not present:
+            continue
+        # Per record extremes; measure extremes include 0 like __mbox().
+        extremes = numpy.column_stack([numpy.minimum.reduceat(values, first),
+                                       numpy.maximum.reduceat(values, first)])
+        if low:
+            extremes[:, 0] = numpy.minimum(extremes[:, 0], 0)
+            extremes[:, 1] = numpy.maximum(extremes[:, 1], 0)
+        out[base[:, None] + numpy.arange(4)] = _words(extremes, 4)
+        _scatterWords(out, base + 4, pointOffsets, _words(values, 2))
+        base = base + 4 + 2 * numPoints
+    return (out.tobytes(), 4 * starts, headers['length'].astype(numpy.int64),
+            bbox, zRange, mRange)
+
+def _dbfText(values, fieldType, size):
+    """Formats a column of values as fixed width dbf field bytes the same
+    way Writer.record() formats single values."""
+    values = numpy.asarray(values)
+    if values.dtype.kind in 'biu':
+        text = values.astype(str)
+    elif values.dtype.kind in 'SU':
+        text = values
+    else:
+        # Floats too: str() of a float differs from the repr numpy uses.
+        text = numpy.array([str(v) for v in values.tolist()], dtype=str)
+    if text.dtype.kind == 'U':
+        text = numpy.char.encode(text, 'utf-8')
+    fieldType = fieldType.upper()
+    if fieldType == "N":
+        if len(text) and numpy.char.str_len(text).max() > size:
+            raise ShapefileException("Numeric value too wide for a field of size %s." % size)
+        return numpy.char.rjust(text, size)
+    elif fieldType == "L":
+        text = numpy.char.upper(text.astype('S1'))
+    return numpy.char.ljust(text.astype('S%d' % size), size)
+
+class _SpatialIndex:
+    """A packed R-tree over the bounding boxes of the records of a
+    shapefile, built bottom up with the Sort-Tile-Recursive algorithm.
+    Every level is a flat list of boxes and the children of node j are
+    the entries j * nodeSize up to (j + 1) * nodeSize of the level below,
+    so the tree needs no pointers and can be saved as a sidecar file.
+    Null shapes are not indexed."""
+    MAGIC = b('SHPRTREE')
+    VERSION = 2
+
+    def __init__(self, nodeSize=16):
+        self.nodeSize = nodeSize
+        # levels[0] holds the record boxes, the last level the root.
+        self.levels = []
+        self.ids = []
+        self.numRecords = 0
+        # The stamp of the files the index was built from, see
+        # Reader.spatialIndex().
+        self.shpLength = 0
+        self.shpMtime = 0.0
+        self.shxMtime = 0.0
+        self.shxDigest = b('\0' * 16)
+
+    def build(self, bboxes):
+        """Builds the tree from a list with one (xmin, ymin, xmax, ymax)
+        tuple or None per record."""
+        self.numRecords = len(bboxes)
+        items = [(tuple(box), i) for i, box in enumerate(bboxes) if box is not None]
+        items = self.__pack(items)
+        self.ids = [i for box, i in items]
+        self.levels = [[box for box, i in items]]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            nodes = []
+            for j in xrange(0, len(level), self.nodeSize):
+                children = level[j:j + self.nodeSize]
+                nodes.append((min([c[0] for c in children]),
+                              min([c[1] for c in children]),
+                              max([c[2] for c in children]),
+                              max([c[3] for c in children])))
+            self.levels.append(nodes)
+        return self
+
+    def __pack(self, items):
+        """Orders the items into vertical slices sorted on x which are then
+        sorted on y, so that consecutive runs of nodeSize are compact."""
+        numLeaves = -(-len(items) // self.nodeSize)
+        numSlices = int(numLeaves ** 0.5) + 1
+        sliceSize = numSlices * self.nodeSize
+        items.sort(key=lambda item: item[0][0] + item[0][2])
+        packed = []
+        for j in xrange(0, len(items), sliceSize):
+            part = items[j:j + sliceSize]
+            part.sort(key=lambda item: item[0][1] + item[0][3])
+            packed.extend(part)
+        return packed
+
+    def query(self, bbox):
+        """Returns the sorted record indexes whose bounding box
+        intersects bbox (xmin, ymin, xmax, ymax)."""
+        if not self.levels or not self.levels[0]:
+            return []
+        xmin, ymin, xmax, ymax = bbox
+        candidates = [0]
+        for depth in xrange(len(self.levels) - 1, -1, -1):
+            level = self.levels[depth]
+            matches = [j for j in candidates
+                       if level[j][0] <= xmax and level[j][2] >= xmin and
+                          level[j][1] <= ymax and level[j][3] >= ymin]
+            if depth == 0:
+                break
+            size = len(self.levels[depth - 1])
+            candidates = []
+            for j in matches:
+                candidates.extend(xrange(j * self.nodeSize,
+                                         min((j + 1) * self.nodeSize, size)))
+        result = [self.ids[j] for j in matches]
+        result.sort()
+        return result
+
+    def save(self, f):
+        """Writes the index to the binary file object f."""
+        f.write(self.MAGIC)
+        f.write(pack("<5i", self.VERSION, self.nodeSize, self.numRecords,
+                     self.shpLength, len(self.levels)))
+        f.write(pack("<2d16s", self.shpMtime, self.shxMtime, self.shxDigest))
+        for level in self.levels:
+            f.write(pack("<i", len(level)))
+            for box in level:
+                f.write(pack("<4d", *box))
+        f.write(pack("<%si" % len(self.ids), *self.ids))
+
+    def load(self, f):
+        """Reads an index written by save() from the binary file object f."""
+        if f.read(len(self.MAGIC)) != self.MAGIC:
+            raise ShapefileException("Not a shapefile spatial index.")
+        (version, self.nodeSize, self.numRecords, self.shpLength,
+         numLevels) = unpack("<5i", f.read(20))
+        if version != self.VERSION:
+            raise ShapefileException("Unsupported spatial index version %s." % version)
+        (self.shpMtime, self.shxMtime, self.shxDigest) = unpack("<2d16s", f.read(32))
+        self.levels = []
+        for k in xrange(numLevels):
+            size = unpack("<i", f.read(4))[0]
+            flat = unpack("<%sd" % (4 * size), f.read(32 * size))
+            self.levels.append([flat[j:j + 4] for j in xrange(0, 4 * size, 4)])
+        size = len(self.levels[0])
+        self.ids = list(unpack("<%si" % size, f.read(4 * size)))
+        return self
+
 class ShapefileException(Exception):
     """An exception to handle shapefile specific problems."""
     pass
@@ -203,6 +700,12 @@ class Reader:
     within each file is only accessed when required and as
     efficiently as possible. Shapefiles are usually not large
     but they can be.
+
+    Pass mmap=True to memory map the files instead of reading
+    them through file objects. Records are then decoded straight
+    from the mapped buffers, so random access by index does not
+    cost a seek and a read and very large files can be scanned
+    without loading them into memory.
     """
     def __init__(self, *args, **kwargs):
         self.shp = None
@@ -210,10 +713,13 @@ class Reader:
         self.dbf = None
         self.shapeName = "Not specified"
         self._offsets = []
+        self._mapped = kwargs.get("mmap", False)
+        self._index = None
         self.shpLength = None
         self.numRecords = None
         self.fields = []
         self.__dbfHdrLength = 0
+        self.__recFmt = None
         # See if a shapefile name was passed as an argument
         if len(args) > 0:
             if is_string(args[0]):
@@ -259,11 +765,37 @@ class Reader:
                 self.dbf = open("%s.dbf" % shapeName, "rb")
             except IOError:
                 raise ShapefileException("Unable to open %s.dbf" % shapeName)
+        if self._mapped:
+            # Only close the files we opened ourselves.
+            self.shp = self.__map(self.shp, shapefile)
+            self.shx = self.__map(self.shx, shapefile)
+            self.dbf = self.__map(self.dbf, shapefile)
         if self.shp:
             self.__shpHeader()
         if self.dbf:
             self.__dbfHeader()
 
+    def __map(self, f, close=False):
+        """Returns a read-only memory map of the file object f, optionally
+        closing f as the map stays valid without it. Objects that can't be
+        mapped (no real file, an empty one, or one too large for the address
+        space of a 32-bit Python) are returned unchanged."""
+        if not f or isinstance(f, mmap.mmap):
+            return f
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, EnvironmentError, ValueError, OverflowError):
+            return f
+        if close:
+            f.close()
+        return m
+
+    def close(self):
+        """Closes the underlying files or memory maps."""
+        for f in (self.shp, self.shx, self.dbf):
+            if hasattr(f, "close"):
+                f.close()
+
     def __getFileObj(self, f):
         """Checks to see if the requested shapefile file object is
         available. If not a ShapefileException is raised."""
@@ -306,61 +838,80 @@ class Reader:
     def __shape(self):
         """Returns the header info and geometry for a single shape."""
         f = self.__getFileObj(self.shp)
-        record = _Shape()
-        nParts = nPoints = zmin = zmax = mmin = mmax = None
         (recNum, recLength) = unpack(">2i", f.read(8))
         # Determine the start of the next record
         next = f.tell() + (2 * recLength)
-        shapeType = unpack("<i", f.read(4))[0]
+        record = self.__shapeFromBuffer(f.read(2 * recLength), 0)
+        # Seek to the end of this record as defined by the record header because
+        # the shapefile spec doesn't require the actual content to meet the header
+        # definition.  Probably allowed for lazy feature deletion. 
+        f.seek(next)
+        return record
+
+    def __shapeFromBuffer(self, buf, pos):
+        """Decodes the geometry of a single shape from the buffer buf, where
+        pos is the start of the record content (just after the record
+        header). Works on strings and memory maps alike."""
+        record = _Shape()
+        nParts = nPoints = zmin = zmax = mmin = mmax = None
+        shapeType = unpack_from("<i", buf, pos)[0]
+        pos += 4
         record.shapeType = shapeType
         # For Null shapes create an empty points list for consistency
         if shapeType == 0:
             record.points = []
         # All shape types capable of having a bounding box
         elif shapeType in (3,5,8,13,15,18,23,25,28,31):
-            record.bbox = _Array('d', unpack("<4d", f.read(32)))
+            record.bbox = _Array('d', unpack_from("<4d", buf, pos))
+            pos += 32
         # Shape types with parts
         if shapeType in (3,5,13,15,23,25,31):
-            nParts = unpack("<i", f.read(4))[0]
+            nParts = unpack_from("<i", buf, pos)[0]
+            pos += 4
         # Shape types with points
-        if shapeType in (3,5,8,13,15,23,25,31):
-            nPoints = unpack("<i", f.read(4))[0]
+        if shapeType in (3,5,8,13,15,18,23,25,28,31):
+            nPoints = unpack_from("<i", buf, pos)[0]
+            pos += 4
         # Read parts
         if nParts:
-            record.parts = _Array('i', unpack("<%si" % nParts, f.read(nParts * 4)))
+            record.parts = _Array('i', unpack_from("<%si" % nParts, buf, pos))
+            pos += nParts * 4
         # Read part types for Multipatch - 31
         if shapeType == 31:
-            record.partTypes = _Array('i', unpack("<%si" % nParts, f.read(nParts * 4)))
+            record.partTypes = _Array('i', unpack_from("<%si" % nParts, buf, pos))
+            pos += nParts * 4
         # Read points - produces a list of [x,y] values
         if nPoints:
-            record.points = [_Array('d', unpack("<2d", f.read(16))) for p in range(nPoints)]
+            xy = unpack_from("<%sd" % (2 * nPoints), buf, pos)
+            record.points = [_Array('d', xy[p:p + 2]) for p in xrange(0, 2 * nPoints, 2)]
+            pos += nPoints * 16
         # Read z extremes and values
         if shapeType in (13,15,18,31):
-            (zmin, zmax) = unpack("<2d", f.read(16))
-            record.z = _Array('d', unpack("<%sd" % nPoints, f.read(nPoints * 8)))
+            (zmin, zmax) = unpack_from("<2d", buf, pos)
+            record.z = _Array('d', unpack_from("<%sd" % nPoints, buf, pos + 16))
+            pos += 16 + nPoints * 8
         # Read m extremes and values if header m values do not equal 0.0
         if shapeType in (13,15,18,23,25,28,31) and not 0.0 in self.measure:
-            (mmin, mmax) = unpack("<2d", f.read(16))
+            (mmin, mmax) = unpack_from("<2d", buf, pos)
             # Measure values less than -10e38 are nodata values according to the spec
             record.m = []
-            for m in _Array('d', unpack("<%sd" % nPoints, f.read(nPoints * 8))):
+            for m in unpack_from("<%sd" % nPoints, buf, pos + 16):
                 if m > -10e38:
                     record.m.append(m)
                 else:
                     record.m.append(None)
+            pos += 16 + nPoints * 8
         # Read a single point
         if shapeType in (1,11,21):
-            record.points = [_Array('d', unpack("<2d", f.read(16)))]
+            record.points = [_Array('d', unpack_from("<2d", buf, pos))]
+            pos += 16
         # Read a single Z value
         if shapeType == 11:
-            record.z = unpack("<d", f.read(8))
+            record.z = unpack_from("<d", buf, pos)
+            pos += 8
         # Read a single M value
         if shapeType in (11,21):
-            record.m = unpack("<d", f.read(8))
-        # Seek to the end of this record as defined by the record header because
-        # the shapefile spec doesn't require the actual content to meet the header
-        # definition.  Probably allowed for lazy feature deletion. 
-        f.seek(next)
+            record.m = unpack_from("<d", buf, pos)
         return record
 
     def __shapeIndex(self, i=None):
@@ -374,12 +925,15 @@ class Reader:
             shx.seek(24)
             shxRecordLength = (unpack(">i", shx.read(4))[0] * 2) - 100
             numRecords = shxRecordLength // 8
-            # Jump to the first record.
-            shx.seek(100)
-            for r in range(numRecords):
-                # Offsets are 16-bit words just like the file length
-                self._offsets.append(unpack(">i", shx.read(4))[0] * 2)
-                shx.seek(shx.tell() + 4)
+            # Offsets are 16-bit words just like the file length. Read the
+            # whole index at once and skip the content lengths.
+            fmt = ">%si" % (2 * numRecords)
+            if isinstance(shx, mmap.mmap):
+                index = unpack_from(fmt, shx, 100)
+            else:
+                shx.seek(100)
+                index = unpack(fmt, shx.read(8 * numRecords))
+            self._offsets = [o * 2 for o in index[::2]]
         if not i == None:
             return self._offsets[i]
 
@@ -394,6 +948,8 @@ class Reader:
             for j,k in enumerate(self.iterShapes()):
                 if j == i:
                     return k
+        if isinstance(shp, mmap.mmap):
+            return self.__shapeFromBuffer(shp, offset + 8)
         shp.seek(offset)
         return self.__shape()
 
@@ -406,22 +962,235 @@ class Reader:
         # and figure it out.
         shp.seek(0,2)
         self.shpLength = shp.tell()
+        if isinstance(shp, mmap.mmap):
+            return list(self.iterShapes())
         shp.seek(100)
         shapes = []
         while shp.tell() < self.shpLength:
             shapes.append(self.__shape())
         return shapes
 
-    def iterShapes(self):
+    def iterShapes(self, bbox=None):
         """Serves up shapes in a shapefile as an iterator. Useful
-        for handling large shapefiles."""
+        for handling large shapefiles. If bbox (xmin, ymin, xmax, ymax)
+        is given only the shapes whose bounding box intersects it are
+        read, using the spatial index."""
         shp = self.__getFileObj(self.shp)
+        if bbox is not None:
+            offsets = self.__recordOffsets()
+            for i in self.spatialIndex().query(bbox):
+                yield self.__shapeAt(offsets[i])
+            return
         shp.seek(0,2)
         self.shpLength = shp.tell()
+        if isinstance(shp, mmap.mmap):
+            pos = 100
+            while pos + 8 <= self.shpLength:
+                recLength = unpack_from(">i", shp, pos + 4)[0]
+                yield self.__shapeFromBuffer(shp, pos + 8)
+                pos += 8 + 2 * recLength
+            return
         shp.seek(100)
         while shp.tell() < self.shpLength:
             yield self.__shape()    
 
+    def __recordOffsets(self):
+        """Returns the offsets of all records in the shp file. The .shx
+        index is used when available, otherwise the record headers are
+        walked once."""
+        self.__shapeIndex()
+        if self._offsets:
+            return self._offsets
+        shp = self.__getFileObj(self.shp)
+        shp.seek(0, 2)
+        end = shp.tell()
+        pos = 100
+        while pos + 8 <= end:
+            self._offsets.append(pos)
+            shp.seek(pos + 4)
+            pos += 8 + 2 * unpack(">i", shp.read(4))[0]
+        return self._offsets
+
+    def __shapeAt(self, offset):
+        """Returns the shape of the record at the given shp offset."""
+        shp = self.__getFileObj(self.shp)
+        if isinstance(shp, mmap.mmap):
+            return self.__shapeFromBuffer(shp, offset + 8)
+        shp.seek(offset)
+        return self.__shape()
+
+    def recordBboxes(self):
+        """Returns a float64 array (numRecords, 4) with the bounding box
+        (xmin, ymin, xmax, ymax) of every record. Only the type and bbox
+        at the start of each record are read, using the shx offsets, so no
+        geometry is decoded. Points get a zero size box, null shapes NaN.
+        Requires numpy."""
+        if numpy is None:
+            raise ShapefileException("recordBboxes() requires numpy.")
+        shp = self.__getFileObj(self.shp)
+        offsets = numpy.asarray(self.__recordOffsets(), numpy.int64)
+        if isinstance(shp, mmap.mmap):
+            raw = numpy.frombuffer(shp, numpy.uint8)
+        else:
+            # Read the 44 byte record start of every record into one buffer.
+            heads = []
+            for offset in offsets:
+                shp.seek(offset)
+                heads.append(shp.read(44).ljust(44, b('\0')))
+            raw = numpy.frombuffer(b('').join(heads), numpy.uint8)
+            offsets = numpy.arange(len(offsets), dtype=numpy.int64) * 44
+        if not len(offsets):
+            return numpy.zeros((0, 4), numpy.float64)
+        return _headerBboxes(raw, offsets)[1]
+
+    def __recordBboxes(self):
+        """Returns the bounding box of every record as a tuple, or None
+        for null shapes."""
+        bboxes = []
+        if numpy is not None:
+            for box in self.recordBboxes().tolist():
+                if numpy.isnan(box[0]):
+                    bboxes.append(None)
+                else:
+                    bboxes.append(tuple(box))
+            return bboxes
+        shp = self.__getFileObj(self.shp)
+        for offset in self.__recordOffsets():
+            shp.seek(offset + 8)
+            head = shp.read(36)
+            shapeType = unpack_from("<i", head)[0]
+            if shapeType in (3,5,8,13,15,18,23,25,28,31):
+                bboxes.append(unpack_from("<4d", head, 4))
+            elif shapeType in (1,11,21):
+                x, y = unpack_from("<2d", head, 4)
+                bboxes.append((x, y, x, y))
+            else:
+                bboxes.append(None)
+        return bboxes
+
+    def __fileStamp(self):
+        """Returns the modification times of the shp and shx files and the
+        md5 digest of the shx file, which change when the shapefile is
+        rewritten even if its size stays the same."""
+        shpName = "%s.shp" % self.shapeName
+        shxName = "%s.shx" % self.shapeName
+        shpMtime = os.path.getmtime(shpName)
+        if not os.path.isfile(shxName):
+            return shpMtime, 0.0, b('\0' * 16)
+        f = open(shxName, "rb")
+        try:
+            shxDigest = hashlib.md5(f.read()).digest()
+        finally:
+            f.close()
+        return shpMtime, os.path.getmtime(shxName), shxDigest
+
+    def spatialIndex(self, sidecar=False):
+        """Returns a packed R-tree (_SpatialIndex) over the bounding boxes
+        of all records. It is built once per Reader. With sidecar=True it
+        is read from, or written to, a <shapefile>.sidx file next to the
+        shapefile; a sidecar whose shp length, record count, file times or
+        shx digest don't match the shapefile is rebuilt. Readers of file
+        objects have no shapefile name and never use a sidecar."""
+        if self._index is not None:
+            return self._index
+        shp = self.__getFileObj(self.shp)
+        shp.seek(0, 2)
+        shpLength = shp.tell()
+        sidecar = sidecar and os.path.isfile("%s.shp" % self.shapeName)
+        if sidecar:
+            sidecarName = "%s.sidx" % self.shapeName
+            stamp = self.__fileStamp()
+        if sidecar and os.path.isfile(sidecarName):
+            f = open(sidecarName, "rb")
+            try:
+                try:
+                    index = _SpatialIndex().load(f)
+                except (ShapefileException, error):
+                    index = None
+            finally:
+                f.close()
+            if index and index.shpLength == shpLength and \
+               index.numRecords == len(self.__recordOffsets()) and \
+               (index.shpMtime, index.shxMtime, index.shxDigest) == stamp:
+                self._index = index
+                return index
+        index = _SpatialIndex().build(self.__recordBboxes())
+        index.shpLength = shpLength
+        if sidecar:
+            (index.shpMtime, index.shxMtime, index.shxDigest) = stamp
+            f = open(sidecarName, "wb")
+            try:
+                index.save(f)
+            finally:
+                f.close()
+        self._index = index
+        return index
+
+    def shapeArrays(self):
+        """Returns all shapes in a shapefile as a _ShapeArrays object:
+        one contiguous float64 coordinate array plus part and record offset
+        arrays. Vertices are decoded in bulk, which is a lot faster than
+        shapes() for large files. The object can still be indexed and
+        iterated as a list of shapes. Requires numpy."""
+        if numpy is None:
+            raise ShapefileException("shapeArrays() requires numpy.")
+        shp = self.__getFileObj(self.shp)
+        if isinstance(shp, mmap.mmap):
+            buf = shp
+        else:
+            shp.seek(0)
+            buf = shp.read()
+        return _shapeArrays(buf, self.__recordOffsets(), not 0.0 in self.measure)
+
+    def parallelShapeArrays(self, processes=None, chunks=None):
+        """Same result as shapeArrays(), but the records are split into
+        chunks of about equal byte size which are decoded in a pool of
+        'processes' worker processes (default: one per cpu). 'chunks'
+        defaults to four per process so slow chunks even out. Every worker
+        reads only its own byte range of the shp file and the chunks are
+        joined again in record order. Needs a Reader opened from a file
+        name; file-like objects and single process runs fall back to
+        shapeArrays(). Requires numpy."""
+        if numpy is None:
+            raise ShapefileException("parallelShapeArrays() requires numpy.")
+        try:
+            import multiprocessing
+        except ImportError:
+            multiprocessing = None
+        shpName = "%s.shp" % self.shapeName
+        offsets = numpy.asarray(self.__recordOffsets(), numpy.int64)
+        if multiprocessing is None or not os.path.isfile(shpName):
+            return self.shapeArrays()
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if chunks is None:
+            chunks = 4 * processes
+        chunks = min(chunks, len(offsets))
+        if processes < 2 or chunks < 2:
+            return self.shapeArrays()
+        shp = self.__getFileObj(self.shp)
+        shp.seek(0, 2)
+        end = shp.tell()
+        # Split on byte position, not record count, so chunks with a few
+        # huge polygons cost about as much as chunks with many small ones.
+        bounds = numpy.searchsorted(offsets, numpy.linspace(offsets[0], end, chunks + 1))
+        bounds = numpy.unique(numpy.concatenate([[0], bounds[1:-1], [len(offsets)]]))
+        readM = not 0.0 in self.measure
+        tasks = []
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            if last < len(offsets):
+                chunkEnd = int(offsets[last])
+            else:
+                chunkEnd = end
+            tasks.append((shpName, offsets[first:last].tolist(), chunkEnd, readM))
+        pool = multiprocessing.Pool(min(processes, len(tasks)))
+        try:
+            results = pool.map(_shapeArraysChunk, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        return _concatShapeArrays(results)
+
     def __dbfHeaderLength(self):
         """Retrieves the header length of a dbf file header."""
         if not self.__dbfHdrLength:
@@ -458,17 +1227,23 @@ class Reader:
 
     def __recordFmt(self):
         """Calculates the size of a .shp geometry record."""
+        if self.__recFmt:
+            return self.__recFmt
         if not self.numRecords:
             self.__dbfHeader()
         fmt = ''.join(['%ds' % fieldinfo[2] for fieldinfo in self.fields])
         fmtSize = calcsize(fmt)
-        return (fmt, fmtSize)
+        self.__recFmt = (fmt, fmtSize)
+        return self.__recFmt
 
     def __record(self):
         """Reads and returns a dbf record row as a list of values."""
         f = self.__getFileObj(self.dbf)
-        recFmt = self.__recordFmt()
-        recordContents = unpack(recFmt[0], f.read(recFmt[1]))
+        return self.__recordFromBuffer(f.read(self.__recordFmt()[1]), 0)
+
+    def __recordFromBuffer(self, buf, pos):
+        """Decodes the dbf record row starting at pos in the buffer buf."""
+        recordContents = unpack_from(self.__recordFmt()[0], buf, pos)
         if recordContents[0] != b(' '):
             # deleted record
             return None
@@ -510,16 +1285,70 @@ class Reader:
             self.__dbfHeader()
         i = self.__restrictIndex(i)
         recSize = self.__recordFmt()[1]
+        if isinstance(f, mmap.mmap):
+            return self.__recordFromBuffer(f, self.__dbfHeaderLength() + (i * recSize))
         f.seek(0)
         f.seek(self.__dbfHeaderLength() + (i * recSize))
         return self.__record()
 
+    def recordColumns(self, fields=None):
+        """Returns the dbf records as a numpy structured array with one
+        typed column per field, see _dbfColumn for the conversions.
+        Only the fields named in 'fields' (case insensitive, all fields by
+        default) are decoded, the other columns of the fixed width rows
+        are never touched. Deleted records are skipped like in records().
+        Requires numpy."""
+        if numpy is None:
+            raise ShapefileException("recordColumns() requires numpy.")
+        f = self.__getFileObj(self.dbf)
+        if not self.numRecords:
+            self.__dbfHeader()
+        recSize = self.__recordFmt()[1]
+        if isinstance(f, mmap.mmap):
+            buf = f
+            start = self.__dbfHeaderLength()
+        else:
+            f.seek(self.__dbfHeaderLength())
+            buf = f.read(recSize * self.numRecords)
+            start = 0
+        # Field positions within a row, the deletion flag comes first.
+        positions = {}
+        pos = 0
+        for field in self.fields:
+            positions[field[0].upper()] = (pos, field)
+            pos += field[2]
+        if fields is None:
+            fields = [field[0] for field in self.fields[1:]]
+        requested = []
+        for name in fields:
+            if name.upper() not in positions:
+                raise ShapefileException("Field %s not found in the dbf file." % name)
+            requested.append(positions[name.upper()])
+        # View the table as an array of rows that holds the requested
+        # fields only, this does not copy anything.
+        layout = numpy.dtype({
+            'names': ['f%s' % i for i in range(len(requested) + 1)],
+            'formats': ['S1'] + ['S%s' % field[2] for pos, field in requested],
+            'offsets': [0] + [pos for pos, field in requested],
+            'itemsize': recSize})
+        rows = numpy.frombuffer(buf, layout, self.numRecords, start)
+        rows = rows[rows['f0'] == b(' ')]
+        columns = [_dbfColumn(rows['f%s' % (i + 1)], field[1], field[3])
+                   for i, (pos, field) in enumerate(requested)]
+        result = numpy.empty(len(rows), [(str(field[0]), column.dtype)
+                                         for (pos, field), column in zip(requested, columns)])
+        for (pos, field), column in zip(requested, columns):
+            result[field[0]] = column
+        return result
+
     def records(self):
         """Returns all records in a dbf file."""
         if not self.numRecords:
             self.__dbfHeader()
-        records = []
         f = self.__getFileObj(self.dbf)
+        if isinstance(f, mmap.mmap):
+            return list(self.iterRecords())
+        records = []
         f.seek(self.__dbfHeaderLength())
         for i in range(self.numRecords):
             r = self.__record()
@@ -533,6 +1362,15 @@ class Reader:
         if not self.numRecords:
             self.__dbfHeader()
         f = self.__getFileObj(self.dbf)
+        if isinstance(f, mmap.mmap):
+            pos = self.__dbfHeaderLength()
+            recSize = self.__recordFmt()[1]
+            for i in xrange(self.numRecords):
+                r = self.__recordFromBuffer(f, pos)
+                pos += recSize
+                if r:
+                    yield r
+            return
         f.seek(self.__dbfHeaderLength())
         for i in xrange(self.numRecords):
             r = self.__record()
@@ -552,9 +1390,37 @@ class Reader:
         return [_ShapeRecord(shape=rec[0], record=rec[1]) \
                                 for rec in zip(self.shapes(), self.records())]
 
+    def iterShapeRecords(self, bbox=None):
+        """Serves up combination geometry/attribute records as an
+        iterator. If bbox (xmin, ymin, xmax, ymax) is given only the
+        records whose bounding box intersects it are read, using the
+        spatial index."""
+        if bbox is None:
+            records = self.iterRecords()
+            for shape in self.iterShapes():
+                yield _ShapeRecord(shape=shape, record=next(records))
+            return
+        offsets = self.__recordOffsets()
+        for i in self.spatialIndex().query(bbox):
+            yield _ShapeRecord(shape=self.__shapeAt(offsets[i]), record=self.record(i))
+
 class Writer:
-    """Provides write support for ESRI Shapefiles."""
-    def __init__(self, shapeType=None):
+    """Provides write support for ESRI Shapefiles.
+
+    By default shapes and records are kept in memory until save() is
+    called. If a target file name is passed the Writer streams instead:
+    every shape and record is written to the shp, shx and dbf files as
+    soon as it is added and close() patches the headers (bounding box,
+    file lengths and record count). Memory use then stays flat no matter
+    how many shapes are written. Fields must be defined before the first
+    record is added in this mode and shapes() stays empty.
+
+    With append=True an existing shapefile at target is extended in place:
+    new shp records, shx entries and dbf rows go to the end of the files
+    and close() only rewrites the headers. The shape type and fields of
+    the existing file are used.
+    """
+    def __init__(self, shapeType=None, target=None, append=False):
         self._shapes = []
         self.fields = []
         self.records = []
@@ -567,6 +1433,79 @@ class Writer:
         self._lengths = []
         # Use deletion flags in dbf? Default is false (0).
         self.deletionFlag = 0
+        # Streaming state: shape and record counts and the running extents.
+        self._stream = False
+        self._append = False
+        if target and append and os.path.isfile(os.path.splitext(target)[0] + '.shp'):
+            self.__openAppend(target)
+        elif target:
+            self.__openStream(target)
+
+    def __openStream(self, target):
+        """Opens the three files for streaming and reserves their headers."""
+        base = os.path.splitext(target)[0]
+        self._stream = True
+        self._numShapes = 0
+        self._numRecords = 0
+        self._shpLength = 100
+        self._bbox = None
+        self._zbox = None
+        self._mbox = [0, 0]
+        self._dbfHeaderWritten = False
+        self.shp = self.__getFileObj(base + '.shp')
+        self.shx = self.__getFileObj(base + '.shx')
+        self.dbf = self.__getFileObj(base + '.dbf')
+        self.shp.write(b('\0') * 100)
+        self.shx.write(b('\0') * 100)
+
+    def __openAppend(self, target):
+        """Opens the three files of an existing shapefile for appending and
+        takes over its shape type, extents, counts and fields."""
+        base = os.path.splitext(target)[0]
+        try:
+            self.shp = open(base + '.shp', 'r+b')
+            self.shx = open(base + '.shx', 'r+b')
+            self.dbf = open(base + '.dbf', 'r+b')
+        except IOError:
+            raise ShapefileException("Unable to open %s for appending." % base)
+        self._stream = True
+        self._append = True
+        header = self.shp.read(100)
+        # The file length in the header can't be trusted, new records go
+        # after the real end of the file.
+        self.shp.seek(0, 2)
+        shpLength = self.shp.tell()
+        self.shapeType = unpack("<i", header[32:36])[0]
+        self.shx.seek(0, 2)
+        self._numShapes = (self.shx.tell() - 100) // 8
+        self._shpLength = shpLength
+        if self._numShapes:
+            self._bbox = list(unpack("<4d", header[36:68]))
+            self._zbox = list(unpack("<2d", header[68:84]))
+        else:
+            self._bbox = None
+            self._zbox = None
+        self._mbox = list(unpack("<2d", header[84:100]))
+        self.shp.seek(shpLength)
+        self.shx.seek(100 + 8 * self._numShapes)
+        # The dbf layout is fixed: take the fields from the header and
+        # continue after the last record, over the optional EOF marker.
+        numRecords, headerLength, recordLength = unpack("<xxxxLHH", self.dbf.read(12))
+        self.fields = []
+        self.dbf.seek(32)
+        for i in range((headerLength - 33) // 32):
+            fieldDesc = self.dbf.read(32)
+            if fieldDesc[:1] == b('\r'):
+                break
+            name, fieldType, size, decimal = unpack("<11sc4xBB14x", fieldDesc)
+            name = u(name[:name.find(b('\0'))]) if b('\0') in name else u(name)
+            self.fields.append((name.lstrip(), u(fieldType), size, decimal))
+        self._numRecords = numRecords
+        self._dbfHeaderWritten = True
+        end = headerLength + numRecords * recordLength
+        self.dbf.seek(end)
+        self._dbfEof = self.dbf.read(1) == b('\x1a')
+        self.dbf.seek(end)
 
     def __getFileObj(self, f):
         """Safety handler to verify file-like objects"""
@@ -582,6 +1521,8 @@ class Writer:
 
     def __shpFileLength(self):
         """Calculates the file length of the shp file."""
+        if self._stream:
+            return self._shpLength // 2
         # Start with header length
         size = 100
         # Calculate size of all shapes
@@ -672,18 +1613,42 @@ class Writer:
                 pass
         return [min(m), max(m)]
 
+    def __growBox(self, box, new):
+        """Returns the box (lower values first) that covers both boxes."""
+        if box is None:
+            return new
+        half = len(box) // 2
+        return [min(a, b) for a, b in zip(box[:half], new[:half])] + \
+               [max(a, b) for a, b in zip(box[half:], new[half:])]
+
+    def __updateExtents(self, s):
+        """Adds the shape to the running extents of a streaming Writer."""
+        if not s.points:
+            return
+        self._bbox = self.__growBox(self._bbox, self.__bbox([s]))
+        z = [p[2] for p in s.points if len(p) > 2]
+        if z:
+            self._zbox = self.__growBox(self._zbox, [min(z), max(z)])
+        self._mbox = self.__growBox(self._mbox, self.__mbox([s]))
+
     def bbox(self):
         """Returns the current bounding box for the shapefile which is
         the lower-left and upper-right corners. It does not contain the
         elevation or measure extremes."""
+        if self._stream:
+            return self._bbox or [0, 0, 0, 0]
         return self.__bbox(self._shapes)
 
     def zbox(self):
         """Returns the current z extremes for the shapefile."""
+        if self._stream:
+            return self._zbox or [0, 0]
         return self.__zbox(self._shapes)
 
     def mbox(self):
         """Returns the current m extremes for the shapefile."""
+        if self._stream:
+            return self._mbox
         return self.__mbox(self._shapes)
 
     def __shapefileHeader(self, fileObj, headerType='shp'):
@@ -698,7 +1663,11 @@ class Writer:
         if headerType == 'shp':
             f.write(pack(">i", self.__shpFileLength()))
         elif headerType == 'shx':
-            f.write(pack('>i', ((100 + (len(self._shapes) * 8)) // 2)))
+            if self._stream:
+                numShapes = self._numShapes
+            else:
+                numShapes = len(self._shapes)
+            f.write(pack('>i', ((100 + (numShapes * 8)) // 2)))
         # Version, Shape type
         f.write(pack("<2i", 1000, self.shapeType))
         # The shapefile's bounding box (lower left, upper right)
@@ -729,7 +1698,10 @@ class Writer:
         for field in self.fields:
             if field[0].startswith("Deletion"):
                 self.fields.remove(field)
-        numRecs = len(self.records)
+        if self._stream:
+            numRecs = self._numRecords
+        else:
+            numRecs = len(self.records)
         numFields = len(self.fields)
         headerLength = numFields * 32 + 33
         recordLength = sum([int(field[2]) for field in self.fields]) + 1
@@ -755,115 +1727,122 @@ class Writer:
         f.seek(100)
         recNum = 1
         for s in self._shapes:
-            self._offsets.append(f.tell())
-            # Record number, Content length place holder
-            f.write(pack(">2i", recNum, 0))
+            offset, length = self.__shpRecord(f, s, recNum)
+            self._offsets.append(offset)
+            self._lengths.append(length)
             recNum += 1
-            start = f.tell()
-            # Shape Type
-            if self.shapeType != 31:
-                s.shapeType = self.shapeType
-            f.write(pack("<i", s.shapeType))
-            # All shape types capable of having a bounding box
-            if s.shapeType in (3,5,8,13,15,18,23,25,28,31):
-                try:
-                    f.write(pack("<4d", *self.__bbox([s])))
-                except error:
-                    raise ShapefileException("Falied to write bounding box for record %s. Expected floats." % recNum)
-            # Shape types with parts
-            if s.shapeType in (3,5,13,15,23,25,31):
-                # Number of parts
-                f.write(pack("<i", len(s.parts)))
-            # Shape types with multiple points per record
-            if s.shapeType in (3,5,8,13,15,23,25,31):
-                # Number of points
-                f.write(pack("<i", len(s.points)))
-            # Write part indexes
-            if s.shapeType in (3,5,13,15,23,25,31):
-                for p in s.parts:
-                    f.write(pack("<i", p))
-            # Part types for Multipatch (31)
-            if s.shapeType == 31:
-                for pt in s.partTypes:
-                    f.write(pack("<i", pt))
-            # Write points for multiple-point records
-            if s.shapeType in (3,5,8,13,15,23,25,31):
-                try:
-                    [f.write(pack("<2d", *p[:2])) for p in s.points]
-                except error:
-                    raise ShapefileException("Failed to write points for record %s. Expected floats." % recNum)
-            # Write z extremes and values
-            if s.shapeType in (13,15,18,31):
-                try:
-                    f.write(pack("<2d", *self.__zbox([s])))
-                except error:
-                    raise ShapefileException("Failed to write elevation extremes for record %s. Expected floats." % recNum)
+
+    def __shpRecord(self, f, s, recNum):
+        """Writes a single shp record at the current position of f and
+        returns its offset and content length (in 16-bit words)."""
+        offset = f.tell()
+        # Record number, Content length place holder
+        f.write(pack(">2i", recNum, 0))
+        start = f.tell()
+        # Shape Type
+        if self.shapeType != 31:
+            s.shapeType = self.shapeType
+        f.write(pack("<i", s.shapeType))
+        # All shape types capable of having a bounding box
+        if s.shapeType in (3,5,8,13,15,18,23,25,28,31):
+            try:
+                f.write(pack("<4d", *self.__bbox([s])))
+            except error:
+                raise ShapefileException("Falied to write bounding box for record %s. Expected floats." % recNum)
+        # Shape types with parts
+        if s.shapeType in (3,5,13,15,23,25,31):
+            # Number of parts
+            f.write(pack("<i", len(s.parts)))
+        # Shape types with multiple points per record
+        if s.shapeType in (3,5,8,13,15,23,25,31):
+            # Number of points
+            f.write(pack("<i", len(s.points)))
+        # Write part indexes
+        if s.shapeType in (3,5,13,15,23,25,31):
+            for p in s.parts:
+                f.write(pack("<i", p))
+        # Part types for Multipatch (31)
+        if s.shapeType == 31:
+            for pt in s.partTypes:
+                f.write(pack("<i", pt))
+        # Write points for multiple-point records
+        if s.shapeType in (3,5,8,13,15,23,25,31):
+            try:
+                [f.write(pack("<2d", *p[:2])) for p in s.points]
+            except error:
+                raise ShapefileException("Failed to write points for record %s. Expected floats." % recNum)
+        # Write z extremes and values
+        if s.shapeType in (13,15,18,31):
+            try:
+                f.write(pack("<2d", *self.__zbox([s])))
+            except error:
+                raise ShapefileException("Failed to write elevation extremes for record %s. Expected floats." % recNum)
+            try:
+                if hasattr(s,"z"):
+                    f.write(pack("<%sd" % len(s.z), *s.z))
+                else:
+                    [f.write(pack("<d", p[2])) for p in s.points]  
+            except error:
+                raise ShapefileException("Failed to write elevation values for record %s. Expected floats." % recNum)
+        # Write m extremes and values
+        if s.shapeType in (13,15,18,23,25,28,31):
+            try:
+                if hasattr(s,"m"):
+                    f.write(pack("<%sd" % len(s.m), *s.m))
+                else:
+                    f.write(pack("<2d", *self.__mbox([s])))
+            except error:
+                raise ShapefileException("Failed to write measure extremes for record %s. Expected floats" % recNum)
+            try:
+                [f.write(pack("<d", p[3])) for p in s.points]
+            except error:
+                raise ShapefileException("Failed to write measure values for record %s. Expected floats" % recNum)
+        # Write a single point
+        if s.shapeType in (1,11,21):
+            try:
+                f.write(pack("<2d", s.points[0][0], s.points[0][1]))
+            except error:
+                raise ShapefileException("Failed to write point for record %s. Expected floats." % recNum)
+        # Write a single Z value
+        if s.shapeType == 11:
+            if hasattr(s, "z"):
                 try:
-                    if hasattr(s,"z"):
-                        f.write(pack("<%sd" % len(s.z), *s.z))
-                    else:
-                        [f.write(pack("<d", p[2])) for p in s.points]  
+                    if not s.z:
+                        s.z = (0,)    
+                    f.write(pack("<d", s.z[0]))
                 except error:
-                    raise ShapefileException("Failed to write elevation values for record %s. Expected floats." % recNum)
-            # Write m extremes and values
-            if s.shapeType in (13,15,18,23,25,28,31):
+                    raise ShapefileException("Failed to write elevation value for record %s. Expected floats." % recNum)
+            else:
                 try:
-                    if hasattr(s,"m"):
-                        f.write(pack("<%sd" % len(s.m), *s.m))
-                    else:
-                        f.write(pack("<2d", *self.__mbox([s])))
+                    if len(s.points[0])<3:
+                        s.points[0].append(0)
+                    f.write(pack("<d", s.points[0][2]))
                 except error:
-                    raise ShapefileException("Failed to write measure extremes for record %s. Expected floats" % recNum)
+                    raise ShapefileException("Failed to write elevation value for record %s. Expected floats." % recNum)
+        # Write a single M value
+        if s.shapeType in (11,21):
+            if hasattr(s, "m"):
                 try:
-                    [f.write(pack("<d", p[3])) for p in s.points]
+                    if not s.m:
+                        s.m = (0,) 
+                    f.write(pack("<1d", s.m[0]))
                 except error:
-                    raise ShapefileException("Failed to write measure values for record %s. Expected floats" % recNum)
-            # Write a single point
-            if s.shapeType in (1,11,21):
+                    raise ShapefileException("Failed to write measure value for record %s. Expected floats." % recNum)    
+            else:                                
                 try:
-                    f.write(pack("<2d", s.points[0][0], s.points[0][1]))
+                    if len(s.points[0])<4:
+                        s.points[0].append(0)
+                    f.write(pack("<1d", s.points[0][3]))
                 except error:
-                    raise ShapefileException("Failed to write point for record %s. Expected floats." % recNum)
-            # Write a single Z value
-            if s.shapeType == 11:
-                if hasattr(s, "z"):
-                    try:
-                        if not s.z:
-                            s.z = (0,)    
-                        f.write(pack("<d", s.z[0]))
-                    except error:
-                        raise ShapefileException("Failed to write elevation value for record %s. Expected floats." % recNum)
-                else:
-                    try:
-                        if len(s.points[0])<3:
-                            s.points[0].append(0)
-                        f.write(pack("<d", s.points[0][2]))
-                    except error:
-                        raise ShapefileException("Failed to write elevation value for record %s. Expected floats." % recNum)
-            # Write a single M value
-            if s.shapeType in (11,21):
-                if hasattr(s, "m"):
-                    try:
-                        if not s.m:
-                            s.m = (0,) 
-                        f.write(pack("<1d", s.m[0]))
-                    except error:
-                        raise ShapefileException("Failed to write measure value for record %s. Expected floats." % recNum)    
-                else:                                
-                    try:
-                        if len(s.points[0])<4:
-                            s.points[0].append(0)
-                        f.write(pack("<1d", s.points[0][3]))
-                    except error:
-                        raise ShapefileException("Failed to write measure value for record %s. Expected floats." % recNum)
-            # Finalize record length as 16-bit words
-            finish = f.tell()
-            length = (finish - start) // 2
-            self._lengths.append(length)
-            # start - 4 bytes is the content length field
-            f.seek(start-4)
-            f.write(pack(">i", length))
-            f.seek(finish)
+                    raise ShapefileException("Failed to write measure value for record %s. Expected floats." % recNum)
+        # Finalize record length as 16-bit words
+        finish = f.tell()
+        length = (finish - start) // 2
+        # start - 4 bytes is the content length field
+        f.seek(start-4)
+        f.write(pack(">i", length))
+        f.seek(finish)
+        return offset, length
 
     def __shxRecords(self):
         """Writes the shx records."""
@@ -877,30 +1856,113 @@ class Writer:
         """Writes the dbf records."""
         f = self.__getFileObj(self.dbf)
         for record in self.records:
-            if not self.fields[0][0].startswith("Deletion"):
-                f.write(b(' ')) # deletion flag
-            for (fieldName, fieldType, size, dec), value in zip(self.fields, record):
-                fieldType = fieldType.upper()
-                size = int(size)
-                if fieldType.upper() == "N":
-                    value = str(value).rjust(size)
-                elif fieldType == 'L':
-                    value = str(value)[0].upper()
-                else:
-                    value = str(value)[:size].ljust(size)
-                assert len(value) == size
-                value = b(value)
-                f.write(value)
+            self.__dbfRecord(f, record)
+
+    def __dbfRecord(self, f, record):
+        """Writes a single dbf record at the current position of f."""
+        if not self.fields[0][0].startswith("Deletion"):
+            f.write(b(' ')) # deletion flag
+        for (fieldName, fieldType, size, dec), value in zip(self.fields, record):
+            fieldType = fieldType.upper()
+            size = int(size)
+            if fieldType.upper() == "N":
+                value = str(value).rjust(size)
+            elif fieldType == 'L':
+                value = str(value)[0].upper()
+            else:
+                value = str(value)[:size].ljust(size)
+            assert len(value) == size
+            value = b(value)
+            f.write(value)
+
+    def _addShape(self, s):
+        """Keeps the shape for save() or, when streaming, writes it."""
+        if not self._stream:
+            self._shapes.append(s)
+            return
+        if not self.shapeType:
+            self.shapeType = s.shapeType
+        self._numShapes += 1
+        offset, length = self.__shpRecord(self.shp, s, self._numShapes)
+        self.shx.write(pack(">2i", offset // 2, length))
+        self._shpLength = offset + 8 + 2 * length
+        self.__updateExtents(s)
+
+    def _addRecord(self, record):
+        """Keeps the record for save() or, when streaming, writes it."""
+        if not self._stream:
+            self.records.append(record)
+            return
+        if not self._dbfHeaderWritten:
+            self.__dbfHeader()
+            self._dbfHeaderWritten = True
+        self._numRecords += 1
+        self.__dbfRecord(self.dbf, record)
+
+    def __addShapes(self, shapeType, xy, pointOffsets, parts=None,
+                    partOffsets=None, z=None, m=None):
+        """Writes a batch of shapes given as arrays to a streaming Writer."""
+        if not self.shapeType:
+            self.shapeType = shapeType
+        if self.shapeType == 31:
+            raise ShapefileException("Multipatch shapes can't be added from arrays.")
+        n = len(pointOffsets) - 1
+        if n < 1:
+            return
+        if self.shapeType in (1,11,21) and (numpy.diff(pointOffsets) != 1).any():
+            raise ShapefileException("Point shapes have exactly one point.")
+        if parts is None:
+            parts = pointOffsets[:-1]
+            partOffsets = numpy.arange(n + 1)
+        payload, starts, lengths, bbox, zRange, mRange = _shpPayload(
+            self.shapeType, xy, pointOffsets, parts, partOffsets, z, m,
+            self._numShapes + 1)
+        index = numpy.empty((n, 2), '>i4')
+        index[:, 0] = (self._shpLength + starts) // 2
+        index[:, 1] = lengths
+        self.shp.write(payload)
+        self.shx.write(index.tobytes())
+        self._numShapes += n
+        self._shpLength += len(payload)
+        self._bbox = self.__growBox(self._bbox, bbox)
+        self._zbox = self.__growBox(self._zbox, zRange)
+        self._mbox = self.__growBox(self._mbox, mRange)
+
+    def close(self):
+        """Finishes a streaming Writer: patches the shp, shx and dbf
+        headers with the final extents, lengths and record count and
+        closes the files."""
+        if not self._stream:
+            return
+        if not self.shapeType:
+            self.shapeType = NULL
+        self.__shapefileHeader(self.shp, headerType='shp')
+        self.__shapefileHeader(self.shx, headerType='shx')
+        if self._append:
+            # Keep the existing field descriptors, only update the date and
+            # the record count and restore the EOF marker.
+            if self._dbfEof:
+                self.dbf.write(b('\x1a'))
+            year, month, day = time.localtime()[:3]
+            self.dbf.seek(1)
+            self.dbf.write(pack('<BBBL', year - 1900, month, day, self._numRecords))
+        else:
+            self.__dbfHeader()
+        self._dbfHeaderWritten = True
+        for f in (self.shp, self.shx, self.dbf):
+            f.close()
+        self._stream = False
+        self._append = False
 
     def null(self):
         """Creates a null shape."""
-        self._shapes.append(_Shape(NULL))
+        self._addShape(_Shape(NULL))
 
     def point(self, x, y, z=0, m=0):
         """Creates a point shape."""
         pointShape = _Shape(self.shapeType)
         pointShape.points.append([x, y, z, m])
-        self._shapes.append(pointShape)
+        self._addShape(pointShape)
 
     def line(self, parts=[], shapeType=POLYLINE):
         """Creates a line shape. This method is just a convienience method
@@ -937,7 +1999,73 @@ class Writer:
                 for part in parts:
                     partTypes.append(polyShape.shapeType)
             polyShape.partTypes = partTypes
-        self._shapes.append(polyShape)
+        self._addShape(polyShape)
+
+    def points(self, xy, z=None, m=None):
+        """Creates a point shape for every row of the (n, 2) array xy,
+        with optional z and m arrays of length n. A streaming Writer
+        encodes all records with a few numpy operations and writes them
+        with a single write per file. Requires numpy."""
+        if numpy is None:
+            raise ShapefileException("points() requires numpy.")
+        xy = numpy.ascontiguousarray(xy, '<f8').reshape(-1, 2)
+        n = len(xy)
+        z = self.__column(z, n)
+        m = self.__column(m, n)
+        if not self._stream:
+            for (x, y), zValue, mValue in zip(xy.tolist(), z.tolist(), m.tolist()):
+                self.point(x, y, zValue, mValue)
+            return
+        self.__addShapes(self.shapeType or POINT, xy, numpy.arange(n + 1), z=z, m=m)
+
+    def lines(self, xy, pointOffsets, parts=None, partOffsets=None, z=None,
+              m=None, shapeType=POLYLINE):
+        """Creates line shapes from arrays, see polys()."""
+        self.polys(xy, pointOffsets, parts, partOffsets, z, m, shapeType)
+
+    def polys(self, xy, pointOffsets, parts=None, partOffsets=None, z=None,
+              m=None, shapeType=POLYGON):
+        """Creates shapes from arrays laid out like _ShapeArrays: shape i
+        owns the vertices xy[pointOffsets[i]:pointOffsets[i+1]] and its
+        parts start at the indices (into xy) parts[partOffsets[i]:
+        partOffsets[i+1]]. Without parts every shape has a single part.
+        z and m are optional per vertex arrays. Unlike poly() the rings
+        are written as given, so polygons must already be closed.
+        A streaming Writer encodes all records with a few numpy
+        operations and writes them with a single write per file.
+        Requires numpy."""
+        if numpy is None:
+            raise ShapefileException("polys() requires numpy.")
+        xy = numpy.ascontiguousarray(xy, '<f8').reshape(-1, 2)
+        pointOffsets = numpy.asarray(pointOffsets, numpy.int64)
+        if parts is not None:
+            parts = numpy.asarray(parts, numpy.int64)
+            partOffsets = numpy.asarray(partOffsets, numpy.int64)
+        z = self.__column(z, len(xy))
+        m = self.__column(m, len(xy))
+        if self._stream:
+            self.__addShapes(shapeType, xy, pointOffsets, parts, partOffsets, z, m)
+            return
+        points = numpy.column_stack([xy, z, m]).tolist()
+        for i in xrange(len(pointOffsets) - 1):
+            start, end = int(pointOffsets[i]), int(pointOffsets[i + 1])
+            shape = _Shape(shapeType)
+            shape.points = points[start:end]
+            if parts is None:
+                shape.parts = [0]
+            else:
+                shape.parts = (parts[partOffsets[i]:partOffsets[i + 1]] - start).tolist()
+            self._addShape(shape)
+
+    def __column(self, values, n):
+        """Returns values as a little endian float64 array of length n,
+        zeros if values is None."""
+        if values is None:
+            return numpy.zeros(n, '<f8')
+        values = numpy.ascontiguousarray(values, '<f8').reshape(-1)
+        if len(values) != n:
+            raise ShapefileException("Expected %s values, got %s." % (n, len(values)))
+        return values
 
     def field(self, name, fieldType="C", size="50", decimal=0):
         """Adds a dbf field descriptor to the shapefile."""
@@ -966,7 +2094,39 @@ class Writer:
                     else:
                         record.append(val)
         if record:
-            self.records.append(record)
+            self._addRecord(record)
+
+    def recordColumns(self, columns):
+        """Creates dbf attribute records from columns: a sequence of arrays
+        in field order, or a dict or numpy structured array (as returned by
+        Reader.recordColumns()) keyed by field name. Values are formatted
+        like record() does. A streaming Writer builds all rows in one
+        fixed width buffer and writes it at once. Requires numpy."""
+        if numpy is None:
+            raise ShapefileException("recordColumns() requires numpy.")
+        fields = [field for field in self.fields if not field[0].startswith("Deletion")]
+        if isinstance(columns, dict) or getattr(getattr(columns, "dtype", None), "names", None):
+            columns = [columns[field[0]] for field in fields]
+        columns = [numpy.asarray(column) for column in columns[:len(fields)]]
+        if len(columns) < len(fields):
+            raise ShapefileException("Expected %s columns, got %s." % (len(fields), len(columns)))
+        n = len(columns[0])
+        if [column for column in columns if len(column) != n]:
+            raise ShapefileException("All columns must have the same length.")
+        if not self._stream:
+            for row in zip(*[column.tolist() for column in columns]):
+                self._addRecord(list(row))
+            return
+        if not self._dbfHeaderWritten:
+            self.__dbfHeader()
+            self._dbfHeaderWritten = True
+        rows = numpy.zeros(n, [('deleted', 'S1')] + [('f%s' % i, 'S%s' % int(field[2]))
+                                                      for i, field in enumerate(fields)])
+        rows['deleted'] = b(' ')
+        for i, (field, column) in enumerate(zip(fields, columns)):
+            rows['f%s' % i] = _dbfText(column, field[1], int(field[2]))
+        self.dbf.write(rows.tobytes())
+        self._numRecords += n
 
     def shape(self, i):
         return self._shapes[i]
@@ -1010,8 +2170,11 @@ class Writer:
         If target is specified but not shp,shx, or dbf then the target path and
         file name are used.  If no options or specified, a unique base file name
         is generated to save the files and the base file name is returned as a 
-        string. 
+        string. A streaming Writer ignores the arguments and is closed.
         """
+        if self._stream:
+            self.close()
+            return
         # Create a unique file name if one is not defined
         if shp:
             self.saveShp(shp)
@@ -1034,13 +2197,21 @@ class Writer:
             if generated:
                 return target
 class Editor(Writer):
-    def __init__(self, shapefile=None, shapeType=POINT, autoBalance=1):
+    """Edits an existing shapefile. By default the whole shapefile is
+    loaded and save() writes it again. With append=True nothing is loaded:
+    new shapes and records are written to the end of the existing files
+    right away and save() (or close()) only updates the headers, so the
+    cost depends on the number of added features instead of the file size.
+    Existing shapes can't be changed or deleted in that mode."""
+    def __init__(self, shapefile=None, shapeType=POINT, autoBalance=1, append=False):
         self.autoBalance = autoBalance
         if not shapefile:
             Writer.__init__(self, shapeType)
         elif is_string(shapefile):
             base = os.path.splitext(shapefile)[0]
-            if os.path.isfile("%s.shp" % base):
+            if append and os.path.isfile("%s.shp" % base):
+                Writer.__init__(self, shapeType, target=base, append=True)
+            elif os.path.isfile("%s.shp" % base):
                 r = Reader(base)
                 Writer.__init__(self, r.shapeType)
                 self._shapes = r.shapes()
@@ -1124,7 +2295,7 @@ class Editor(Writer):
             shape, part, point = addr
             self._shapes[shape][part][point] = [x, y, z, m]
         else:
-            Writer.point(self, x, y, z, m)
+            Writer.point(self, x, y, z or 0, m or 0)
         if self.autoBalance:
             self.balance()
 
@@ -1138,9 +2309,13 @@ class Editor(Writer):
         """Adds a corresponding empty attribute or null geometry record depending
         on which type of record was created to make sure all three files
         are in synch."""
-        if len(self.records) > len(self._shapes):
+        if self._stream:
+            numRecords, numShapes = self._numRecords, self._numShapes
+        else:
+            numRecords, numShapes = len(self.records), len(self._shapes)
+        if numRecords > numShapes:
             self.null()
-        elif len(self.records) < len(self._shapes):
+        elif numRecords < numShapes:
             self.record()
 
     def __fieldNorm(self, fieldName):
@@ -0,0 +1,360 @@
+# (c) Nelen & Schuurmans. GPL licensed, see LICENSE.txt
+# -*- coding: utf-8 -*-
+"""Read and write throughput benchmark for shapefile.py.
+
+Generates synthetic polder datasets (peilgebied polygons, waterline
+polylines and point clouds with dbf attributes) at several scales, times
+the Reader, Writer and Editor operations on them and prints one JSON
+line per measurement:
+
+    python shapefile_benchmark.py --scales 1,10 --repeat 3 -o bench.jsonl
+
+Every line holds the git revision, the dataset, the operation, the best
+time of the repeats, records/s, vertices/s, MB/s (file size over time)
+and the peak memory of the operation. The data only depends on the seed
+and the scale, so runs on different commits can be compared line by
+line.
+"""
+
+import gc
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+import numpy
+
+import shapefile
+
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Bytes per unit of ru_maxrss: kilobytes, but bytes on Mac OS X.
+MAXRSS_UNIT = sys.platform == 'darwin' and 1 or 1024
+# Number of features per dataset at scale 1.
+BASE_COUNTS = {'peilgebied': 200, 'waterline': 2000, 'point': 20000}
+
+
+def git_revision():
+    """Returns the current commit of the repository, or None."""
+    try:
+        out = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'],
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+    except OSError:
+        return None
+    return out.decode('ascii').strip() or None
+
+
+def peilgebieden(count, rng):
+    """Returns closed polygons on a grid of polder cells of 1 km, each with
+    a wobbly boundary of 50 to 400 vertices (some with a hole)."""
+    side = int(math.ceil(math.sqrt(count)))
+    polygons = []
+    for i in range(count):
+        cx = 100000 + 1000 * (i % side) + 500
+        cy = 400000 + 1000 * (i // side) + 500
+        n = rng.randint(50, 400)
+        ring = []
+        for k in range(n):
+            angle = -2 * math.pi * k / n
+            radius = 450 + rng.uniform(-40, 40)
+            ring.append([cx + radius * math.cos(angle), cy + radius * math.sin(angle)])
+        ring.append(list(ring[0]))
+        parts = [ring]
+        if rng.random() < 0.2:
+            hole = [[cx + 50 * math.cos(2 * math.pi * k / 12),
+                     cy + 50 * math.sin(2 * math.pi * k / 12)] for k in range(12)]
+            hole.append(list(hole[0]))
+            parts.append(hole)
+        polygons.append(parts)
+    return polygons
+
+
+def waterlines(count, rng, extent):
+    """Returns polylines as random walks of 20 to 200 vertices."""
+    lines = []
+    for i in range(count):
+        x = rng.uniform(extent[0], extent[2])
+        y = rng.uniform(extent[1], extent[3])
+        heading = rng.uniform(0, 2 * math.pi)
+        line = []
+        for k in range(rng.randint(20, 200)):
+            line.append([x, y])
+            heading += rng.uniform(-0.3, 0.3)
+            x += 10 * math.cos(heading)
+            y += 10 * math.sin(heading)
+        lines.append([line])
+    return lines
+
+
+def points(count, rng, extent):
+    """Returns uniformly spread points."""
+    return [[[[rng.uniform(extent[0], extent[2]), rng.uniform(extent[1], extent[3])]]]
+            for i in range(count)]
+
+
+def attributes(count, rng):
+    """Returns dbf rows (GPGIDENT, NAME, PEIL, TYPE) for count features."""
+    return [('GPG%06d' % i, 'peilgebied %d' % i, round(rng.uniform(-6, 2), 2),
+             rng.randint(1, 4)) for i in range(count)]
+
+
+def datasets(scale, seed):
+    """Yields (name, shape type, shapes, rows) for the given scale."""
+    rng = random.Random(seed)
+    polygons = peilgebieden(BASE_COUNTS['peilgebied'] * scale, rng)
+    side = int(math.ceil(math.sqrt(len(polygons))))
+    extent = (100000, 400000, 100000 + 1000 * side, 400000 + 1000 * side)
+    lines = waterlines(BASE_COUNTS['waterline'] * scale, rng, extent)
+    cloud = points(BASE_COUNTS['point'] * scale, rng, extent)
+    for name, shapeType, shapes in (('peilgebied', shapefile.POLYGON, polygons),
+                                    ('waterline', shapefile.POLYLINE, lines),
+                                    ('point', shapefile.POINT, cloud)):
+        yield name, shapeType, shapes, attributes(len(shapes), rng)
+
+
+def add_fields(w):
+    w.field('GPGIDENT', 'C', 24)
+    w.field('NAME', 'C', 50)
+    w.field('PEIL', 'N', 12, 2)
+    w.field('TYPE', 'N', 4, 0)
+
+
+def as_arrays(shapes):
+    """Returns the shapes as xy, point offsets, parts and part offsets."""
+    xy, pointOffsets, parts, partOffsets = [], [0], [], [0]
+    for shape in shapes:
+        for part in shape:
+            parts.append(len(xy))
+            xy.extend(part)
+        pointOffsets.append(len(xy))
+        partOffsets.append(len(parts))
+    return (numpy.array(xy, numpy.float64), numpy.array(pointOffsets),
+            numpy.array(parts), numpy.array(partOffsets))
+
+
+def write_features(base, shapeType, shapes, rows):
+    w = shapefile.Writer(shapeType, target=base)
+    add_fields(w)
+    for shape, row in zip(shapes, rows):
+        if shapeType == shapefile.POINT:
+            w.point(*shape[0][0])
+        else:
+            w.poly([[list(p) for p in part] for part in shape], shapeType=shapeType)
+        w.record(*row)
+    w.close()
+
+
+def write_arrays(base, shapeType, arrays, columns):
+    w = shapefile.Writer(shapeType, target=base)
+    add_fields(w)
+    xy, pointOffsets, parts, partOffsets = arrays
+    if shapeType == shapefile.POINT:
+        w.points(xy)
+    else:
+        w.polys(xy, pointOffsets, parts, partOffsets, shapeType=shapeType)
+    w.recordColumns(columns)
+    w.close()
+
+
+def append_features(base, shapeType, shapes, rows):
+    e = shapefile.Editor(base, append=True)
+    for shape, row in zip(shapes, rows):
+        if shapeType == shapefile.POINT:
+            e.point(*shape[0][0])
+        else:
+            e.poly([[list(p) for p in part] for part in shape], shapeType=shapeType)
+        e.record(*row)
+    e.close()
+
+
+def read_with(base, method, **kwargs):
+    r = shapefile.Reader(base, mmap=kwargs.pop('mmap', False))
+    try:
+        result = getattr(r, method)(**kwargs)
+        if method.startswith('iter'):
+            result = sum(1 for item in result)
+    finally:
+        r.close()
+    return result
+
+
+def window_counts(base, bbox):
+    """Returns the number of records that iterShapes(bbox=bbox) serves
+    and their number of vertices."""
+    r = shapefile.Reader(base)
+    try:
+        shapes = list(r.iterShapes(bbox=bbox))
+    finally:
+        r.close()
+    return len(shapes), sum(len(shape.points) for shape in shapes)
+
+
+def peak_memory(func):
+    """Returns how many bytes the peak resident memory grows while func
+    runs. It is measured with ru_maxrss in a forked child process, which
+    starts at the current memory of this process, so the peaks of earlier
+    operations don't hide it. Without fork (Windows) it is the growth of
+    the peak working set of this process according to psutil, which only
+    counts what func needs beyond earlier peaks. None if neither works."""
+    if hasattr(os, 'fork') and resource is not None:
+        readEnd, writeEnd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.close(readEnd)
+                gc.collect()
+                before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                func()
+                after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                os.write(writeEnd, str(after - before).encode('ascii'))
+            finally:
+                os._exit(0)
+        os.close(writeEnd)
+        out = []
+        while True:
+            chunk = os.read(readEnd, 64)
+            if not chunk:
+                break
+            out.append(chunk)
+        os.close(readEnd)
+        os.waitpid(pid, 0)
+        if not out:
+            return None
+        return int(b''.join(out)) * MAXRSS_UNIT
+    if psutil is not None:
+        process = psutil.Process()
+        if hasattr(process.memory_info(), 'peak_wset'):
+            gc.collect()
+            before = process.memory_info().peak_wset
+            func()
+            return process.memory_info().peak_wset - before
+    return None
+
+
+def measure(func, repeat):
+    """Returns the best wall clock time of func over repeat runs and its
+    peak memory in bytes (see peak_memory()), measured in one extra run."""
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, peak_memory(func)
+
+
+def file_size(base):
+    return sum(os.path.getsize(base + ext) for ext in ('.shp', '.shx', '.dbf'))
+
+
+def run(scales, repeat, seed, workdir):
+    revision = git_revision()
+    for scale in scales:
+        for name, shapeType, shapes, rows in datasets(scale, seed):
+            base = os.path.join(workdir, '%s_%s' % (name, scale))
+            arrays = as_arrays(shapes)
+            columns = [numpy.array(column) for column in zip(*rows)]
+            numRecords = len(shapes)
+            numVertices = len(arrays[0])
+            # The append benchmark adds the last tenth to a copy of the rest.
+            split = numRecords - numRecords // 10
+            headBase = base + '_head'
+            appendBase = base + '_append'
+            write_features(headBase, shapeType, shapes[:split], rows[:split])
+
+            def append():
+                for ext in ('.shp', '.shx', '.dbf'):
+                    shutil.copyfile(headBase + ext, appendBase + ext)
+                append_features(appendBase, shapeType, shapes[split:], rows[split:])
+
+            window = shapefile.Reader(headBase).bbox
+            window = [window[0], window[1], (window[0] + window[2]) / 2.0,
+                      (window[1] + window[3]) / 2.0]
+            operations = [
+                ('write_features', lambda: write_features(base, shapeType, shapes, rows), 1.0),
+                ('write_arrays', lambda: write_arrays(base, shapeType, arrays, columns), 1.0),
+                ('read_shapes', lambda: read_with(base, 'shapes'), 1.0),
+                ('read_shapes_mmap', lambda: read_with(base, 'shapes', mmap=True), 1.0),
+                ('read_shape_arrays', lambda: read_with(base, 'shapeArrays'), 1.0),
+                ('read_shape_arrays_mmap', lambda: read_with(base, 'shapeArrays', mmap=True), 1.0),
+                ('read_shape_arrays_parallel', lambda: read_with(base, 'parallelShapeArrays'), 1.0),
+                ('read_record_bboxes', lambda: read_with(base, 'recordBboxes'), 1.0),
+                ('read_window', lambda: read_with(base, 'iterShapes', bbox=window), 1.0),
+                ('read_records', lambda: read_with(base, 'records'), 1.0),
+                ('read_record_columns', lambda: read_with(base, 'recordColumns'), 1.0),
+                ('editor_append', append, (numRecords - split) / float(numRecords)),
+            ]
+            for operation, func, fraction in operations:
+                elapsed, peak = measure(func, repeat)
+                size = file_size(base) * fraction
+                if operation == 'read_window':
+                    records, vertices = window_counts(base, window)
+                else:
+                    records, vertices = numRecords * fraction, numVertices * fraction
+                if peak is not None:
+                    peak = round(peak / 1e6, 3)
+                result = {
+                    'revision': revision,
+                    'python': platform.python_version(),
+                    'numpy': numpy.__version__,
+                    'dataset': name,
+                    'scale': scale,
+                    'operation': operation,
+                    'records': int(records),
+                    'vertices': int(vertices),
+                    'megabytes': round(size / 1e6, 3),
+                    'seconds': round(elapsed, 6),
+                    'records_per_s': round(records / elapsed, 1),
+                    'vertices_per_s': round(vertices / elapsed, 1),
+                    'mb_per_s': round(size / 1e6 / elapsed, 3),
+                    'peak_memory_mb': peak,
+                }
+                yield result
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--scales', default='1,10',
+                      help="comma separated dataset scales (default 1,10)")
+    parser.add_option('--repeat', type='int', default=3,
+                      help="repeats per operation, the best time counts (default 3)")
+    parser.add_option('--seed', type='int', default=1,
+                      help="random seed of the synthetic data (default 1)")
+    parser.add_option('-o', '--output',
+                      help="append the JSON lines to this file instead of stdout")
+    options, args = parser.parse_args()
+    scales = [int(scale) for scale in options.scales.split(',')]
+    workdir = tempfile.mkdtemp(prefix='shapefile_benchmark_')
+    if options.output:
+        out = open(options.output, 'a')
+    else:
+        out = sys.stdout
+    try:
+        for result in run(scales, options.repeat, options.seed, workdir):
+            out.write(json.dumps(result, sort_keys=True) + '\n')
+            out.flush()
+    finally:
+        if options.output:
+            out.close()
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+# (c) Nelen & Schuurmans. GPL licensed, see LICENSE.txt
+# -*- coding: utf-8 -*-
+"""Regression check for shapefile.Writer.recordColumns.
+
+recordColumns() writes the dbf records of whole numpy columns at once.
+This script writes the same rows once with record() row by row and once
+with recordColumns() and compares the dbf files byte for byte:
+
+    python shapefile_columns_check.py
+
+It prints one line per case and exits with status 1 if any case writes
+other bytes.  It runs on Python 2 and 3.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy
+
+import shapefile
+
+# Floats whose str() and repr() differ, and values that only fit narrow
+# fields through str().
+FLOATS = [0.1 + 0.2, 1.1 * 1.1, -2.5, 1e-7, 123456.785, round(0.07 * 3, 2), 0.0, -0.1 * 3]
+
+
+def add_fields(w):
+    w.field('GPGIDENT', 'C', 24)
+    w.field('NAME', 'C', 50)
+    w.field('PEIL', 'N', 12, 2)
+    w.field('TYPE', 'N', 4, 0)
+
+
+def float_rows():
+    # record() itself refuses values whose str() doesn't fit PEIL (N 12).
+    values = [value for value in FLOATS if len(str(value)) <= 12]
+    return [(u'GPG%06d' % i, u'naam %d' % i, value, i * 7 - 3)
+            for i, value in enumerate(values)]
+
+
+def integer_rows():
+    return [(u'GPG%06d' % i, u'', i * 1000 - 5000, -i)
+            for i in range(20)]
+
+
+CASES = [float_rows, integer_rows]
+
+
+def write_dbf(base, rows, columns):
+    """Writes rows as points with record(), or with recordColumns() if
+    columns is true, and returns the bytes of the dbf file."""
+    w = shapefile.Writer(shapefile.POINT, target=base)
+    add_fields(w)
+    for i in range(len(rows)):
+        w.point(i, i)
+    if columns:
+        w.recordColumns([numpy.array(column) for column in zip(*rows)])
+    else:
+        for row in rows:
+            w.record(*row)
+    w.close()
+    f = open(base + '.dbf', 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def check(workdir):
+    """Yields (case, same dbf bytes).  a case where recordColumns() raises
+    ShapefileException on rows that record() accepts is not the same."""
+    for case in CASES:
+        rows = case()
+        written = [write_dbf(os.path.join(workdir, '%s_record' % case.__name__), rows, False)]
+        try:
+            written.append(write_dbf(os.path.join(workdir, '%s_columns' % case.__name__), rows, True))
+        except shapefile.ShapefileException:
+            written.append(None)
+        yield case.__name__, written[0] == written[1]
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix='shapefile_columns_')
+    failed = 0
+    try:
+        for case, same in check(workdir):
+            if not same:
+                failed += 1
+            sys.stdout.write('%-14s %s\n' % (case, same and 'ok' or 'FAILED'))
+    finally:
+        shutil.rmtree(workdir)
+    if failed:
+        sys.stdout.write('%d cases wrote other dbf bytes with recordColumns()\n' % failed)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,14 @@ log = logging.getLogger('nens.trrrlib')
 log.setLevel(logging.DEBUG)
 log.debug('loading module (%s)' % __revision__)
 
+import cPickle as pickle
+import datetime
+import hashlib
+import heapq
+import os
+import re
+import shutil
+import tempfile
 import types
 
 settings = None
@@ -47,9 +55,9 @@ def Config(filename):
 
 
 def kwelwegzijging(wat_is_het, waarde):
-    if wat_is_het == settings.get('dictionary.peilgebied.kwel_wegzijging', 'kwel'):
+    if wat_is_het == cachedSetting(settings, 'dictionary.peilgebied.kwel_wegzijging', 'kwel'):
         return abs(waarde)
-    elif wat_is_het == settings.get('dictionary.peilgebied.kwel_wegzijging', 'wegzijging'):
+    elif wat_is_het == cachedSetting(settings, 'dictionary.peilgebied.kwel_wegzijging', 'wegzijging'):
         return -abs(waarde)
     return waarde
 
@@ -84,106 +92,31 @@ def checkConstraints(obj, field_name, settings):
     MMDD - Integer holding a day of the year.
     (min, max) - either values can be a '-', which is ignored.
     W(min, max) - this is a weak constraint: logs a warning, but returns True.
-    """
-
-    import re
-    pattern = re.compile(r'^([a-z]?)\(([-0-9\.]+)[ ,]+([-0-9\.]+)\)$', re.I)
-
-    result = True
-
-    log.debug("checkConstraints for %s" % field_name)
-    # get the string representation of the value from object
-    value = obj[field_name]
-
-    try:
-        fvalue = float(value)
-        ivalue = int(fvalue)
-    except (TypeError, ValueError):
-        fvalue = ivalue = None
-
-    log.debug("%s(%s)" % (type(value), value))
-
-    if fvalue == float(settings.get('value.missing', 'float')):
-        log.debug("replacing 'value.missing' float field '%s' in object %s with None" % (field_name, str(obj)))
-        value = None
-
-    if ivalue == int(settings.get('value.missing', 'int')):
-        log.debug("replacing 'value.missing' int field '%s' in object %s with None" % (field_name, str(obj)))
-        value = None
-
-    if value is None:
-        log.warning("field '%s' is not defined in object %s" % (field_name, str(obj)))
-        return True
 
-    if not isinstance(value, types.StringTypes):
-        value = str(value)
+    the constraints are compiled once per settings object, see
+    compiledConstraints.  use validateTable to check a whole table.
+    """
 
-    # get constraints from settings
+    log.debug("checkConstraints for %s", field_name)
     if isinstance(obj, Kunstwerk):
-        constraints = settings.get('range.kunstwerk', field_name)
+        kind = 'kunstwerk'
     elif isinstance(obj, Peilgebied):
-        constraints = settings.get('range.peilgebied', field_name)
+        kind = 'peilgebied'
     else:
-        log.error("can't check object %s" % str(obj))
+        log.error("can't check object %s", obj)
         return False
-    constraints = splitConstraints(constraints)
 
-    # perform the check
-    try:
-        log.debug("checking s/f/i %s %0.6f %d, %s" % (value, fvalue, ivalue, constraints))
-    except TypeError:
-        log.debug("checking s/f/i %s %s %s, %s" % (value, fvalue, ivalue, constraints))
-    for i in [i.lower() for i in constraints]:
-        log.debug(i)
-        justWarn = False
-        matchedPattern = pattern.match(i)
-        if i == 'boolean':
-            ok = value.lower() in ['1', '0', 'true', 'false', 'yes', 'no']
-        elif i == 'percent':
-            ok = True
-            ok &= (fvalue >= 0)
-            ok &= (fvalue <= 100)
-        elif i == 'integer':
-            ok = (ivalue == fvalue)
-        elif i == 'nonnegative':
-            ok = (fvalue >= 0)
-        elif i == 'positive':
-            ok = (fvalue > 0)
-        elif i in ['ddmm', 'mmdd']:
-            if i == 'ddmm':
-                day, month = ivalue / 100, ivalue % 100
-            if i == 'mmdd':
-                month, day = ivalue / 100, ivalue % 100
-            try:
-                import datetime
-                datetime.datetime(2000, month, day)
-                ok = True
-            except ValueError:
-                ok = False
-        elif matchedPattern:
-            justWarn, min, max = matchedPattern.groups()
-            if min != '-':
-                min = float(min)
-            else:
-                min = None
-            if max != '-':
-                max = float(max)
-            else:
-                max = None
-            ok = True
-            if min is not None:
-                ok &= (fvalue >= min)
-            if max is not None:
-                ok &= (fvalue <= max)
-        else:
-            log.warn("unrecognized pattern '%s'" % i)
-            ok = True
-        if not ok:
-            log.warn("value %s in field %s does not respect constraint %s" %
-                     (value, field_name, i))
-        if justWarn:
-            ok = True
-        result &= ok
+    value = prepareValue(obj[field_name], missingValues(settings))
+    if value is None:
+        log.warning("field '%s' is not defined in object %s", field_name, obj)
+        return True
+
+    result = True
+    for constraint in fieldConstraints(settings, kind, field_name).constraints:
+        if not constraint.test(*value):
+            log.warn("value %s in field %s does not respect constraint %s",
+                     value[0], field_name, constraint.text)
+            result &= constraint.weak
     return result
 
 
@@ -199,7 +132,6 @@ def splitConstraints(s):
     splitTypeDef("(-, 100)") ['(-, 100)']
     '''
 
-    import re
     p = re.compile(r'^((?:[a-z]+(?:\([^\)]*\))?|(?:\([^\)]*\))))[ ]*', re.I)
     result = []
     while p.match(s):
@@ -209,8 +141,390 @@ def splitConstraints(s):
     return result
 
 
-def createPool(output_dir='.'):
+def validDate(first, second, day_first):
+    "true if the two parts of a DDMM or MMDD integer form a day of the year"
+    if day_first:
+        day, month = first, second
+    else:
+        month, day = first, second
+    try:
+        datetime.datetime(2000, month, day)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class Constraint(object):
+    """a single constraint of a 'range.*' setting, compiled.
+
+    test(value, fvalue, ivalue) gets the string, float and int form of a
+    value and returns True if the value respects the constraint.  weak
+    constraints only warn, their failure does not invalidate an object.
+    """
+
+    range_pattern = re.compile(r'^([a-z]?)\(([-0-9\.]+)[ ,]+([-0-9\.]+)\)$', re.I)
+
+    def __init__(self, text):
+        self.text = text
+        self.weak = False
+        name = text.lower()
+        matched = self.range_pattern.match(name)
+        if name == 'boolean':
+            self.test = lambda s, f, i: s.lower() in ['1', '0', 'true', 'false', 'yes', 'no']
+        elif name == 'percent':
+            self.test = lambda s, f, i: f >= 0 and f <= 100
+        elif name == 'integer':
+            self.test = lambda s, f, i: i == f
+        elif name == 'nonnegative':
+            self.test = lambda s, f, i: f >= 0
+        elif name == 'positive':
+            self.test = lambda s, f, i: f > 0
+        elif name in ['ddmm', 'mmdd']:
+            day_first = (name == 'ddmm')
+            self.test = lambda s, f, i: i is not None and validDate(i / 100, i % 100, day_first)
+        elif matched:
+            weak, low, high = matched.groups()
+            self.weak = bool(weak)
+            bounds = []
+            if low != '-':
+                bounds.append(lambda f, low=float(low): f >= low)
+            if high != '-':
+                bounds.append(lambda f, high=float(high): f <= high)
+            self.test = lambda s, f, i: not [b for b in bounds if not b(f)]
+        else:
+            log.warn("unrecognized pattern '%s'" % name)
+            self.test = lambda s, f, i: True
+
+
+class FieldConstraints(object):
+    "the compiled constraints of one field of a 'range.*' section"
+
+    def __init__(self, field_name, definition):
+        self.field_name = field_name.lower()
+        self.constraints = [Constraint(c) for c in splitConstraints(definition)]
+
+    def failures(self, value):
+        "the constraints that the prepared value does not respect"
+        return [c for c in self.constraints if not c.test(*value)]
+
+
+def compiledConstraints(settings, kind):
+    """the FieldConstraints of section 'range.<kind>', in option order.
+
+    the section is parsed once and cached on the settings object, like
+    its 'computation' attribute.
+    """
+
+    cache = getattr(settings, 'compiled_constraints', None)
+    if cache is None:
+        cache = settings.compiled_constraints = {}
+    if kind not in cache:
+        log.debug("compiling constraints in section 'range.%s'", kind)
+        cache[kind] = [FieldConstraints(name, definition)
+                       for name, definition in settings.items('range.' + kind)]
+    return cache[kind]
+
+
+def fieldConstraints(settings, kind, field_name):
+    "the compiled constraints of a single field of section 'range.<kind>'"
+
+    for field in compiledConstraints(settings, kind):
+        if field.field_name == field_name.lower():
+            return field
+    return FieldConstraints(field_name, settings.get('range.' + kind, field_name))
+
+
+def missingValues(settings):
+    "the float and int 'value.missing' markers, read once per settings object"
+
+    cache = getattr(settings, 'compiled_constraints', None)
+    if cache is None:
+        cache = settings.compiled_constraints = {}
+    if 'value.missing' not in cache:
+        cache['value.missing'] = (float(settings.get('value.missing', 'float')),
+                                  int(settings.get('value.missing', 'int')))
+    return cache['value.missing']
+
+
+def cachedSetting(settings, section, option, convert=None, raw=False):
+    """the value of option in section, passed through convert if given.
+
+    read and converted once per settings object and cached on it, for
+    the settings the constructors consult for every object.  a missing
+    section or option raises as ConfigParser does and is not cached.
+    """
+
+    cache = getattr(settings, 'cached_settings', None)
+    if cache is None:
+        cache = settings.cached_settings = {}
+    key = (section, option, convert, raw)
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+    value = settings.get(section, option, raw)
+    if convert is not None:
+        value = convert(value)
+    cache[key] = value
+    return value
+
+
+def prepareValue(value, missing):
+    """the (string, float, int) form of a value to be checked.
+
+    None if the value is not defined or holds a 'value.missing' marker.
+    float and int form are None if the value is not numeric.
+    """
+
+    try:
+        fvalue = float(value)
+        ivalue = int(fvalue)
+    except (TypeError, ValueError, OverflowError):
+        fvalue = ivalue = None
+    if value is None or fvalue == missing[0] or ivalue == missing[1]:
+        return None
+    if not isinstance(value, types.StringTypes):
+        value = str(value)
+    return value, fvalue, ivalue
+
+
+class ConstraintReport(object):
+    """the outcome of validateTable.
+
+    missing holds (id, field) of fields that are not defined,
+    violations holds (id, field, value, constraint, weak).
+    """
+
+    def __init__(self, kind, count):
+        self.kind = kind
+        self.count = count
+        self.missing = []
+        self.violations = []
+
+    def ok(self):
+        "false if any object violates a strong constraint"
+        return not [v for v in self.violations if not v[4]]
+
+    def invalid_ids(self):
+        "the ids of the objects violating a strong constraint"
+        result = []
+        for (id, field_name, value, constraint, weak) in self.violations:
+            if not weak and id not in result:
+                result.append(id)
+        return result
+
+    def log_summary(self, examples=5):
+        "logs one line per field and per violated constraint"
+        missing = {}
+        for (id, field_name) in self.missing:
+            missing.setdefault(field_name, []).append(id)
+        for field_name, ids in sorted(missing.items()):
+            log.warning("field '%s' is not defined in %d of %d %s objects, e.g. %s" %
+                        (field_name, len(ids), self.count, self.kind, ', '.join([str(i) for i in ids[:examples]])))
+        violated = {}
+        for (id, field_name, value, constraint, weak) in self.violations:
+            violated.setdefault((field_name, constraint), []).append("%s=%s" % (id, value))
+        for (field_name, constraint), values in sorted(violated.items()):
+            log.warn("%d %s values in field %s do not respect constraint %s, e.g. %s" %
+                     (len(values), self.kind, field_name, constraint, ', '.join(values[:examples])))
+        log.info("validated %d %s objects: %d undefined fields, %d violations" %
+                 (self.count, self.kind, len(self.missing), len(self.violations)))
+
+
+def validateTable(objects, kind, settings):
+    """checks a whole table of Peilgebied or Kunstwerk objects against the
+    compiled constraints of section 'range.<kind>'.
+
+    works one field (column) at a time and evaluates every distinct
+    value of a column only once.  returns a ConstraintReport.
+    """
+
+    missing = missingValues(settings)
+    report = ConstraintReport(kind, len(objects))
+    for field in compiledConstraints(settings, kind):
+        column = [(obj['id'], obj[field.field_name]) for obj in objects]
+        outcome = {}
+        for id, value in column:
+            try:
+                prepared, failures = outcome[type(value), value]
+            except KeyError:
+                prepared = prepareValue(value, missing)
+                failures = prepared is not None and field.failures(prepared) or []
+                outcome[type(value), value] = prepared, failures
+            except TypeError:
+                prepared = prepareValue(value, missing)
+                failures = prepared is not None and field.failures(prepared) or []
+            if prepared is None:
+                report.missing.append((id, field.field_name))
+                continue
+            for constraint in failures:
+                report.violations.append((id, field.field_name, prepared[0], constraint.text, constraint.weak))
+    return report
+
+
+class JoinReport(object):
+    """the outcome of joinTables, one entry per joined table.
+
+    every entry is a dictionary with the name of the table, the number of
+    rows read, the rows matched, the keys of the joined rows that found no
+    row in the table (missing), the keys of table rows that match no row
+    (orphans), the keys occurring more than once in the table
+    (duplicates) and the columns left out by the projection (dropped).
+    """
+
+    def __init__(self, kind, count, key):
+        self.kind = kind
+        self.count = count
+        self.key = key
+        self.tables = []
+
+    def log_summary(self, examples=5):
+        "logs the cardinality of every join and the keys that did not match"
+        for table in self.tables:
+            log.info("joined table '%(name)s' to %(count)d %(kind)s rows on key '%(key)s': "
+                     "%(rows)d rows read, %(matched)d matched" % dict(table, kind=self.kind, count=self.count, key=self.key))
+            if table['missing']:
+                log.warning("%d %s rows have no row in table '%s', e.g. %s" %
+                            (len(table['missing']), self.kind, table['name'],
+                             ', '.join([str(k) for k in table['missing'][:examples]])))
+            if table['orphans']:
+                log.warning("%d rows of table '%s' match no %s, e.g. %s" %
+                            (len(table['orphans']), table['name'], self.kind,
+                             ', '.join([str(k) for k in table['orphans'][:examples]])))
+            if table['duplicates']:
+                log.warning("%d keys occur more than once in table '%s', the last row is used, e.g. %s" %
+                            (len(table['duplicates']), table['name'],
+                             ', '.join([str(k) for k in table['duplicates'][:examples]])))
+            if table['dropped']:
+                log.debug("columns of table '%s' not in the column section: %s" %
+                          (table['name'], ', '.join(table['dropped'])))
+
+
+def joinTables(rows, tables, key, columns=None, kind='peilgebied'):
+    """left-joins tables, a list of (name, list of dictionaries), to rows
+    on key in a single pass.
+
+    every table is indexed on key once.  if columns is given, only those
+    columns (and the key) are taken from the tables.  fields of later
+    tables override those of earlier ones and of rows.  every row is
+    kept, even if a table has no row for it.  returns the new list of
+    dictionaries and a JoinReport.
+    """
+
+    report = JoinReport(kind, len(rows), key)
+    if columns is not None:
+        columns = set([name.lower() for name in columns])
+        columns.add(key.lower())
+    indexes = []
+    row_keys = set([row.get(key) for row in rows])
+    for name, table in tables:
+        index = {}
+        duplicates = []
+        dropped = set()
+        for item in table:
+            if columns is not None:
+                projected = {}
+                for column, value in item.items():
+                    if column.lower() in columns:
+                        projected[column] = value
+                    else:
+                        dropped.add(column)
+                item = projected
+            item_key = item.get(key)
+            if item_key in index:
+                duplicates.append(item_key)
+            index[item_key] = item
+        indexes.append(index)
+        report.tables.append({'name': name,
+                              'rows': len(table),
+                              'matched': 0,
+                              'missing': [],
+                              'orphans': sorted([k for k in index if k not in row_keys]),
+                              'duplicates': duplicates,
+                              'dropped': sorted(dropped), })
+
+    result = []
+    for row in rows:
+        joined = dict(row)
+        row_key = row.get(key)
+        for index, table in zip(indexes, report.tables):
+            item = index.get(row_key)
+            if item is None:
+                table['missing'].append(row_key)
+            else:
+                table['matched'] += 1
+                joined.update(item)
+        result.append(joined)
+    return result, report
+
+
+class Template(object):
+    """a %-format string for Dict objects, with its mapping keys lowercased
+    once at definition time.
+
+    ``template % obj`` formats directly against ``obj.dict``, which avoids
+    one case-insensitive lookup per key.  if obj lacks one of the keys, it
+    falls back to formatting the original text against obj, so missing
+    fields still come out as None.  the result is always the same as
+    ``text % obj``.
+    """
+
+    __slots__ = ('text', 'lowered')
+
+    key_pattern = re.compile(r'%(%|\(([^)]*)\))')
+
+    def __init__(self, text):
+        self.text = text
+
+        def lower(match):
+            if match.group(2) is None:
+                return match.group(0)
+            return '%%(%s)' % lowercase_key(match.group(2))
+        self.lowered = self.key_pattern.sub(lower, text)
+
+    def __mod__(self, obj):
+        try:
+            return self.lowered % obj.dict
+        except KeyError:
+            return self.text % obj
+
+    def __str__(self):
+        return self.text
+
+
+class PoolFile(object):
+    """an output file of the pool that collects the written fragments and
+    passes them on to the file in chunks of about chunk_size bytes.
+    """
+
+    def __init__(self, target, chunk_size=1 << 20):
+        self.target = target
+        self.chunk_size = chunk_size
+        self.fragments = []
+        self.size = 0
+
+    def write(self, text):
+        self.fragments.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.fragments:
+            self.target.write(''.join(self.fragments))
+            self.fragments = []
+            self.size = 0
+
+    def close(self):
+        self.flush()
+        return self.target.close()
+
+
+def createPool(output_dir='.', chunk_size=1 << 20):
     """creates files, returns pool of open files, as a dictionary.
+
+    the files are PoolFile objects that write in chunks of chunk_size
+    bytes.
     """
 
     log.debug("writing to output - creating pool")
@@ -260,6 +574,8 @@ def createPool(output_dir='.'):
     # inlees file
     retval['netwbbb'] = file(sep.join([output_dir, "network.bbb"]), "w")
 
+    for key, target in retval.items():
+        retval[key] = PoolFile(target, chunk_size)
     return retval
 
 
@@ -307,6 +623,392 @@ def closePool(pool):
     log.debug("writing to output - flushing/closing pool")
     return [i.close() for i in pool.values()]
 
+
+class FragmentFile(object):
+    "a pool file of a FragmentPool"
+
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+
+    def write(self, text):
+        self.pool.fragments.append((self.name, text))
+
+
+class FragmentPool(dict):
+    """a pool that keeps what is written to it as a list of (pool file
+    name, text) in ``fragments``, instead of writing it to files.
+    """
+
+    def __init__(self):
+        dict.__init__(self)
+        self.fragments = []
+
+    def __missing__(self, name):
+        result = self[name] = FragmentFile(self, name)
+        return result
+
+
+def networkRecords(g, skip=()):
+    """returns the (key, object) pairs of the nodes and edges of g in
+    output order: the nodes by id and class name, then the edges by the
+    ids of their ends.  the nodes in skip are left out.
+    """
+
+    nodes = [((0, node['id'], node.__class__.__name__), node)
+             for node in g.nodes() if node not in skip]
+    nodes.sort(key=lambda item: item[0])
+    edges = [((1, bn['id'], en['id']), dict_to_Dict(g[bn][en])) for bn, en in g.edges()]
+    edges.sort(key=lambda item: item[0])
+    return nodes + edges
+
+
+def fragmentRecords(records):
+    "yields (key, fragments) for the (key, object) pairs in records"
+    pool = FragmentPool()
+    for key, obj in records:
+        pool.fragments = []
+        obj.write(pool)
+        yield key, pool.fragments
+
+
+class NetworkStream(object):
+    """the parts of a network already converted by a streaming run, as
+    sorted runs of (key, fragments) records in a scratch directory in
+    output_dir.  writeNetwork merges the runs into the pool files.
+    """
+
+    def __init__(self, output_dir='.'):
+        self.work_dir = tempfile.mkdtemp(prefix='.trrrlib_runs_', dir=output_dir)
+        self.paths = []
+
+    def addRun(self, records):
+        "writes the networkRecords as the next run"
+        path = os.path.join(self.work_dir, 'run%05d' % len(self.paths))
+        out = open(path, 'wb')
+        try:
+            for record in fragmentRecords(records):
+                pickle.dump(record, out, 2)
+        finally:
+            out.close()
+        self.paths.append(path)
+        log.debug("run %d written to %s" % (len(self.paths), path))
+
+    def readRun(self, path):
+        f = open(path, 'rb')
+        try:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+        finally:
+            f.close()
+
+    def runs(self):
+        "returns an iterator over the records of every run"
+        return [self.readRun(path) for path in self.paths]
+
+    def close(self):
+        "removes the scratch directory"
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def writeNetwork(g, output_dir='.', chunk_size=1 << 20, state=None, runs=(), skip=(), names=None):
+    """writes all nodes and edges of the network g to the 3B files in
+    output_dir.
+
+    every object renders its fragments from the class templates into the
+    buffered pool, the files receive them in chunks of chunk_size bytes.
+    objects are written sorted by id, so that the same network always
+    gives the same files.  the records of runs (see NetworkStream) are
+    merged in that same order; the nodes in skip, already in the runs,
+    are not written again.  g may be None when the runs hold the whole
+    network.
+
+    with a ModelState, the files are written to a scratch directory and
+    only those that differ from the recorded ones replace the files in
+    output_dir.  names then limits the files written to the given pool
+    names and to the recorded files that are no longer in place.
+    returns the names of the files replaced.
+    """
+
+    if state is None:
+        target_dir = output_dir
+        names = None
+    else:
+        target_dir = tempfile.mkdtemp(prefix='.trrrlib_', dir=output_dir)
+    try:
+        pool = createPool(target_dir, chunk_size)
+        try:
+            if names is not None:
+                current = state.currentFiles()
+                names = set(names)
+                names.update([name for name, f in pool.items()
+                              if os.path.basename(f.target.name) not in current])
+            startupPool(pool)
+            if g is None:
+                records = []
+            else:
+                records = networkRecords(g, skip)
+            if runs:
+                for key, fragments in heapq.merge(fragmentRecords(records), *runs):
+                    for name, text in fragments:
+                        if names is None or name in names:
+                            pool[name].write(text)
+            else:
+                for key, obj in records:
+                    obj.write(pool)
+        finally:
+            closePool(pool)
+        if names is not None:
+            for name, f in pool.items():
+                if name not in names:
+                    os.remove(f.target.name)
+        if state is None:
+            return sorted([os.path.basename(f.target.name) for f in pool.values()])
+        return state.replaceFiles(target_dir)
+    finally:
+        if state is not None:
+            shutil.rmtree(target_dir, ignore_errors=True)
+
+
+def _jsonValue(value):
+    "refers to Dict objects by class and id, other values by repr"
+    if isinstance(value, Dict):
+        return '%s:%s' % (value.__class__.__name__, value['id'])
+    return repr(value)
+
+
+def _jsonLine(value):
+    """value as a line of JSON.  byte strings are read as latin-1, which
+    decodes any byte, so that names in the encoding of the tables do not
+    break the dump.
+    """
+
+    import json
+
+    try:
+        return json.dumps(value, sort_keys=True, default=_jsonValue, encoding='latin-1') + '\n'
+    except (TypeError, ValueError), e:
+        log.debug("dumping %s by repr: %s" % (value.get('node', value.get('edge')), e))
+        return json.dumps(repr(value)) + '\n'
+
+
+def dumpNetwork(g, path):
+    """writes one JSON line per node and per edge of the network g to path,
+    sorted by id.  a node line holds 'node', 'type' and 'fields', an edge
+    line 'edge', 'type', 'from', 'to' and 'fields'.
+    """
+
+    nodes = [(node['id'], node.__class__.__name__, node) for node in g.nodes()]
+    nodes.sort()
+    edges = [(edge[0]['id'], edge[1]['id'], edge[:2]) for edge in g.edges()]
+    edges.sort()
+    out = open(path, 'w')
+    try:
+        for node_id, type_name, node in nodes:
+            out.write(_jsonLine({'node': node_id, 'type': type_name, 'fields': node.dict}))
+        for bn_id, en_id, (bn, en) in edges:
+            info = dict_to_Dict(g[bn][en])
+            out.write(_jsonLine({'edge': info['id'], 'type': info.__class__.__name__,
+                                 'from': bn_id, 'to': en_id, 'fields': info.dict}))
+    finally:
+        out.close()
+    log.debug("network with %d nodes and %d edges written to %s" % (len(nodes), len(edges), path))
+
+
+def fingerprint(value):
+    """md5 hex digest of the repr of value."""
+    return hashlib.md5(repr(value)).hexdigest()
+
+
+def fileDigest(path):
+    f = open(path, 'rb')
+    try:
+        return hashlib.md5(f.read()).hexdigest()
+    finally:
+        f.close()
+
+
+def rowFingerprints(kind, objects):
+    """returns the fingerprints of the fields of objects by 'kind:id'.
+
+    references to other objects (like the peilgebied of a peilgebied)
+    are left out.
+    """
+
+    result = {}
+    for obj in objects:
+        fields = [(key, value) for key, value in obj.dict.items()
+                  if not isinstance(value, Dict)]
+        fields.sort()
+        result['%s:%s' % (kind, obj['id'])] = fingerprint(fields)
+    return result
+
+
+class ModelState(object):
+    """fingerprints of the model last written to an output directory.
+
+    ``settings`` is the fingerprint of the configuration, the run
+    arguments and this module, ``rows`` holds the fingerprints of the
+    input rows by 'kind:id' and ``files`` the md5 digest, size and
+    modification time of the written files by name.  ``units`` keeps the
+    converted peilgebieden by id (see convertArea) and ``network`` the
+    records of the rest of the network, so that a next run renders only
+    what its changed rows touch.  the state is kept in the output
+    directory, next to the files it describes.
+    """
+
+    file_name = 'trrrlib.state'
+    version = 2
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.settings = None
+        self.rows = {}
+        self.files = {}
+        self.units = {}
+        self.network = []
+
+    def load(self):
+        "reads the recorded state, returns whether there was a usable one"
+        try:
+            f = open(os.path.join(self.output_dir, self.file_name), 'rb')
+            try:
+                stored = pickle.load(f)
+            finally:
+                f.close()
+        except IOError:
+            return False
+        except Exception, e:
+            log.warning("ignoring unreadable model state: %s" % e)
+            return False
+        if stored.get('version') != self.version:
+            return False
+        self.settings = stored['settings']
+        self.rows = stored['rows']
+        self.files = stored['files']
+        self.units = stored['units']
+        self.network = stored['network']
+        return True
+
+    def save(self):
+        f = open(os.path.join(self.output_dir, self.file_name), 'wb')
+        try:
+            pickle.dump({'version': self.version,
+                         'settings': self.settings,
+                         'rows': self.rows,
+                         'files': self.files,
+                         'units': self.units,
+                         'network': self.network, }, f, 2)
+        finally:
+            f.close()
+
+    def clear(self):
+        "forgets the recorded output, for a full rebuild"
+        self.files = {}
+        self.units = {}
+        self.network = []
+
+    def changedRows(self, rows):
+        "returns the sorted keys of the rows added, changed or removed"
+        keys = set(rows)
+        keys.update(self.rows)
+        return sorted([key for key in keys if rows.get(key) != self.rows.get(key)])
+
+    def outputIntact(self):
+        "whether all recorded files are still there, unchanged"
+        for name, (digest, size, mtime) in self.files.items():
+            path = os.path.join(self.output_dir, name)
+            if not os.path.isfile(path) or fileDigest(path) != digest:
+                return False
+        return bool(self.files)
+
+    def currentFiles(self):
+        """the names of the recorded files that are still in place with
+        the size and modification time they were written with.
+        """
+
+        result = set()
+        for name, (digest, size, mtime) in self.files.items():
+            try:
+                stat = os.stat(os.path.join(self.output_dir, name))
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime) == (size, mtime):
+                result.add(name)
+        return result
+
+    def replaceFiles(self, source_dir):
+        """moves the files in source_dir that differ from the recorded ones,
+        or whose recorded ones are no longer in place, into the output
+        directory and records their digests.  returns the
+        names of the files moved.
+        """
+
+        replaced = []
+        current = self.currentFiles()
+        for name in sorted(os.listdir(source_dir)):
+            digest = fileDigest(os.path.join(source_dir, name))
+            target = os.path.join(self.output_dir, name)
+            if name in current and self.files[name][0] == digest:
+                continue
+            if os.path.exists(target):
+                os.remove(target)
+            shutil.move(os.path.join(source_dir, name), target)
+            stat = os.stat(target)
+            self.files[name] = (digest, stat.st_size, stat.st_mtime)
+            replaced.append(name)
+        return replaced
+
+
+def moduleDigest():
+    """md5 digest of the source of this module: output written by another
+    version of the converter is not reused.
+    """
+
+    path = __file__
+    if path[-4:] in ('.pyc', '.pyo') and os.path.isfile(path[:-1]):
+        path = path[:-1]
+    return fileDigest(path)
+
+
+def changedNames(old, new):
+    """the pool names of the fragments of the records that differ between
+    the (key, fragments) lists old and new.
+    """
+
+    old = dict(old)
+    new = dict(new)
+    result = set()
+    for key in set(old).union(new):
+        if old.get(key) != new.get(key):
+            for name, text in old.get(key, []) + new.get(key, []):
+                result.add(name)
+    return result
+
+
+def detachNode(node):
+    """(class name, fields) of node, referring to its peilgebied by id,
+    for a ModelState.
+    """
+
+    fields = dict(node.dict)
+    if isinstance(fields.get('peilgebied'), Dict):
+        fields['peilgebied'] = fields['peilgebied']['id']
+    return node.__class__.__name__, fields
+
+
+def attachNode(detached, peilgebieden_dict):
+    "the node saved by detachNode, referring to the peilgebied in peilgebieden_dict"
+    class_name, fields = detached
+    node = object.__new__(globals()[class_name])
+    node.dict = dict(fields)
+    if fields.get('peilgebied') is not None:
+        node.dict['peilgebied'] = peilgebieden_dict[fields['peilgebied']]
+    return node
+
 # met NX versie 0.99 vervalt XDiGraph (graphs waar men informatie bij
 # een edge kan toevoegen) want het toevoegen van informatie bij een
 # edge wordt bij alle graphs mogelijk.
@@ -334,21 +1036,54 @@ required_fields = {
 # ------------------------------------------------------------
 
 
+# normalized keys of all Dict objects, by original key.  field names come
+# from a handful of tables, so this stays small and every object shares the
+# same interned key strings.
+_lowercase_keys = {}
+
+
+def lowercase_key(key):
+    """returns the lowercase, interned form of key (non-string keys are
+    returned unchanged).
+    """
+    try:
+        return _lowercase_keys[key]
+    except KeyError:
+        pass
+    except TypeError:  # unhashable, cannot be a key anyway
+        return key
+    try:
+        result = key.lower()
+    except AttributeError:
+        result = key
+    else:
+        try:
+            result = intern(result)
+        except TypeError:  # unicode
+            pass
+    _lowercase_keys[key] = result
+    return result
+
+
 class Dict(object):
     """dictionaries are not hashable, for this reason I implement the few
     relevant functions in a common 'interface'...  moreover, our
     'dictionaries' must be case insensitive...
+
+    all fields live in the one ``dict`` slot, subclasses declare empty
+    ``__slots__`` so that objects carry no instance ``__dict__``.
     """
 
+    __slots__ = ('dict',)
+
     def __init__(self, **kwargs):
         log.log(5, "initializing Dict")
-        if 'init' not in kwargs:
-            init = {}  # fresh new dictionary
-        else:
-            init = dict([(self.lowercase_key(key), value) for key, value in kwargs['init'].items()])  # clone argument
-            del kwargs['init']
+        init = {}  # fresh new dictionary
+        if 'init' in kwargs:
+            for key, value in kwargs.pop('init').items():  # clone argument
+                init[lowercase_key(key)] = value
         for key, value in kwargs.items():
-            init[self.lowercase_key(key)] = value
+            init[lowercase_key(key)] = value
         self.dict = init
 
     def lowercase_key(self, key):
@@ -356,30 +1091,27 @@ class Dict(object):
         shouldn't break on integer keys, really... So I'm 'fixing' all the
         ``key.lower()`` methods right here.
         """
-        try:
-            result = key.lower()
-        except:
-            result = key
-        return result
+        return lowercase_key(key)
 
     def __getitem__(self, key, default=None):
-        return self.dict.get(self.lowercase_key(key), default)
+        return self.dict.get(lowercase_key(key), default)
 
     def __setitem__(self, key, value):
-        self.dict[self.lowercase_key(key)] = value
+        self.dict[lowercase_key(key)] = value
 
     def __contains__(self, key):
-        return self.lowercase_key(key) in self.dict
+        return lowercase_key(key) in self.dict
 
     def update(self, d):
+        setdefault = self.dict.setdefault
         for key, value in d.items():
-            self.dict.setdefault(self.lowercase_key(key), value)
+            setdefault(lowercase_key(key), value)
 
     def get(self, key, default=None):
-        return self.dict.get(self.lowercase_key(key), default)
+        return self.dict.get(lowercase_key(key), default)
 
     def setdefault(self, key, default=None):
-        return self.dict.setdefault(self.lowercase_key(key), default)
+        return self.dict.setdefault(lowercase_key(key), default)
 
     def __repr__(self):
         return "%s(id='%s')" % (self.__class__.__name__, self['ID'])
@@ -397,6 +1129,8 @@ def dict_to_Dict(obj):
 
 # abstract base classes
 class Peilgebied(Dict):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         Dict.__init__(self, **kwargs)
         log.log(5, "initializing Peilgebied")
@@ -405,6 +1139,9 @@ class Peilgebied(Dict):
 
 class SobekNode(Dict):
     "sobek network node"
+    __slots__ = ()
+
+    NODE_format = Template("NODE id '%(ID)s' nm '%(nm)s' ri '-1' mt 1 '%(mt)i' nt %(nt)i ObID '%(type_id)s' px %(xcoord)0.0f py %(ycoord)0.0f node\n")
 
     def __init__(self, **kwargs):
         log.log(5, "initializing SobekNode")
@@ -420,7 +1157,7 @@ class SobekNode(Dict):
         "common part called by all derived classes"
 
         try:
-            pool['nodetp'].write("NODE id '%(ID)s' nm '%(nm)s' ri '-1' mt 1 '%(mt)i' nt %(nt)i ObID '%(type_id)s' px %(xcoord)0.0f py %(ycoord)0.0f node\n" % self)
+            pool['nodetp'].write(self.NODE_format % self)
         except TypeError:
             log.debug('node %s has no geographical information: not generating NODE entry' % self.dict)
 
@@ -435,6 +1172,9 @@ SobekNode._SobekNode__super = super(SobekNode)
 
 # concrete classes
 class Zuivering(SobekNode):
+    __slots__ = ()
+
+    WWTP_format = Template("WWTP id '%(ID)s' tb 0 wwtp\n")
 
     def __init__(self, peilgebied, **kwargs):
         log.log(5, "initializing Zuivering")
@@ -450,12 +1190,15 @@ class Zuivering(SobekNode):
     def write(self, pool):
         "writes the object to the correct files in the pool"
         self.__super.write(pool)
-        pool['wwtp3b'].write("WWTP id '%(ID)s' tb 0 wwtp\n" % self)
+        pool['wwtp3b'].write(self.WWTP_format % self)
 
 Zuivering._Zuivering__super = super(Zuivering)
 
 
 class KoppelPunt(SobekNode):
+    __slots__ = ()
+
+    BOUN_format = Template("BOUN id '%(ID)s' bl %(bl)s is %(isc).2f boun\n")
 
     def __init__(self, **kwargs):
         log.log(5, "initializing KoppelPunt")
@@ -467,12 +1210,13 @@ class KoppelPunt(SobekNode):
     def write(self, pool):
         "writes the object to the correct files in the pool"
         self.__super.write(pool)
-        pool['bound3b'].write("BOUN id '%(ID)s' bl %(bl)s is %(isc).2f boun\n" % self)
+        pool['bound3b'].write(self.BOUN_format % self)
 
 KoppelPunt._KoppelPunt__super = super(KoppelPunt)
 
 
 class Boundary(KoppelPunt):
+    __slots__ = ()
 
     def __init__(self, **kwargs):
         log.log(5, "initializing Boundary")
@@ -493,6 +1237,10 @@ Boundary._Boundary__super = super(Boundary)
 
 
 class Kas(SobekNode):
+    __slots__ = ()
+
+    GRHS_format = Template("GRHS id '%(ID)s' na %(nr_areas)i ar %(storage_areas)s as 0 sl %(surface_level)0.2f ms '%(meteo_station)s' sd '%(roofstorage_def)s' si 'silo_uit' is 0 grhs\n")
+    STDF_format = Template("STDF id '%(roofstorage_def)s' nm '%(ID)s' mk %(max_roof_berging)s ik %(ini_roof_berging)s stdf\n")
 
     def __init__(self, peilgebied, **kwargs):
         log.log(5, "initializing Kas")
@@ -520,13 +1268,22 @@ class Kas(SobekNode):
         "writes the object to the correct files in the pool"
         self.__super.write(pool)
 
-        pool['green3b'].write("GRHS id '%(ID)s' na %(nr_areas)i ar %(storage_areas)s as 0 sl %(surface_level)0.2f ms '%(meteo_station)s' sd '%(roofstorage_def)s' si 'silo_uit' is 0 grhs\n" % self)
-        pool['greenrf'].write("STDF id '%(roofstorage_def)s' nm '%(ID)s' mk %(max_roof_berging)s ik %(ini_roof_berging)s stdf\n" % self)
+        pool['green3b'].write(self.GRHS_format % self)
+        pool['greenrf'].write(self.STDF_format % self)
 
 Kas._Kas__super = super(Kas)
 
 
 class Onverhard(SobekNode):
+    __slots__ = ()
+
+    UNPV_format = Template("UNPV id '%(id)s' na 16 ar %(area_grass)i %(area_corn)i %(area_potato)i %(area_beet)i %(area_grain)i %(area_misc)i %(area_nonarab)i %(area_greenhouse)i %(area_orchard)i %(area_bulbous)i %(area_foliage)i %(area_pine)i %(area_nature)i %(area_fallow)i %(area_vegetable)i %(area_flower)i ga %(groundw_area)i lv %(level).2f co %(ground_comp_type)i su %(use_scurve)i '%(scurve_def)s' sd '%(storage_def)s' %(storage_comp)s '%(alfa_def)s' sp '%(seepage_def)s' ic '%(infilt_cap_def)s' bt %(soil_type)i ig 0 %(ini_groundwater)s mg %(level).2f gl %(groundlayer).2f ms '%(meteo_station)s' is %(isc).2f unpv\n")
+    SC_T_format = Template("SC_T id '%(scurve_def)s' nm '%(id)s' PDIN 1 0 pdin TBLE\n%(scurve_table)s tble sc_t\n")
+    STDF_format = Template("STDF id '%(storage_def)s' nm '%(id)s' ml %(land_storage).1f il %(initial_land_storage).1f stdf\n")
+    SEEP_format = Template("SEEP id '%(seepage_def)s' nm '%(id)s' co 1 sp %(kwel).2f ss %(kwel_salt_concentration).2f cv %(kwel_resist_C).1f seep\n")
+    INFC_format = Template("INFC id '%(infilt_cap_def)s' nm '%(id)s' ic %(inf_cap).2f infc\n")
+    ERNS_format = Template("ERNS id '%(alfa_def)s' nm '%(id)s' cvi %(alfa_infiltratie).2f cvo %(ws_0).2f %(ws_1).2f %(ws_2).2f %(ws_3).2f cvs %(alfa_land).2f lv %(dp_0).1f %(dp_1).1f %(dp_2).1f erns\n")
+    ALFA_format = Template("ALFA id '%(alfa_def)s' nm '%(id)s' af %(alfa_land).2f %(ws_0).2f %(ws_1).2f %(ws_2).2f %(ws_3).2f %(alfa_infiltratie).2f lv %(dp_0).1f %(dp_1).1f %(dp_2).1f alfa\n\n")
 
     def __init__(self, peilgebied, **kwargs):
         log.log(5, "initializing Onverhard")
@@ -549,7 +1306,7 @@ class Onverhard(SobekNode):
                 'groundlayer': peilgebied['dikteWatervLaag'],
                 'meteo_station': peilgebied['rainstation'],
                 'isc': peilgebied['iniSaltConc'],
-                'kwel_resist_C': settings.getfloat('globals', 'kwelresistC'),
+                'kwel_resist_C': cachedSetting(settings, 'globals', 'kwelresistC', float),
                 'inf_cap': peilgebied['infCap'],
                 'level': peilgebied['maaiveldOnv'],
                 'kwel_salt_concentration': peilgebied['kwelsaltconc'],
@@ -565,16 +1322,16 @@ class Onverhard(SobekNode):
     def write(self, pool):
         "writes the object to the correct files in the pool"
         self.__super.write(pool)
-        pool['unp3b'].write("UNPV id '%(id)s' na 16 ar %(area_grass)i %(area_corn)i %(area_potato)i %(area_beet)i %(area_grain)i %(area_misc)i %(area_nonarab)i %(area_greenhouse)i %(area_orchard)i %(area_bulbous)i %(area_foliage)i %(area_pine)i %(area_nature)i %(area_fallow)i %(area_vegetable)i %(area_flower)i ga %(groundw_area)i lv %(level).2f co %(ground_comp_type)i su %(use_scurve)i '%(scurve_def)s' sd '%(storage_def)s' %(storage_comp)s '%(alfa_def)s' sp '%(seepage_def)s' ic '%(infilt_cap_def)s' bt %(soil_type)i ig 0 %(ini_groundwater)s mg %(level).2f gl %(groundlayer).2f ms '%(meteo_station)s' is %(isc).2f unpv\n" % self)
-        pool['unptbl'].write("SC_T id '%(scurve_def)s' nm '%(id)s' PDIN 1 0 pdin TBLE\n%(scurve_table)s tble sc_t\n" % self)
-        pool['unpsto'].write("STDF id '%(storage_def)s' nm '%(id)s' ml %(land_storage).1f il %(initial_land_storage).1f stdf\n" % self)
-        pool['unpsep'].write("SEEP id '%(seepage_def)s' nm '%(id)s' co 1 sp %(kwel).2f ss %(kwel_salt_concentration).2f cv %(kwel_resist_C).1f seep\n" % self)
-        pool['unpinf'].write("INFC id '%(infilt_cap_def)s' nm '%(id)s' ic %(inf_cap).2f infc\n" % self)
+        pool['unp3b'].write(self.UNPV_format % self)
+        pool['unptbl'].write(self.SC_T_format % self)
+        pool['unpsto'].write(self.STDF_format % self)
+        pool['unpsep'].write(self.SEEP_format % self)
+        pool['unpinf'].write(self.INFC_format % self)
 
         if settings.computation == 'ernst':
-            pool['unpalf'].write("ERNS id '%(alfa_def)s' nm '%(id)s' cvi %(alfa_infiltratie).2f cvo %(ws_0).2f %(ws_1).2f %(ws_2).2f %(ws_3).2f cvs %(alfa_land).2f lv %(dp_0).1f %(dp_1).1f %(dp_2).1f erns\n" % self)
+            pool['unpalf'].write(self.ERNS_format % self)
         elif settings.computation == 'zeeuw':
-            pool['unpalf'].write("ALFA id '%(alfa_def)s' nm '%(id)s' af %(alfa_land).2f %(ws_0).2f %(ws_1).2f %(ws_2).2f %(ws_3).2f %(alfa_infiltratie).2f lv %(dp_0).1f %(dp_1).1f %(dp_2).1f alfa\n\n" % self)
+            pool['unpalf'].write(self.ALFA_format % self)
             # ook zoiets
 
     def computeAlfaFields(self, peilgebied, prefix, suffix):
@@ -611,6 +1368,7 @@ Onverhard._Onverhard__super = super(Onverhard)
 
 
 class OnverhardLand(Onverhard):
+    __slots__ = ()
 
     def __init__(self, peilgebied, **kwargs):
         log.log(5, "initializing OnverhardLand")
@@ -640,7 +1398,7 @@ class OnverhardLand(Onverhard):
                 'area_flower': int(float(peilgebied['flowers_area']) * 10000),
                 'area': int(float(peilgebied['OnverhardLand_area']) * 10000),             
                 'groundw_area': int(float(peilgebied['OnverhardLand_area']) * 10000),
-                'use_scurve': settings.getfloat('globals', 'use_scurve'),
+                'use_scurve': cachedSetting(settings, 'globals', 'use_scurve', float),
                 'land_storage': peilgebied['maxBergingLand'],
                 'initial_land_storage': peilgebied['bergingLandIni'],
                 })
@@ -652,6 +1410,7 @@ OnverhardLand._OnverhardLand__super = super(OnverhardLand)
 
 
 class OnverhardSted(Onverhard):
+    __slots__ = ()
 
     def __init__(self, peilgebied, **kwargs):
         log.log(5, "initializing OnverhardSted")
@@ -695,6 +1454,10 @@ OnverhardSted._OnverhardSted__super = super(OnverhardSted)
 
 
 class Verhard(SobekNode):
+    __slots__ = ()
+
+    PAVE_format = Template("PAVE id '%(ID)s' ar %(area)i lv %(level).2f sd '%(storage_def)s' ss %(sewer_system_type)s qc 0 %(mixed_cap).5f %(vgs_cap).5f qo %(qo)s ms '%(meteo_station)s' is %(ini_salt_concentration).2f np %(number_people)i dw 'alg_dwa'%(runoff_spec)s pave\n")
+    STDF_format = Template("STDF id '%(storage_def)s' nm '%(id)s' ms %(street_storage).1f is 0 mr %(sewer_storage).1f 0 ir %(initial_sewer_storage).1f 0 stdf\n")
 
     def __init__(self, peilgebied, **kwargs):
         log.log(5, "initializing Verhard")
@@ -721,15 +1484,15 @@ class Verhard(SobekNode):
                 'paved_runoff_coefficient': peilgebied['paved_runoff_coefficient'],
                 })
 
-        if peilgebied['typeriool'].lower() == settings.get('dictionary.peilgebied.typeRiool', 'mixed').lower():
-            self['mixed_cap'] += peilgebied['aantalinw'] * settings.getfloat('globals', 'waterusepppday') / 1000 / 10 / 3600
+        if peilgebied['typeriool'].lower() == cachedSetting(settings, 'dictionary.peilgebied.typeRiool', 'mixed').lower():
+            self['mixed_cap'] += peilgebied['aantalinw'] * cachedSetting(settings, 'globals', 'waterusepppday', float) / 1000 / 10 / 3600
             self['sewer_system_type'] = 0
             self['sewer_storage'] = peilgebied['maxBergingRiool']
-        elif peilgebied['typeriool'].lower() == settings.get('dictionary.peilgebied.typeRiool', 'separated').lower():
-            self['vgs_cap'] = peilgebied['aantalinw'] * settings.getfloat('globals', 'waterusepppday') / 1000 / 10 / 3600
+        elif peilgebied['typeriool'].lower() == cachedSetting(settings, 'dictionary.peilgebied.typeRiool', 'separated').lower():
+            self['vgs_cap'] = peilgebied['aantalinw'] * cachedSetting(settings, 'globals', 'waterusepppday', float) / 1000 / 10 / 3600
             self['sewer_system_type'] = 1
-        elif peilgebied['typeriool'].lower() == settings.get('dictionary.peilgebied.typeRiool', 'impr_sep').lower():
-            self['vgs_cap'] = peilgebied['aantalinw'] * settings.getfloat('globals', 'waterusepppday') / 1000 / 10 / 3600
+        elif peilgebied['typeriool'].lower() == cachedSetting(settings, 'dictionary.peilgebied.typeRiool', 'impr_sep').lower():
+            self['vgs_cap'] = peilgebied['aantalinw'] * cachedSetting(settings, 'globals', 'waterusepppday', float) / 1000 / 10 / 3600
             self['sewer_system_type'] = 2
             self['sewer_storage'] = peilgebied['maxBergingRioolVgs']
         else:
@@ -738,7 +1501,7 @@ class Verhard(SobekNode):
         # TODO 20080721 be careful here, if we add a new fictive wwtp,
         # there's no 'zuivering' field in the peilgebied, but there's
         # the fictive wwtp connected to the pu...
-        if peilgebied['zuivering'] and peilgebied['zuivering'].lower() == settings.get('dictionary.peilgebied.naam', 'boundary').lower():
+        if peilgebied['zuivering'] and peilgebied['zuivering'].lower() == cachedSetting(settings, 'dictionary.peilgebied.naam', 'boundary').lower():
             self['qo'] = '0 0'
         elif peilgebied['zuivering']:
             self['qo'] = '2 2'
@@ -752,14 +1515,20 @@ class Verhard(SobekNode):
             self['runoff_spec'] = " ro 1 ru %(paved_runoff_coefficient)s qh ''" % self
         else:
             self['runoff_spec'] = ''
-        pool['pav3b'].write("PAVE id '%(ID)s' ar %(area)i lv %(level).2f sd '%(storage_def)s' ss %(sewer_system_type)s qc 0 %(mixed_cap).5f %(vgs_cap).5f qo %(qo)s ms '%(meteo_station)s' is %(ini_salt_concentration).2f np %(number_people)i dw 'alg_dwa'%(runoff_spec)s pave\n" % self)
+        pool['pav3b'].write(self.PAVE_format % self)
 
-        pool['pavsto'].write("STDF id '%(storage_def)s' nm '%(id)s' ms %(street_storage).1f is 0 mr %(sewer_storage).1f 0 ir %(initial_sewer_storage).1f 0 stdf\n" % self)
+        pool['pavsto'].write(self.STDF_format % self)
 
 Verhard._Verhard__super = super(Verhard)
 
 
 class OpenWater(SobekNode):
+    __slots__ = ()
+
+    OPWA_format = Template("OPWA id '%(ID)s' ml %(max_peil)0.2f rl 0 al 2 na 6 ar %(storage_opp_string)s lv %(storage_level_string)s bl %(bottom_level).2f tl 1 '%(targetlevel_def)s' sp '%(seepage_def)s' ms '%(meteo_station)s' is %(ini_salt_concentration).2f opwa\n")
+    SEEP_format = Template("SEEP id '%(seepage_def)s' nm '%(ID)s' co 1 sp %(kwel).2f ss %(kwel_salt_concentration).2f cv %(kwel_resist_C).2f seep\n")
+    OW_T_format = Template("OW_T id '%(targetlevel_def)s' nm '%(ID)s' PDIN %(blokfunctie)i 1 '365;00:00:00' pdin TBLE\n")
+
     def __init__(self, peilgebied, **kwargs):
         log.log(5, "initializing OpenWater")
         #"create the object from peilgebied properties"
@@ -777,8 +1546,8 @@ class OpenWater(SobekNode):
         self['min_streefpeil'] = min(peilgebied['winterPeil'], peilgebied['zomerPeil'])
         self['max_streefpeil'] = max(peilgebied['winterPeil'], peilgebied['zomerPeil'])
 
-        waterpeilstijgingsmodel = settings.get('globals', 'waterpeilstijgingsmodel', 'taludhelling').lower()
-        log.debug('waterpeilstijgingsmodel = %s' % waterpeilstijgingsmodel)
+        waterpeilstijgingsmodel = cachedSetting(settings, 'globals', 'waterpeilstijgingsmodel', raw=True).lower()
+        log.debug('waterpeilstijgingsmodel = %s', waterpeilstijgingsmodel)
         if (waterpeilstijgingsmodel == "openwatercurve"):
             storage_level[0] = peilgebied['maaiveldhgt'][0] - 0.20
             storage_level[1] = peilgebied['maaiveldhgt'][0]
@@ -822,7 +1591,7 @@ class OpenWater(SobekNode):
                 'ini_salt_concentration': peilgebied['iniSaltConc'],
                 'kwel_salt_concentration': peilgebied['kwelSaltConc'],
 
-                'kwel_resist_C': settings.getfloat('globals', 'kwelresistC'),
+                'kwel_resist_C': cachedSetting(settings, 'globals', 'kwelresistC', float),
                 'winterpeil': peilgebied['winterPeil'],
                 'zomerpeil': peilgebied['zomerPeil'],
                 'date_zomwin': str(peilgebied['datumZomerWinter']),
@@ -855,11 +1624,11 @@ class OpenWater(SobekNode):
         "writes the object to the correct files in the pool"
         self.__super.write(pool)
 
-        pool['openw3b'].write("OPWA id '%(ID)s' ml %(max_peil)0.2f rl 0 al 2 na 6 ar %(storage_opp_string)s lv %(storage_level_string)s bl %(bottom_level).2f tl 1 '%(targetlevel_def)s' sp '%(seepage_def)s' ms '%(meteo_station)s' is %(ini_salt_concentration).2f opwa\n" % self)
-        pool['openwsep'].write("SEEP id '%(seepage_def)s' nm '%(ID)s' co 1 sp %(kwel).2f ss %(kwel_salt_concentration).2f cv %(kwel_resist_C).2f seep\n" % self)
+        pool['openw3b'].write(self.OPWA_format % self)
+        pool['openwsep'].write(self.SEEP_format % self)
         # going to write in openwtbl
         toWrite = []
-        toWrite.append("OW_T id '%(targetlevel_def)s' nm '%(ID)s' PDIN %(blokfunctie)i 1 '365;00:00:00' pdin TBLE\n" % self)
+        toWrite.append(self.OW_T_format % self)
 
         # startlevel is always 'winterpeil' and always on 2000-01-01
         toWrite.append(" '2000/01/01;00:00:00' %.2f <\n" % self['winterpeil'])
@@ -868,7 +1637,7 @@ class OpenWater(SobekNode):
             #  snelle overgang: dus maar drie elementen in de table:
             # yyyy-01-01_, yyyy-m1-d1^, yyyy-m2-d2_
 
-            if settings.get('range.peilgebied', 'datumWinterZomer').lower() == 'mmdd':
+            if cachedSetting(settings, 'range.peilgebied', 'datumWinterZomer').lower() == 'mmdd':
                 toWrite.append(" '2000/%s/%s;00:00:00' %.2f <\n" % (
                         self['date_winzom'][0:2], self['date_winzom'][2:4], self['zomerpeil']))
 
@@ -891,7 +1660,7 @@ class OpenWater(SobekNode):
 
             import datetime
             duur = datetime.timedelta(self['overgangstijd_ZP_WP_dgn'])
-            if settings.get('range.peilgebied', 'datumWinterZomer').lower() == 'mmdd':
+            if cachedSetting(settings, 'range.peilgebied', 'datumWinterZomer').lower() == 'mmdd':
                 maand = self['date_winzom'] / 100
                 dag = self['date_winzom'] % 100
             else:
@@ -905,7 +1674,7 @@ class OpenWater(SobekNode):
             toWrite.append(" '%s;00:00:00' %.2f <\n" % (
                         overgang.isoformat().replace('-', '/'), self['zomerpeil']))
 
-            if settings.get('range.peilgebied', 'datumWinterZomer').lower() == 'mmdd':
+            if cachedSetting(settings, 'range.peilgebied', 'datumWinterZomer').lower() == 'mmdd':
                 maand = self['date_zomwin'] / 100
                 dag = self['date_zomwin'] % 100
             else:
@@ -927,6 +1696,9 @@ OpenWater._OpenWater__super = super(OpenWater)
 
 
 class Kunstwerk(SobekNode):
+    __slots__ = ()
+
+    STRU_format = Template("STRU id '%(id)s' dd '%(struct_def)s' ca %(ca_1)s 0 0 0 cj '%(cj_1)s' '-1' '-1' '-1' stru\n")
 
     def __init__(self, **kwargs):
         log.log(5, "initializing Kunstwerk")
@@ -942,22 +1714,26 @@ class Kunstwerk(SobekNode):
 
     def write(self, pool):
         "writes the object to the correct files in the pool"
-        log.log(5, "Kunstwerk.write... %s" % self.dict)
-        log.log(5, "STDS_format: %s" % self.STDS_format)
+        log.log(5, "Kunstwerk.write... %s", self.dict)
+        log.log(5, "STDS_format: %s", self.STDS_format)
         self.__super.write(pool)
-        pool['strdat'].write("STRU id '%(id)s' dd '%(struct_def)s' ca %(ca_1)s 0 0 0 cj '%(cj_1)s' '-1' '-1' '-1' stru\n" % self)
+        pool['strdat'].write(self.STRU_format % self)
         pool['strdef'].write(self.STDS_format % self)
 
 Kunstwerk._Kunstwerk__super = super(Kunstwerk)
 
 
-class Inlaat:
+class Inlaat(object):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         log.log(5, "initializing Inlaat")
         self['struct_def'] = "inl_%s" % self['ID']
 
 
-class Uitlaat:
+class Uitlaat(object):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         log.log(5, "initializing Uitlaat")
         self['struct_def'] = "outl_%s" % self['ID']
@@ -966,6 +1742,7 @@ class Uitlaat:
 # concrete classes
 
 class Gemaal(Kunstwerk):
+    __slots__ = ()
 
     def __init__(self, **kwargs):
         log.log(5, "initializing Gemaal")
@@ -978,8 +1755,9 @@ Gemaal._Gemaal__super = super(Gemaal)
 
 
 class InlaatGemaal(Gemaal, Inlaat):
+    __slots__ = ()
 
-    STDS_format = "STDS id '%(struct_def)s' nm '%(id)s' ty 8 in 1 dn 2 nc 2 pc %(gem_cap_low).6f %(gem_cap_add_cap_high).6f so 'onoff_inlet' stds\n"
+    STDS_format = Template("STDS id '%(struct_def)s' nm '%(id)s' ty 8 in 1 dn 2 nc 2 pc %(gem_cap_low).6f %(gem_cap_add_cap_high).6f so 'onoff_inlet' stds\n")
 
     def __init__(self, **kwargs):
         log.log(5, "initializing InlaatGemaal")
@@ -990,8 +1768,9 @@ class InlaatGemaal(Gemaal, Inlaat):
 
 
 class UitlaatGemaal(Gemaal, Uitlaat):
+    __slots__ = ()
 
-    STDS_format = "STDS id '%(struct_def)s' nm '%(id)s' ty 8 in 0 dn 1 nc 2 pc %(gem_cap_low).6f %(gem_cap_add_cap_high).6f so 'onoff_outlet' stds\n"
+    STDS_format = Template("STDS id '%(struct_def)s' nm '%(id)s' ty 8 in 0 dn 1 nc 2 pc %(gem_cap_low).6f %(gem_cap_add_cap_high).6f so 'onoff_outlet' stds\n")
 
     def __init__(self, **kwargs):
         log.log(5, "initializing UitlaatGemaal")
@@ -1002,6 +1781,11 @@ class UitlaatGemaal(Gemaal, Uitlaat):
 
 
 class Stuw(Kunstwerk):
+    __slots__ = ('CNTL_format',)
+
+    CNTL_auto_format = Template("CNTL id '%(controller_def)s' nm '%(ID)s' ty 12 mf %(maxflow).6f mf2 %(p_mf2).6f ml %(maxpeil).2f zmin -999.99 zmax 9999 md 999 cntl\n")
+    CNTL_equal_format = Template("CNTL id '%(controller_def)s' nm '%(ID)s' ty 16 mf 0.000000 mf2 %(p_mf2).6f zmin -999.99 zmax 9999 cntl\n")
+
     def __init__(self, **kwargs):
         log.log(5, "initializing Stuw")
         kwargs.setdefault('mt', 9)
@@ -1015,7 +1799,7 @@ class Stuw(Kunstwerk):
         self['stuw_crest_width_2'] = 999
         self['controller_def'] = 'weir_' + self['id']
 
-        if self['controlType'] == settings.get('dictionary.kunstwerk.controlType', 'trap'):
+        if self['controlType'] == cachedSetting(settings, 'dictionary.kunstwerk.controlType', 'trap'):
             # controller_type = 1
             self['ca_1'] = 0
             self['cj_1'] = -1
@@ -1023,22 +1807,22 @@ class Stuw(Kunstwerk):
             self['stuw_crest_width_2'] = self['kruinBreedte_trap']
             self['write_to_cntl'] = False
 
-        elif self['controlType'] == settings.get('dictionary.kunstwerk.controlType', 'auto'):
+        elif self['controlType'] == cachedSetting(settings, 'dictionary.kunstwerk.controlType', 'auto'):
             # controller_type = 2
             self['ca_1'] = 1
             self['cj_1'] = self['controller_def']
             self['write_to_cntl'] = True
-            self.CNTL_format = "CNTL id '%(controller_def)s' nm '%(ID)s' ty 12 mf %(maxflow).6f mf2 %(p_mf2).6f ml %(maxpeil).2f zmin -999.99 zmax 9999 md 999 cntl\n"
+            self.CNTL_format = self.CNTL_auto_format
 
-        elif self['controlType'] == settings.get('dictionary.kunstwerk.controlType', 'equal'):
+        elif self['controlType'] == cachedSetting(settings, 'dictionary.kunstwerk.controlType', 'equal'):
             # controller_type = 3
             self['ca_1'] = 1
             self['cj_1'] = self['controller_def']
             self['write_to_cntl'] = True
-            self.CNTL_format = "CNTL id '%(controller_def)s' nm '%(ID)s' ty 16 mf 0.000000 mf2 %(p_mf2).6f zmin -999.99 zmax 9999 cntl\n"
+            self.CNTL_format = self.CNTL_equal_format
 
         else:
-            if self['controlType'] != settings.get('dictionary.kunstwerk.controlType', 'fixed'):
+            if self['controlType'] != cachedSetting(settings, 'dictionary.kunstwerk.controlType', 'fixed'):
                 log.warning('unrecognized controlType %(controlType)s - assuming fixed weir' % self)
             # controller_type = 1
             self['ca_1'] = 0
@@ -1071,23 +1855,25 @@ Stuw._Stuw__super = super(Stuw)
 
 
 class InlaatStuw(Stuw, Inlaat):
+    __slots__ = ()
 
     def __init__(self, **kwargs):
         Stuw.__init__(self, **kwargs)
         Inlaat.__init__(self, **kwargs)
 
-    STDS_format = "STDS id '%(struct_def)s' nm '%(ID)s' ty 9 in 1 dc %(dischcoef).1f cl %(kruinhoogte).2f cl2 %(stuw_crestlevel_2).2f cw %(kruinbreedte).2f cw2 %(stuw_crest_width_2).2f cp %(powercoef).2f rt 1 wt %(wt)i fl %(inlet_flushing_flow).2f so 'onoff_inlet_stuw' stds\n"
+    STDS_format = Template("STDS id '%(struct_def)s' nm '%(ID)s' ty 9 in 1 dc %(dischcoef).1f cl %(kruinhoogte).2f cl2 %(stuw_crestlevel_2).2f cw %(kruinbreedte).2f cw2 %(stuw_crest_width_2).2f cp %(powercoef).2f rt 1 wt %(wt)i fl %(inlet_flushing_flow).2f so 'onoff_inlet_stuw' stds\n")
 
 InlaatStuw._InlaatStuw__super = super(InlaatStuw)
 
 
 class UitlaatStuw(Stuw, Uitlaat):
+    __slots__ = ()
 
     def __init__(self, **kwargs):
         Stuw.__init__(self, **kwargs)
         Uitlaat.__init__(self, **kwargs)
 
-    STDS_format = "STDS id '%(struct_def)s' nm '%(ID)s' ty 9 in 0 dc %(dischcoef).1f cl %(kruinhoogte).2f cl2 %(stuw_crestlevel_2).2f cw %(kruinbreedte).2f cw2 %(stuw_crest_width_2).2f cp %(powercoef).2f rt 0 wt %(wt)i stds\n"
+    STDS_format = Template("STDS id '%(struct_def)s' nm '%(ID)s' ty 9 in 0 dc %(dischcoef).1f cl %(kruinhoogte).2f cl2 %(stuw_crestlevel_2).2f cw %(kruinbreedte).2f cw2 %(stuw_crest_width_2).2f cp %(powercoef).2f rt 0 wt %(wt)i stds\n")
 
 
 UitlaatStuw._UitlaatStuw__super = super(UitlaatStuw)
@@ -1100,6 +1886,10 @@ UitlaatStuw._UitlaatStuw__super = super(UitlaatStuw)
 # abstract base classes
 
 class SobekEdge(Dict):
+    __slots__ = ()
+
+    BRCH_format = Template("BRCH id '%(ID)s' ri '-1' mt 1 '%(tubed)s' bt %(bt)i ObID '%(type_id)s' bn '%(bn)s' en '%(en)s' brch\n")
+
     def __init__(self, **kwargs):
         log.log(5, "initializing SobekEdge")
         kwargs.setdefault('mt', 0)
@@ -1133,12 +1923,14 @@ class SobekEdge(Dict):
     def write(self, pool):
         "common part called by all derived classes"
 
-        pool['linktp'].write("BRCH id '%(ID)s' ri '-1' mt 1 '%(tubed)s' bt %(bt)i ObID '%(type_id)s' bn '%(bn)s' en '%(en)s' brch\n" % self)
+        pool['linktp'].write(self.BRCH_format % self)
 
 SobekEdge._SobekEdge__super = super(SobekEdge)
 
 
 class OppervlakLink(SobekEdge):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         log.log(5, "initializing OppervlakLink")
         kwargs.setdefault('mt', 14)
@@ -1155,6 +1947,8 @@ OppervlakLink._OppervlakLink__super = super(OppervlakLink)
 
 
 class RioolLink(SobekEdge):
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         log.log(5, "initializing RioolLink")
         kwargs.setdefault('mt', 14)
@@ -1172,6 +1966,493 @@ RioolLink._RioolLink__super = super(RioolLink)
 
 # ------------------------------------------------------------
 
+class NetworkReport(object):
+    """the changes made by validateNetwork.
+
+    removed_nodes holds (id, reason), removed_edges (begin id, end id,
+    reason).
+    """
+
+    def __init__(self):
+        self.removed_nodes = []
+        self.removed_edges = []
+
+    def update(self, other):
+        "adds the changes recorded in the other report"
+        self.removed_nodes.extend(other.removed_nodes)
+        self.removed_edges.extend(other.removed_edges)
+
+    def log_summary(self):
+        "logs the number of removed nodes and edges per reason"
+        counts = {}
+        for item in self.removed_nodes + self.removed_edges:
+            counts[item[-1]] = counts.get(item[-1], 0) + 1
+        for reason, count in sorted(counts.items()):
+            log.info("network validation: %d times %s" % (count, reason))
+        log.info("network validation removed %d nodes and %d edges" %
+                 (len(self.removed_nodes), len(self.removed_edges)))
+
+
+def nodesByType(g):
+    "returns the nodes of g in a dictionary by class"
+    result = {}
+    for node in g.nodes():
+        result.setdefault(node.__class__, []).append(node)
+    return result
+
+
+def nodesOfType(index, classes):
+    "returns the nodes in index that are instances of classes, sorted by id"
+    result = []
+    for cls, nodes in index.items():
+        if issubclass(cls, classes):
+            result.extend(nodes)
+    result = [(node['id'], node) for node in result]
+    result.sort()
+    return [node for (id, node) in result]
+
+
+def validateNetwork(g):
+    """removes from g the links that the model cannot use, returns a
+    NetworkReport.
+
+    - fictive 'cf_node_' koppelpunten that area nodes (OpenWater, Verhard,
+      Onverhard, Kas) are coupled to do not exist in the CF model: they
+      are removed.
+    - a Verhard node coupled to more than one KoppelPunt or Boundary
+      loses its sewage links to Boundary nodes, and the boundaries left
+      without neighbours are removed.
+    """
+
+    report = NetworkReport()
+    area_types = (OpenWater, Verhard, Onverhard, Kas)
+    index = nodesByType(g)
+
+    fictive = [node for node in nodesOfType(index, (KoppelPunt, Boundary))
+               if node['id'].startswith('cf_node_')]
+    for fn in fictive:
+        sources = [item for item in g.predecessors(fn) if isinstance(item, area_types)]
+        if not sources:
+            continue
+        for source in sources:
+            log.warn('node %s has link to non existing CF node' % source['id'])
+        g.remove_node(fn)
+        report.removed_nodes.append((fn['id'], 'link to non existing CF node'))
+
+    # TODO 20080721 there must be some option so that the user can choose
+    # between this warning and creating a new fictive wwtp in
+    # order to connect the paved urban node to boundary via
+    # sewage.
+    for node in nodesOfType(index, Verhard):
+        neighbors = [item for item in g.neighbors(node) if isinstance(item, (KoppelPunt, Boundary))]
+        if len(neighbors) <= 1:
+            continue
+        log.warn('node %s is directly coupled to too many Boundary nodes, removing sewage link' % (node['id'],))
+        for neighbor in [item for item in neighbors if isinstance(item, Boundary)]:
+            g.remove_edge(node, neighbor)
+            report.removed_edges.append((node['id'], neighbor['id'], 'paved node coupled to too many boundaries'))
+            if len(g.neighbors(neighbor)) == 0:
+                g.remove_node(neighbor)
+                report.removed_nodes.append((neighbor['id'], 'boundary left without neighbours'))
+    return report
+
+
+def createAreaNodes(peilgebied):
+    """creates the OpenWater of peilgebied and those of its Kas,
+    OnverhardLand, OnverhardSted and Verhard nodes whose area reaches the
+    threshold.
+
+    returns the openwater and the other nodes by lowercase type name.
+    touches neither the network nor the sequential ids.
+    """
+
+    openwater = OpenWater(peilgebied)
+    openwater['area'] = max(peilgebied['openwater_area'],
+                            cachedSetting(settings, 'threshold.peilgebied', 'openwater_area', float))
+    created = {}
+    for Type in [Kas, OnverhardLand, OnverhardSted, Verhard]:
+        type_name = Type.__name__.lower()
+        log.debug("area of %s for %s is %s" % (type_name, peilgebied['id'], peilgebied[type_name + '_area']))
+        if type_name == 'onverhardland':
+            input_area = float(peilgebied['OnverhardLand_area'])
+        else:
+            input_area = float(peilgebied[type_name + '_area'])
+
+        if (input_area >= cachedSetting(settings, 'threshold.peilgebied', type_name + '_area', float)):
+            created[type_name] = Type(peilgebied)
+    return openwater, created
+
+
+def _startAreaWorker(inifile_name, computation):
+    "reads the settings in a worker process of parallelAreaNodes"
+    global settings
+    settings = Config(inifile_name)
+    settings.computation = computation
+
+
+def _areaNodesShard(peilgebieden):
+    return [createAreaNodes(peilgebied) for peilgebied in peilgebieden]
+
+
+def adoptPeilgebied(peilgebied, copy, nodes):
+    """makes nodes, built in another process from copy of peilgebied,
+    refer to peilgebied instead and takes over the fields that their
+    constructors set on the copy.
+    """
+
+    for key, value in copy.dict.items():
+        if value is copy:
+            value = peilgebied
+        peilgebied.dict[key] = value
+    for node in nodes:
+        for key, value in node.dict.items():
+            if value is copy:
+                node.dict[key] = peilgebied
+
+
+def parallelAreaNodes(peilgebieden, inifile_name, computation, processes, shards_per_process=4):
+    """returns createAreaNodes(peilgebied) for all peilgebieden, computed
+    by a pool of processes on contiguous shards of the list.
+
+    the workers read the settings from inifile_name themselves.  the
+    results are in peilgebied order and refer to the given peilgebieden.
+    """
+
+    import multiprocessing
+
+    count = min(len(peilgebieden), processes * shards_per_process)
+    bounds = [len(peilgebieden) * i // count for i in range(count + 1)]
+    shards = [peilgebieden[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+    pool = multiprocessing.Pool(processes, _startAreaWorker, (inifile_name, computation))
+    try:
+        built = pool.map(_areaNodesShard, shards)
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+    result = []
+    for shard, shard_built in zip(shards, built):
+        for peilgebied, (openwater, created) in zip(shard, shard_built):
+            adoptPeilgebied(peilgebied, openwater['peilgebied'], [openwater] + created.values())
+            result.append((openwater, created))
+    return result
+
+
+def coupleAreaNodes(g, peilgebied, openwater, created, koppelpunten, zuiveringen, missingnode_name):
+    """adds the created area nodes of peilgebied to the network g, coupled
+    to their koppelpunt or to the openwater, and the waste water
+    connections of its paved node.
+
+    koppelpunten and zuiveringen hold the nodes shared by name between
+    peilgebieden, they are updated.
+    """
+
+    coupled_to_openwater = []
+    forget_about_openwater = False
+    nodes_for_peilgebied = {}
+
+    for Type in [Kas, OnverhardLand, OnverhardSted, Verhard]:
+        # couple to openwater
+        type_name = Type.__name__.lower()
+        # if it has been created (area above threshold), connect it
+        # to koppelpunt or openwater, depending on whether koppelpunt
+        # exists or not.
+        if type_name in created:
+
+            # koppelpunt_name is None if model is RR or if, in
+            # RR+RR_CF model with cfDirect, no "knoop" has been
+            # specified for this type for this peilgebied
+            log.debug("evaluates cfDirect field %s(%s) to True? %s" % (type(peilgebied['cfDirect']), peilgebied['cfDirect'], bool(peilgebied['cfDirect']),))
+            if peilgebied['cfDirect']:
+                koppelpunt_name = peilgebied.get(type_name + '_knoop', missingnode_name)
+                log.debug('looking into peilgebied %s for field %s, got %s(%s)' % (peilgebied['id'], type_name + '_knoop', type(koppelpunt_name), koppelpunt_name,))
+            else:
+                koppelpunt_name = None
+
+            if isinstance(koppelpunt_name, types.StringTypes):
+                if koppelpunt_name:
+                    id = koppelpunt_name
+                else:
+                    id = 'cf_node_' + sequential()
+                koppelpunten.setdefault(id, KoppelPunt(id=id, peilgebied=peilgebied))
+                log.debug("adding edge from %s to %s" % (type_name, id))
+                nodes_for_peilgebied[type_name] = created[type_name]
+                g.add_edge(nodes_for_peilgebied[type_name],
+                           koppelpunten[id],
+                           OppervlakLink().as_dict())
+                # if any object is connected to koppelpunt instead of
+                # to openwater, forget about the openwater component
+                forget_about_openwater = True
+            else:
+                coupled_to_openwater.append(created[type_name])
+
+    # if any object is connected to koppelpunt, create an
+    # externKwkKnp, otherwise store openwater in externKwkKnp
+
+    if forget_about_openwater:
+        desc = "CF node"
+        externKwkKnp = KoppelPunt(peilgebied=peilgebied)
+    else:
+        desc = "openwater"
+        externKwkKnp = openwater
+        koppelpunten[peilgebied['id']] = openwater
+
+    for obj in coupled_to_openwater:
+        type_name = obj.__class__.__name__.lower()
+        log.debug("adding edge from %s to %s" % (type_name, desc))
+        nodes_for_peilgebied[type_name] = obj
+        g.add_edge(obj, externKwkKnp, OppervlakLink().as_dict())
+
+    # rioolaansluitingen
+
+    if peilgebied['typeriool']:
+        if 'verhard' not in nodes_for_peilgebied:
+            log.warning('settings dictate a waste water connection, but no paved area has been created')
+        else:
+            log.debug('creating waste water connections')
+            obj = nodes_for_peilgebied['verhard']
+
+            if peilgebied['zuivering'] and peilgebied['zuivering'] != cachedSetting(settings, 'dictionary.peilgebied.naam', 'boundary'):
+                if peilgebied['zuivering'] not in zuiveringen:
+                    log.debug("create Zuivering '%s' and connect it to Boundary via RioolLink."
+                              % peilgebied['zuivering'])
+                    zuivering = Zuivering(peilgebied)
+                    zuiveringen[peilgebied['zuivering']] = zuivering
+                    g.add_edge(zuivering, Boundary(bl="0 0.00", isc=0, cause=zuivering), RioolLink().as_dict())
+                log.debug("connect 'verhard' object to zuivering '%s' via RioolLink."
+                          % peilgebied['zuivering'])
+                zuivering = zuiveringen[peilgebied['zuivering']]
+                g.add_edge(obj, zuivering, RioolLink().as_dict())
+
+            else:
+                log.debug("connect 'verhard' object to Boundary via RioolLink.")
+                g.add_edge(obj, Boundary(bl='0 0.00', isc=0, cause=obj), RioolLink().as_dict())
+
+
+def naarKnoopField(kunstwerk, model):
+    "the name of the kunstwerk field that holds its downstream node in model"
+    if model == 'RR':
+        return 'naarRRKnoop'
+    elif model == 'RR_CF':
+        return 'naarCFKnoop'
+    return 'naar%sKnoop' % kunstwerk['typeNaarKnoop']
+
+
+def sharedNames(peilgebieden, kunstwerken, model):
+    """the names by which peilgebieden and kunstwerken refer to koppelpunten
+    and openwaters of other peilgebieden: the '<type>_knoop' fields of the
+    peilgebieden and both ends of the kunstwerken.
+    """
+
+    result = set()
+    for peilgebied in peilgebieden:
+        for type_name in ['kas', 'onverhardland', 'onverhardsted', 'verhard']:
+            name = peilgebied[type_name + '_knoop']
+            if isinstance(name, types.StringTypes) and name:
+                result.add(name)
+    for kunstwerk in kunstwerken:
+        for name in [kunstwerk['vanknoop'], kunstwerk[naarKnoopField(kunstwerk, model)]]:
+            if isinstance(name, types.StringTypes):
+                result.add(name)
+    return result
+
+
+def areaReferences(peilgebied):
+    """the shared nodes that coupling peilgebied looks up, as (kind, name):
+    the koppelpunten of its '<type>_knoop' fields and its zuivering.
+    """
+
+    result = []
+    for type_name in ['kas', 'onverhardland', 'onverhardsted', 'verhard']:
+        name = peilgebied[type_name + '_knoop']
+        if isinstance(name, types.StringTypes) and name:
+            result.append(('koppelpunt', name))
+    if peilgebied['zuivering']:
+        result.append(('zuivering', peilgebied['zuivering']))
+    result.sort()
+    return result
+
+
+def presentReferences(peilgebied, koppelpunten, zuiveringen):
+    "the areaReferences of peilgebied to nodes that already exist"
+    shared = {'koppelpunt': koppelpunten, 'zuivering': zuiveringen}
+    return [(kind, name) for kind, name in areaReferences(peilgebied)
+            if name in shared[kind]]
+
+
+def convertArea(peilgebied, openwater, created, koppelpunten, zuiveringen,
+                missingnode_name, shared_names, written, row, start):
+    """couples the area nodes of peilgebied in a network of its own,
+    spreads the information over it, validates and renders it.
+
+    koppelpunten keeps only the shared_names, the shared nodes that the
+    peilgebied creates are added to written.  returns the unit of the
+    peilgebied, a dictionary holding
+
+    - row, present, start: the fingerprint of its row, the shared nodes
+      it found and its sequential offset (None if it renders no
+      sequential id).  a later run can reuse the unit while these are
+      unchanged (see reuseArea).
+    - count: the number of sequential ids used.
+    - records: its nodes and edges as sorted (key, fragments).
+    - names: the names it added to koppelpunten.
+    - shared: (kind, name, detached node) of the nodes it shared.
+    - removed: the removed nodes and edges of its NetworkReport.
+    """
+
+    present = presentReferences(peilgebied, koppelpunten, zuiveringen)
+    candidates = [name for kind, name in areaReferences(peilgebied) if kind == 'koppelpunt']
+    candidates.append(peilgebied['id'])
+    before = dict([(name, koppelpunten.get(name)) for name in candidates])
+    had_zuivering = peilgebied['zuivering'] in zuiveringen
+    first = sequential.id
+
+    network = networkx.DiGraph()
+    coupleAreaNodes(network, peilgebied, openwater, created,
+                    koppelpunten, zuiveringen, missingnode_name)
+    spreadNetworkInfo(network)
+    report = validateNetwork(network)
+
+    generated = set()
+    for number in range(first + 1, sequential.id + 1):
+        generated.add('koppelpunt_%04d' % number)
+        generated.add('cf_node_%04d' % number)
+    if not [node for node in network.nodes() if node['id'] in generated]:
+        start = None
+
+    names = sorted([name for name in before if koppelpunten.get(name) is not before[name]])
+    shared = []
+    for name in names:
+        if name in shared_names:
+            shared.append(('koppelpunt', name, koppelpunten[name]))
+        else:
+            del koppelpunten[name]
+    if peilgebied['zuivering'] in zuiveringen and not had_zuivering:
+        shared.append(('zuivering', peilgebied['zuivering'], zuiveringen[peilgebied['zuivering']]))
+
+    records = list(fragmentRecords(networkRecords(network, written)))
+    written.update([node for kind, name, node in shared])
+    # the back reference is not used after construction.
+    peilgebied.dict.pop('ow', None)
+    return {'row': row,
+            'present': present,
+            'start': start,
+            'count': sequential.id - first,
+            'records': records,
+            'names': names,
+            'shared': [(kind, name, detachNode(node)) for kind, name, node in shared],
+            'removed': (report.removed_nodes, report.removed_edges), }
+
+
+def reuseArea(unit, peilgebied, koppelpunten, zuiveringen, shared_names, written,
+              peilgebieden_dict, row, start):
+    """replays unit, converted by a previous run, for peilgebied: takes over
+    its sequential ids and shared nodes.  returns its NetworkReport, or
+    None if the unit does not fit the current input and peilgebied must
+    be converted again.
+    """
+
+    if unit is None or unit['row'] != row:
+        return None
+    if unit['start'] is not None and unit['start'] != start:
+        return None
+    if unit['present'] != presentReferences(peilgebied, koppelpunten, zuiveringen):
+        return None
+    shared = set([name for kind, name, detached in unit['shared'] if kind == 'koppelpunt'])
+    if shared != set([name for name in unit['names'] if name in shared_names]):
+        return None
+
+    sequential.id += unit['count']
+    for kind, name, detached in unit['shared']:
+        node = attachNode(detached, peilgebieden_dict)
+        if kind == 'koppelpunt':
+            koppelpunten[name] = node
+        else:
+            zuiveringen[name] = node
+        written.add(node)
+    report = NetworkReport()
+    report.removed_nodes.extend(unit['removed'][0])
+    report.removed_edges.extend(unit['removed'][1])
+    return report
+
+
+def addKunstwerken(g, kunstwerken, koppelpunten, peilgebieden_dict, model):
+    """adds the kunstwerken to the network g, between the openwater or
+    koppelpunt of their two ends.
+    """
+
+    for kunstwerk in kunstwerken:
+        naarField = naarKnoopField(kunstwerk, model)
+        vanknoop, naarknoop = kunstwerk['vanknoop'], kunstwerk[naarField]
+        log.debug(("%(soort)s %(id)s: %(vanknoop)s -> %(" + naarField + ")s") % kunstwerk)
+
+        # vanknoop and naarknoop are the names of peilgebieden or of
+        # CF koppelpunten.  if it's a KoppelPunt, that's what you
+        # need.  if it's a Peilgebied, use the koppelpunten dictionary
+        # to get the koppelpunt of the named peilgebied (will be
+        # OpenWater or again KoppelPunt.)  whichever the case, after
+        # translation of the name you remain at both ends of the
+        # kunstwerk with OpenWater or KoppelPunt.  notice that also
+        # the case 'Boundary' is to be considered a CF KoppelPunt.
+
+        # setting coordinates taking them from the OpenWater of
+        # preferably the 'vanknoop' and otherwise the 'naarknoop'
+        # peigebied.  remove the kunstwerk if no OpenWater.
+        connecting = [n for n in [vanknoop, naarknoop]
+                      if n in koppelpunten and isinstance(koppelpunten[n], OpenWater)]
+        if len(connecting) == 0:
+            log.warn("%(soort)s %(id)s is not linking any OpenWater.  not adding it to the network." % kunstwerk)
+            continue
+
+        if 'xcoord' not in kunstwerk:
+            # using the first one (maybe the only one)
+            log.debug('assigning fictive coordinates to %(soort)s %(id)s' % kunstwerk)
+            kunstwerk['xcoord'], kunstwerk['ycoord'] = koppelpunten[connecting[0]].getNextKwkPosition()
+
+        # here we have a geographically localized kunstwerk coupling
+        # things...  we still don't know what kind of things...  let's
+        # translate the names of the two extremes into
+        # OpenWater/KoppelPunt/Boundary
+
+        for extreme in [vanknoop, naarknoop]:
+            # if extreme is 'boundary', create new boundary node
+            if extreme == cachedSetting(settings, 'dictionary.peilgebied.naam', 'boundary'):
+                log.debug("translating %s to Boundary object" % extreme)
+                koppelpunten[extreme] = Boundary(bl="0 %(boundPeil).2f" % kunstwerk,
+                                                 isc=0, cause=kunstwerk)
+            elif extreme not in peilgebieden_dict:
+                # it's the name of a KoppelPung, which we probably must add...
+                if extreme in koppelpunten:
+                    log.debug("reusing already created KoppelPunt")
+                else:
+                    koppelpunten[extreme] = KoppelPunt(id=extreme,
+                                                       peilgebied=peilgebieden_dict[connecting[0]],
+                                                       xcoord=kunstwerk['xcoord'] + 25,
+                                                       ycoord=kunstwerk['ycoord'])
+
+        try:
+            # add kunstwerk to graph
+            g.add_edge(koppelpunten[vanknoop], kunstwerk, OppervlakLink().as_dict())
+            g.add_edge(kunstwerk, koppelpunten[naarknoop], OppervlakLink().as_dict())
+            log.debug("kunstwerk added to graph: %s", kunstwerk.as_dict())
+        except KeyError, e:
+            kunstwerk['missing'] = e
+            log.warning("kunstwerk %(soort)s %(id)s discarded: missing %(missing)s" % kunstwerk)
+
+
+def spreadNetworkInfo(g):
+    "completes the edges of g with the info of their nodes and vice versa"
+    for edge in g.edges():
+        (begin_node, end_node) = edge[:2]
+        info = g[begin_node][end_node]
+        info = dict_to_Dict(info)
+        info.complete_with_node_info(begin_node, end_node)
+        begin_node.handle_outbound_edge(edge)
+        end_node.handle_inbound_edge(edge)
+
+
 def kunstwerkFromDict(d):
     translate = {'STUW': UitlaatStuw,
                  'GEMAAL': UitlaatGemaal,
@@ -1193,7 +2474,23 @@ class HardCodedConfig:
         return float(self.content[section.lower()][field.lower()])
 
 
-def add_defaults_from_section(object_type, obj, config, section):
+def typedDefaults(config, section):
+    """the defaults of section as a tuple of (field name, typed value).
+
+    every option is converted once, trying float, int and string in that
+    order; 'NO_DATA[.type]' values are replaced by the 'value.missing'
+    marker of that type.  the table is built once per config object and
+    cached on it, like the compiled constraints.
+    """
+
+    cache = getattr(config, 'typed_defaults', None)
+    if cache is None:
+        cache = config.typed_defaults = {}
+    try:
+        return cache[section]
+    except KeyError:
+        pass
+
     def gettyped(config, section, field):
         try:
             return config.getfloat(section, field)
@@ -1205,18 +2502,31 @@ def add_defaults_from_section(object_type, obj, config, section):
             pass
         return config.get(section, field)
 
+    table = []
     for field_name in config.options(section):
-        if field_name not in obj or obj[field_name] in [None, '']:
-            value = gettyped(config, section, field_name)
-            if isinstance(value, types.StringTypes) and value.startswith('NO_DATA'):
-                typename_of_nodata = value[len("NO_DATA."):]
-                if not typename_of_nodata:
-                    typename_of_nodata = "char"
-                value = gettyped(config, "value.missing", typename_of_nodata)
-                if value == "None":
-                    value = ""
-            log.debug("fixing missing value: %s(%s)['%s'] <- %s" % (object_type, obj['id'], field_name, value))
-            obj[field_name] = value
+        value = gettyped(config, section, field_name)
+        if isinstance(value, types.StringTypes) and value.startswith('NO_DATA'):
+            typename_of_nodata = value[len("NO_DATA."):]
+            if not typename_of_nodata:
+                typename_of_nodata = "char"
+            value = gettyped(config, "value.missing", typename_of_nodata)
+            if value == "None":
+                value = ""
+        table.append((lowercase_key(field_name), value))
+    cache[section] = table = tuple(table)
+    return table
+
+
+def add_defaults_from_section(object_type, obj, config, section):
+    """fills the fields of obj that are missing, None or '' from the
+    typed defaults table of section.
+    """
+
+    fields = obj.dict
+    for field_name, value in typedDefaults(config, section):
+        if fields.get(field_name) in (None, ''):
+            log.debug("fixing missing value: %s(%s)['%s'] <- %s", object_type, fields.get('id'), field_name, value)
+            fields[field_name] = value
 
 
 # ------------------------------------------------------------
@@ -1290,25 +2600,26 @@ def main(options, args):
         log.debug("first peilgebied has %d fields now" % len(peilgebieden[0]))
         log.debug("columns are: %s" % str(peilgebieden[0].keys()))
 
-        # complete the peilgebied information...
+        # complete the peilgebied information: read every table once
+        # and join them all in one pass.
+        conversion = settings.items('column.peilgebied')
+        tables = []
+        read = {peilgebieden_name: peilgebieden}
         for item_name in dataset.split(';'):
-            log.info("joining to table '%s' on key 'id'" % nens.gp.loggable_name(item_name))
-
-            # get the table data...
-            item = nens.gp.get_table(
-                gp, item_name,
-                conversion=settings.items('column.peilgebied'))
-            log.debug("%d rows and %d columns for table '%s'" % (len(item), len((item + [{}])[0]), item_name,))
-
-            # join it to our data
-            peilgebieden = nens.gp.join_dicts(peilgebieden, item, 'id')
-
-            log.debug("first peilgebied has %d fields after the join" % len(peilgebieden[0]))
-            log.debug("columns are: %s" % str(peilgebieden[0].keys()))
+            if item_name not in read:
+                log.info("reading table '%s' to join on key 'id'" % nens.gp.loggable_name(item_name))
+                read[item_name] = nens.gp.get_table(gp, item_name, conversion=conversion)
+                log.debug("%d rows and %d columns for table '%s'" % (len(read[item_name]), len((read[item_name] + [{}])[0]), item_name,))
+            tables.append((nens.gp.loggable_name(item_name), read[item_name]))
+
+        peilgebieden, report = joinTables(peilgebieden, tables, 'id',
+                                          [name for name, value in conversion])
+        report.log_summary()
+        log.debug("first peilgebied has %d fields after the join" % len(peilgebieden[0]))
+        log.debug("columns are: %s" % str(peilgebieden[0].keys()))
 
                 # transform to list of case-insensitive dictionaries
         peilgebieden = [Peilgebied(init=k) for k in peilgebieden]
-        peilgebieden_dict = dict([(p['id'], p) for p in peilgebieden])
 
         # TODO: validate the peilgebied information, generating
         # warning and stopping in case of error.  at this point
@@ -1335,8 +2646,9 @@ def main(options, args):
             log.debug('add hard coded defaults')
             add_defaults_from_section('peilgebied', peilgebied, hard_coded_defaults, 'default.peilgebied')
 
-            for field_name in settings.options('range.peilgebied'):
-                check[0] &= checkConstraints(peilgebied, field_name, settings)
+        report = validateTable(peilgebieden, 'peilgebied', settings)
+        report.log_summary()
+        check[0] &= report.ok()
 
         if not check[0]:
             log.error("peilgebieden did not pass validation. check above warnings.")
@@ -1375,8 +2687,10 @@ def main(options, args):
                 if field_name not in kunstwerk:
                     log.warning("kunstwerk %s misses required field %s" % (kunstwerk['id'], field_name))
                     check[1] = False
-            for field_name in settings.options('range.kunstwerk'):
-                check[1] &= checkConstraints(kunstwerk, field_name, settings)
+
+        report = validateTable(kunstwerken, 'kunstwerk', settings)
+        report.log_summary()
+        check[1] &= report.ok()
 
         if not check[1]:
             log.error("kunstwerken did not pass validation. check above warnings.")
@@ -1387,6 +2701,47 @@ def main(options, args):
         log.error("a fundamental check failed: aborting now.  please correct the above errors and try again.")
         return None
 
+    if not peilgebieden_name:
+        peilgebieden = []
+    return convertNetwork(options, peilgebieden, kunstwerken, model, inifile_name, output_dir,
+                          (peilgebieden_name, dataset, afvoer_name, kunstwerken_name,
+                           koppelpunten_name, settings.computation))
+
+
+def convertNetwork(options, peilgebieden, kunstwerken, model, inifile_name, output_dir, arguments=()):
+    """converts the peilgebieden and kunstwerken that main read and
+    validated into the network of model and writes it to the 3B files in
+    output_dir.  the settings are those of inifile_name, arguments are
+    the other run arguments that decide on the output.
+    """
+
+    peilgebieden_dict = dict([(p['id'], p) for p in peilgebieden])
+
+    # compare with the model written by the previous run into output_dir.
+    # changed settings, arguments or converter mean a full rebuild,
+    # unchanged input rows and intact output files mean there is nothing
+    # to do.  otherwise the peilgebieden whose conversion is recorded and
+    # still fits the input are reused, see convertArea.
+    state = ModelState(output_dir)
+    rows = rowFingerprints('peilgebied', peilgebieden)
+    rows.update(rowFingerprints('kunstwerk', kunstwerken))
+    # the sequential ids follow the order of the rows.
+    rows['order'] = fingerprint(([obj['id'] for obj in peilgebieden],
+                                 [obj['id'] for obj in kunstwerken]))
+    settings_fingerprint = fingerprint((file(inifile_name).read(), ) + tuple(arguments) +
+                                       (model, __revision__, moduleDigest()))
+    if not state.load() or state.settings != settings_fingerprint:
+        log.info("no previous model with these settings in %s: full rebuild" % output_dir)
+        state.clear()
+    else:
+        changed = state.changedRows(rows)
+        if not changed and state.outputIntact():
+            log.info("input rows unchanged since the previous run: output is up to date.")
+            return None
+        log.info("%d input rows changed since the previous run" % len(changed))
+        for key in changed:
+            log.debug("changed input row %s" % key)
+
     # hold here all koppelpunten...  associate the name of the
     # peilgebied with the koppelpunt for external kunstwerken.
     koppelpunten = {}
@@ -1398,250 +2753,180 @@ def main(options, args):
     else:
         missingnode_name = None
 
-    # create a directed graph in which edges can be associated to
-    # extra information
-    g = networkx.DiGraph()
-
     # zuiveringen contains all Zuivering objects created, by name.
     zuiveringen = {}
 
-    for peilgebied in peilgebieden:
-
-        log.debug('examining peilgebied %s: %s' % (peilgebied['id'], peilgebied.dict,))
-
-        openwater = OpenWater(peilgebied)
-        openwater['area'] = max(peilgebied['openwater_area'],
-                                settings.getfloat('threshold.peilgebied', 'openwater_area'))
-
-        coupled_to_openwater = []
-        forget_about_openwater = False
-        nodes_for_peilgebied = {}
-
-        for Type in [Kas, OnverhardLand, OnverhardSted, Verhard]:
-            # couple to openwater
-            type_name = Type.__name__.lower()
-            # if area above threshold, create it and connect it to
-            # koppelpunt or openwater, depending on whether koppelpunt
-            # exists or not.
-            log.debug("area of %s for %s is %s" % (type_name, peilgebied['id'], peilgebied[type_name + '_area']))
-            if type_name == 'onverhardland':
-                input_area = float(peilgebied['OnverhardLand_area'])
-            else:
-                input_area = float(peilgebied[type_name + '_area'])
-
-            if (input_area >= settings.getfloat('threshold.peilgebied', type_name + '_area')):
-
-                # koppelpunt_name is None if model is RR or if, in
-                # RR+RR_CF model with cfDirect, no "knoop" has been
-                # specified for this type for this peilgebied
-                log.debug("evaluates cfDirect field %s(%s) to True? %s" % (type(peilgebied['cfDirect']), peilgebied['cfDirect'], bool(peilgebied['cfDirect']),))
-                if peilgebied['cfDirect']:
-                    koppelpunt_name = peilgebied.get(type_name + '_knoop', missingnode_name)
-                    log.debug('looking into peilgebied %s for field %s, got %s(%s)' % (peilgebied['id'], type_name + '_knoop', type(koppelpunt_name), koppelpunt_name,))
-                else:
-                    koppelpunt_name = None
+    # the area nodes of the peilgebieden do not depend on each other, so
+    # they can be built by a pool of processes.  coupling them into the
+    # network stays serial and in peilgebied order, so that sequential()
+    # hands out the same ids as in a serial run.
+    processes = options.get('processes')
+    if processes is None and settings.has_option('globals', 'processes'):
+        processes = settings.getint('globals', 'processes')
+
+    # every peilgebied is converted on its own: its nodes and edges are
+    # final once it is validated and only the nodes shared between
+    # peilgebieden stay in memory until the kunstwerken are added.  that
+    # does not hold for shared koppelpunten named 'cf_node_', which
+    # validateNetwork may remove.
+    shared_names = sharedNames(peilgebieden, kunstwerken, model)
+    separate = not [name for name in shared_names if name.startswith('cf_node_')]
+    if not separate:
+        log.info("koppelpunt names starting with 'cf_node_' need the whole network: converting it at once")
+
+    # the network dump is only written on request, to the file named by
+    # the option or the setting, and needs the whole network.
+    network_dump = options.get('network_dump')
+    if network_dump is None and settings.has_option('globals', 'network_dump'):
+        network_dump = settings.get('globals', 'network_dump').strip()
+    if network_dump and separate:
+        log.info("network dump to %s needs the whole network: converting it at once" % network_dump)
+        separate = False
+
+    # in streaming mode the peilgebieden are converted in batches, that
+    # go to sorted runs on disk instead of to the model state.
+    batch_size = options.get('batch_size')
+    if batch_size is None and settings.has_option('globals', 'batch_size'):
+        batch_size = settings.getint('globals', 'batch_size')
+    if batch_size and not separate:
+        batch_size = None
+    if batch_size:
+        log.info("streaming the conversion in batches of %d peilgebieden" % batch_size)
+        stream = NetworkStream(output_dir)
+    else:
+        stream = None
 
-                if isinstance(koppelpunt_name, types.StringTypes):
-                    if koppelpunt_name:
-                        id = koppelpunt_name
+    # create a directed graph in which edges can be associated to
+    # extra information
+    g = networkx.DiGraph()
+    report = NetworkReport()
+    written = set()
+    units = {}
+    runs = []
+    names = set()
+    try:
+        if separate and stream is None:
+            todo = [index for index, peilgebied in enumerate(peilgebieden)
+                    if state.units.get(peilgebied['id'], {}).get('row') != rows['peilgebied:%s' % peilgebied['id']]]
+            area_nodes = {}
+            if processes and processes > 1 and len(todo) > 1:
+                log.info("building the area nodes with %d processes" % processes)
+                built = parallelAreaNodes([peilgebieden[index] for index in todo],
+                                          inifile_name, settings.computation, processes)
+                area_nodes = dict(zip(todo, built))
+
+            base = sequential.id
+            for index, peilgebied in enumerate(peilgebieden):
+                key = peilgebied['id']
+                row = rows['peilgebied:%s' % key]
+                start = sequential.id - base
+                unit = state.units.get(key)
+                if key in units or not reuseArea(unit, peilgebied, koppelpunten, zuiveringen, shared_names,
+                                                 written, peilgebieden_dict, row, start):
+                    log.debug('examining peilgebied %s: %s', key, peilgebied.dict)
+                    if index in area_nodes:
+                        openwater, created = area_nodes.pop(index)
                     else:
-                        id = 'cf_node_' + sequential()
-                    koppelpunten.setdefault(id, KoppelPunt(id=id, peilgebied=peilgebied))
-                    log.debug("adding edge from %s to %s" % (type_name, id))
-                    nodes_for_peilgebied[type_name] = Type(peilgebied)
-                    g.add_edge(nodes_for_peilgebied[type_name],
-                               koppelpunten[id],
-                               OppervlakLink().as_dict())
-                    # if any object is connected to koppelpunt instead of
-                    # to openwater, forget about the openwater component
-                    forget_about_openwater = True
+                        openwater, created = createAreaNodes(peilgebied)
+                    unit = convertArea(peilgebied, openwater, created, koppelpunten, zuiveringen,
+                                       missingnode_name, shared_names, written, row, start)
+                if key in units:
+                    log.warning("peilgebied id %s is not unique: it is converted on every run" % key)
+                    names.update(changedNames([], unit['records']))
                 else:
-                    coupled_to_openwater.append(Type(peilgebied))
-
-        # if any object is connected to koppelpunt, create an
-        # externKwkKnp, otherwise store openwater in externKwkKnp
-
-        if forget_about_openwater:
-            desc = "CF node"
-            externKwkKnp = KoppelPunt(peilgebied=peilgebied)
+                    units[key] = unit
+                runs.append(unit['records'])
+                report.removed_nodes.extend(unit['removed'][0])
+                report.removed_edges.extend(unit['removed'][1])
+
+            reused = [key for key in units if units[key] is state.units.get(key)]
+            log.info("%d peilgebieden reused from the previous run, %d converted" %
+                     (len(reused), len(peilgebieden) - len(reused)))
+            for key in set(state.units).union(units):
+                old, new = state.units.get(key), units.get(key)
+                if old is not new:
+                    names.update(changedNames(old and old['records'] or [],
+                                              new and new['records'] or []))
         else:
-            desc = "openwater"
-            externKwkKnp = openwater
-            koppelpunten[peilgebied['id']] = openwater
-
-        for obj in coupled_to_openwater:
-            type_name = obj.__class__.__name__.lower()
-            log.debug("adding edge from %s to %s" % (type_name, desc))
-            nodes_for_peilgebied[type_name] = obj
-            g.add_edge(obj, externKwkKnp, OppervlakLink().as_dict())
-
-        # rioolaansluitingen
-
-        if peilgebied['typeriool']:
-            if 'verhard' not in nodes_for_peilgebied:
-                log.warning('settings dictate a waste water connection, but no paved area has been created')
-            else:
-                log.debug('creating waste water connections')
-                obj = nodes_for_peilgebied['verhard']
-
-                if peilgebied['zuivering'] and peilgebied['zuivering'] != settings.get('dictionary.peilgebied.naam', 'boundary'):
-                    if peilgebied['zuivering'] not in zuiveringen:
-                        log.debug("create Zuivering '%s' and connect it to Boundary via RioolLink."
-                                  % peilgebied['zuivering'])
-                        zuivering = Zuivering(peilgebied)
-                        zuiveringen[peilgebied['zuivering']] = zuivering
-                        g.add_edge(zuivering, Boundary(bl="0 0.00", isc=0, cause=zuivering), RioolLink().as_dict())
-                    log.debug("connect 'verhard' object to zuivering '%s' via RioolLink."
-                              % peilgebied['zuivering'])
-                    zuivering = zuiveringen[peilgebied['zuivering']]
-                    g.add_edge(obj, zuivering, RioolLink().as_dict())
-
+            step = batch_size or max(len(peilgebieden), 1)
+            for start in range(0, len(peilgebieden), step):
+                batch = peilgebieden[start:start + step]
+                if stream is None:
+                    network = g
                 else:
-                    log.debug("connect 'verhard' object to Boundary via RioolLink.")
-                    g.add_edge(obj, Boundary(bl='0 0.00', isc=0, cause=obj), RioolLink().as_dict())
+                    network = networkx.DiGraph()
 
-    # prepare the kunstwerk dictionary for RR/RR_CF/MX
-    # if RR: zero all 'cfkoppelknoop' information
+                if processes and processes > 1 and len(batch) > 1:
+                    log.info("building the area nodes with %d processes" % processes)
+                    area_nodes = parallelAreaNodes(batch, inifile_name, settings.computation, processes)
+                else:
+                    area_nodes = None
 
-    if model == 'RR':
-        for k in kunstwerken:
-            k['cfkoppelknoop'] = None
-    elif model == 'RR_CF' and kunstwerken:
-        log.info("kunstwerken dictionary not empty while doing a RR_CF computation.  if you're not doing 'indirect', you will be warned about kunstwerken that have to be ignored (relative to a directly connected peilgebied).")
+                for index, peilgebied in enumerate(batch):
+                    log.debug('examining peilgebied %s: %s', peilgebied['id'], peilgebied.dict)
+                    if area_nodes is None:
+                        openwater, created = createAreaNodes(peilgebied)
+                    else:
+                        openwater, created = area_nodes[index]
+                    coupleAreaNodes(network, peilgebied, openwater, created,
+                                    koppelpunten, zuiveringen, missingnode_name)
+
+                if stream is not None:
+                    log.debug("streaming peilgebieden %d to %d" % (start, start + len(batch)))
+                    spreadNetworkInfo(network)
+                    report.update(validateNetwork(network))
+                    stream.addRun(networkRecords(network, written))
+                    for name in koppelpunten.keys():
+                        if name not in shared_names:
+                            del koppelpunten[name]
+                    shared = set(koppelpunten.values())
+                    shared.update(zuiveringen.values())
+                    written.update(node for node in network.nodes() if node in shared)
+                    for peilgebied in batch:
+                        # the back reference is not used after construction.
+                        peilgebied.dict.pop('ow', None)
+
+        # prepare the kunstwerk dictionary for RR/RR_CF/MX
+        # if RR: zero all 'cfkoppelknoop' information
 
-    for kunstwerk in kunstwerken:
         if model == 'RR':
-            naarField = 'naarRRKnoop'
-        elif model == 'RR_CF':
-            naarField = 'naarCFKnoop'
+            for k in kunstwerken:
+                k['cfkoppelknoop'] = None
+        elif model == 'RR_CF' and kunstwerken:
+            log.info("kunstwerken dictionary not empty while doing a RR_CF computation.  if you're not doing 'indirect', you will be warned about kunstwerken that have to be ignored (relative to a directly connected peilgebied).")
+
+        addKunstwerken(g, kunstwerken, koppelpunten, peilgebieden_dict, model)
+
+        log.info("spreading network information")
+        spreadNetworkInfo(g)
+
+        log.info('validating the network')
+        report.update(validateNetwork(g))
+        report.log_summary()
+
+        if network_dump:
+            dumpNetwork(g, network_dump)
+
+        log.info("writing to output - start")
+        if stream is not None:
+            replaced = writeNetwork(g, output_dir, state=state, runs=stream.runs(), skip=written)
+            state.units, state.network = {}, []
+        elif separate:
+            network = list(fragmentRecords(networkRecords(g, written)))
+            names.update(changedNames(state.network, network))
+            runs.append(network)
+            replaced = writeNetwork(None, output_dir, state=state, runs=runs, names=names)
+            state.units, state.network = units, network
         else:
-            naarField = 'naar%sKnoop' % kunstwerk['typeNaarKnoop']
-
-        vanknoop, naarknoop = kunstwerk['vanknoop'], kunstwerk[naarField]
-        log.debug(("%(soort)s %(id)s: %(vanknoop)s -> %(" + naarField + ")s") % kunstwerk)
-
-        # vanknoop and naarknoop are the names of peilgebieden or of
-        # CF koppelpunten.  if it's a KoppelPunt, that's what you
-        # need.  if it's a Peilgebied, use the koppelpunten dictionary
-        # to get the koppelpunt of the named peilgebied (will be
-        # OpenWater or again KoppelPunt.)  whichever the case, after
-        # translation of the name you remain at both ends of the
-        # kunstwerk with OpenWater or KoppelPunt.  notice that also
-        # the case 'Boundary' is to be considered a CF KoppelPunt.
-
-        # setting coordinates taking them from the OpenWater of
-        # preferably the 'vanknoop' and otherwise the 'naarknoop'
-        # peigebied.  remove the kunstwerk if no OpenWater.
-        connecting = [n for n in [vanknoop, naarknoop]
-                      if n in koppelpunten and isinstance(koppelpunten[n], OpenWater)]
-        if len(connecting) == 0:
-            log.warn("%(soort)s %(id)s is not linking any OpenWater.  not adding it to the network." % kunstwerk)
-            continue
-
-        if 'xcoord' not in kunstwerk:
-            # using the first one (maybe the only one)
-            log.debug('assigning fictive coordinates to %(soort)s %(id)s' % kunstwerk)
-            kunstwerk['xcoord'], kunstwerk['ycoord'] = koppelpunten[connecting[0]].getNextKwkPosition()
-
-        # here we have a geographically localized kunstwerk coupling
-        # things...  we still don't know what kind of things...  let's
-        # translate the names of the two extremes into
-        # OpenWater/KoppelPunt/Boundary
-
-        for extreme in [vanknoop, naarknoop]:
-            # if extreme is 'boundary', create new boundary node
-            if extreme == settings.get('dictionary.peilgebied.naam', 'boundary'):
-                log.debug("translating %s to Boundary object" % extreme)
-                koppelpunten[extreme] = Boundary(bl="0 %(boundPeil).2f" % kunstwerk,
-                                                 isc=0, cause=kunstwerk)
-            elif extreme not in peilgebieden_dict:
-                # it's the name of a KoppelPung, which we probably must add...
-                if extreme in koppelpunten:
-                    log.debug("reusing already created KoppelPunt")
-                else:
-                    koppelpunten[extreme] = KoppelPunt(id=extreme,
-                                                       peilgebied=peilgebieden_dict[connecting[0]],
-                                                       xcoord=kunstwerk['xcoord'] + 25,
-                                                       ycoord=kunstwerk['ycoord'])
-
-        try:
-            # add kunstwerk to graph
-            g.add_edge(koppelpunten[vanknoop], kunstwerk, OppervlakLink().as_dict())
-            g.add_edge(kunstwerk, koppelpunten[naarknoop], OppervlakLink().as_dict())
-            log.debug("kunstwerk added to graph: %s" % kunstwerk.as_dict())
-        except KeyError, e:
-            kunstwerk['missing'] = e
-            log.warning("kunstwerk %(soort)s %(id)s discarded: missing %(missing)s" % kunstwerk)
-
-    log.info("spreading network information")
-    for edge in g.edges():
-        (begin_node, end_node) = edge[:2]
-        info = g[begin_node][end_node]
-        info = dict_to_Dict(info)
-        info.complete_with_node_info(begin_node, end_node)
-        begin_node.handle_outbound_edge(edge)
-        end_node.handle_inbound_edge(edge)
-
-    log.info('validating the network')
-    for node in [item for item in g.nodes() if isinstance(item, (OpenWater, Verhard, Onverhard, Kas))]:
-        # check node is not connected to any 'cf_node_' node: these
-        # are fictive nodes that have been generated just to be
-        # removed here...
-        fictive_neighbors = [item for item in g.neighbors(node)
-                             if isinstance(item, (KoppelPunt, Boundary))
-                             and item['id'].startswith('cf_node_')]
-        for fn in fictive_neighbors:
-            log.warn('node %s has link to non existing CF node' % node['id'])
-            g.remove_node(fn)
-
-        # check that node is not directly connected to both a named CF
-        # node and a boundary node.  this test can be limited to paved
-        # urban nodes.
-
-        # TODO 20080721 there must be some option so that the user can choose
-        # between this warning and creating a new fictive wwtp in
-        # order to connect the paved urban node to boundary via
-        # sewage.
-        if isinstance(node, Verhard):
-            neighbors = [item for item in g.neighbors(node) if isinstance(item, (KoppelPunt, Boundary))]
-            if len(neighbors) > 1:
-                log.warn('node %s is directly coupled to too many Boundary nodes, removing sewage link' % (node['id'],))
-                for neighbor in [item for item in neighbors if isinstance(item, Boundary)]:
-                    g.remove_edge(node, neighbor)
-                    if len(g.neighbors(neighbor)) == 0:
-                        g.remove_node(neighbor)
-
-    log.debug("network contains...")
-    log.debug('...compact form:')
-    g_nodes_id_sorted = [item['id'] for item in g.nodes()]
-    g_nodes_id_sorted.sort()
-    for node in g_nodes_id_sorted:
-        log.debug("node (%s)" % (node,))
-    for edge in g.edges():
-        (bn, en) = edge[:2]
-        log.debug("edge (%s)->(%s)" % (bn['id'], en['id'],))
-
-    log.debug('...verbose form:')
-    for node in g.nodes():
-        log.debug("node (%s): %s" % (node['id'], node.dict,))
-    for edge in g.edges():
-        (bn, en) = edge[:2]
-        info = g[bn][en]
-        log.debug("edge (%s)->(%s): %s" % (bn['id'], en['id'], info))
-
-    log.info("writing to output - start")
-    pool = createPool(output_dir)
-    startupPool(pool)
-    for node in g.nodes():
-        node.write(pool)
-    for edge in g.edges():
-        (bn, en) = edge[:2]
-        info = g[bn][en]
-        info = dict_to_Dict(info)
-        info.write(pool)
-    closePool(pool)
-    log.info("output written.")
-
+            replaced = writeNetwork(g, output_dir, state=state)
+            state.units, state.network = {}, []
+    finally:
+        if stream is not None:
+            stream.close()
+    state.settings = settings_fingerprint
+    state.rows = rows
+    state.save()
+    log.info("output written, %d files replaced: %s" % (len(replaced), ', '.join(replaced)))
 
 if __name__ == '__main__':
     log.warn("module loaded, no tests defined, no action taken.")
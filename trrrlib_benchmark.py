@@ -0,0 +1,349 @@
+# (c) Nelen & Schuurmans. GPL licensed, see LICENSE.txt
+# -*- coding: utf-8 -*-
+"""Output and construction throughput benchmark for trrrlib.
+
+Generates a synthetic polder of peilgebieden, each with its open water,
+paved, unpaved (rural and urban) and greenhouse nodes, an outlet weir and
+a pumping station and the links between them, writes the network to a
+pool of 3B files and prints one JSON line per measurement:
+
+    python trrrlib_benchmark.py --scales 1,10 --repeat 3 -o bench.jsonl
+
+Every line holds the git revision, the scale, the operation, the best
+time of the repeats, objects/s and MB/s (written bytes over time).  The
+model only depends on the seed and the scale, so runs on different
+commits can be compared line by line; with --digest the lines also carry
+the md5 of the written files, which must not change between commits.
+
+The construct_objects operation builds the same kind of polder from table
+rows the way trrrlib.main does, with the settings of
+rr_default_settings.ini: the peilgebied defaults, the area nodes of every
+peilgebied and its kunstwerken.  Its objects/s is the construction
+throughput, to be compared between commits as well.
+"""
+
+import gc
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from ConfigParser import ConfigParser
+from optparse import OptionParser
+
+import trrrlib
+
+# Number of peilgebieden at scale 1.
+BASE_COUNT = 1000
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'rr_default_settings.ini')
+
+SETTINGS = {
+    'globals': {'waterusepppday': '120'},
+    'default.kunstwerk': {},
+    'default.stuw': {'inlet_flushing_flow': '0.0'},
+    'default.gemaal': {'on_low': '-0.1', 'off_low': '-0.2',
+                       'on_high': '0.1', 'off_high': '0.0'},
+    'default.inlaatgemaal': {'on_low': '-0.3', 'off_low': '-0.2',
+                             'on_high': '0.1', 'off_high': '0.0'},
+    'dictionary.kunstwerk.controlType': {'trap': 'trap', 'auto': 'auto',
+                                         'equal': 'equal', 'fixed': 'fixed'},
+    'range.peilgebied': {'datumWinterZomer': 'DDMM'},
+    }
+
+AREAS = ['grass', 'corn', 'potato', 'beet', 'grain', 'misc', 'nonarab',
+         'greenhouse', 'orchard', 'bulbous', 'foliage', 'pine', 'nature',
+         'fallow', 'vegetable', 'flower']
+
+
+def git_revision():
+    """Returns the current commit of the repository, or None."""
+    try:
+        out = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'],
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+    except OSError:
+        return None
+    return out.decode('ascii').strip() or None
+
+
+def settings(computation):
+    config = ConfigParser()
+    config.optionxform = str
+    for section, items in SETTINGS.items():
+        config.add_section(section)
+        for key, value in items.items():
+            config.set(section, key, value)
+    config.computation = computation
+    return config
+
+
+def record(cls, **fields):
+    """Returns a cls object holding exactly fields, as the constructors
+    would leave it after reading the tables."""
+    obj = cls.__new__(cls)
+    obj.dict = dict((key.lower(), value) for key, value in fields.items())
+    return obj
+
+
+def node_fields(rng, ident, x, y, **fields):
+    fields.update({'id': ident, 'nm': ident, 'mt': 1, 'nt': 40 + rng.randint(3, 9),
+                   'type_id': '3B_NODE', 'xcoord': x, 'ycoord': y,
+                   'meteo_station': 'De Bilt', 'peilgebied': None})
+    return fields
+
+
+def unpaved(rng, cls, ident, x, y):
+    fields = node_fields(rng, ident, x, y)
+    for name in AREAS:
+        fields['area_' + name] = rng.randint(0, 50000)
+    fields.update({
+        'groundw_area': rng.randint(10000, 500000), 'level': rng.uniform(-6, 2),
+        'ground_comp_type': 3, 'use_scurve': 0, 'scurve_def': ident + '_sc',
+        'storage_def': ident + '_sto', 'storage_comp': '', 'alfa_def': ident + '_alf',
+        'seepage_def': ident + '_sep', 'infilt_cap_def': ident + '_inf',
+        'soil_type': rng.randint(101, 121), 'ini_groundwater': 'ig 0.35',
+        'groundlayer': rng.uniform(0.5, 3), 'isc': 0.0,
+        'scurve_table': ''.join([" %.2f %.2f <\n" % (k / 10.0, rng.uniform(-6, 2))
+                                 for k in range(11)]),
+        'land_storage': 1.0, 'initial_land_storage': 0.0, 'kwel': rng.uniform(-1, 1),
+        'kwel_salt_concentration': 0.0, 'kwel_resist_C': 1000.0,
+        'inf_cap': rng.uniform(1, 50), 'alfa_land': 0.1, 'alfa_infiltratie': 3.0,
+        'ws_0': 0.5, 'ws_1': 0.5, 'ws_2': 0.5, 'ws_3': 0.5,
+        'dp_0': 0.0, 'dp_1': 0.5, 'dp_2': 1.0,
+        })
+    return record(cls, **fields)
+
+
+def polder(scale, seed):
+    """Returns (nodes, edges) of a synthetic polder at the given scale."""
+    rng = random.Random(seed)
+    nodes = []
+    edges = []
+
+    def link(bn, en, cls=trrrlib.OppervlakLink):
+        edge = cls(bn=bn['id'], en=en['id'])
+        edge['id'] = '%s_%s' % (bn['id'], en['id'])
+        edges.append(edge)
+
+    for i in range(BASE_COUNT * scale):
+        gid = 'GPG%06d' % i
+        x = 100000 + 1000 * (i % 100)
+        y = 400000 + 1000 * (i // 100)
+        winterpeil = rng.uniform(-6, 1)
+        openwater = record(trrrlib.OpenWater, **node_fields(
+                rng, gid, x, y, max_peil=winterpeil + 0.5,
+                storage_opp_string=' '.join(['%d' % rng.randint(1000, 90000)] * 6),
+                storage_level_string=' '.join(['%.2f' % (winterpeil + k / 10.0) for k in range(6)]),
+                bottom_level=winterpeil - 1.5, targetlevel_def=gid + '_tl',
+                seepage_def=gid + '_sep', ini_salt_concentration=0.0,
+                kwel=rng.uniform(-1, 1), kwel_salt_concentration=0.0,
+                kwel_resist_C=1000.0, blokfunctie=1, winterpeil=winterpeil,
+                zomerpeil=winterpeil + 0.2, date_winzom='1504', date_zomwin='1510'))
+        paved = record(trrrlib.Verhard, **node_fields(
+                rng, gid + '_pv', x, y - 25, area=rng.randint(1000, 90000),
+                level=winterpeil + 1, storage_def=gid + '_pv_sto',
+                sewer_system_type=rng.randint(0, 2), mixed_cap=rng.uniform(0, 1),
+                vgs_cap=rng.uniform(0, 1), qo="0 0", ini_salt_concentration=0.0,
+                number_people=rng.randint(0, 5000), paved_runoff_coefficient=None,
+                street_storage=1.0, sewer_storage=5.0, initial_sewer_storage=0.0))
+        greenhouse = record(trrrlib.Kas, **node_fields(
+                rng, gid + '_gh', x + 25, y + 25, nr_areas=10,
+                storage_areas=' '.join(['%d' % rng.randint(0, 9000)] * 10),
+                surface_level=winterpeil + 1, roofstorage_def=gid + '_gh_sto',
+                max_roof_berging=2.0, ini_roof_berging=0.0))
+        areas = [unpaved(rng, trrrlib.OnverhardLand, gid + '_ur', x - 25, y),
+                 unpaved(rng, trrrlib.OnverhardSted, gid + '_us', x + 25, y),
+                 paved, greenhouse]
+        weir = trrrlib.UitlaatStuw(
+            ID=gid + '_stuw', soort='stuw', xcoord=x + 50, ycoord=y,
+            controlType=['auto', 'equal', 'fixed'][i % 3], dischcoef=1.0,
+            kruinhoogte=winterpeil - 0.1, kruinbreedte=rng.uniform(1, 5), powercoef=1.5,
+            maxflow=rng.uniform(0, 2), p_mf2=rng.uniform(0, 20), maxpeil=winterpeil + 0.5)
+        pump = trrrlib.UitlaatGemaal(
+            ID=gid + '_gemaal', soort='gemaal', xcoord=x + 50, ycoord=y + 25,
+            gemaalLaag=rng.uniform(1, 100), gemaalHoog=rng.uniform(100, 200))
+        nodes.extend([openwater] + areas + [weir, pump])
+        for area in areas:
+            link(area, openwater)
+        link(openwater, weir)
+        link(openwater, pump)
+    return nodes, edges
+
+
+def table_rows(scale, seed):
+    """Returns (peilgebied rows, kunstwerk rows) of a synthetic polder, as
+    nens.gp.get_table would return them."""
+    rng = random.Random(seed)
+    peilgebieden = []
+    kunstwerken = []
+    for i in range(BASE_COUNT * scale):
+        gid = 'GPG%06d' % i
+        winterpeil = round(rng.uniform(-6, 1), 2)
+        total = rng.uniform(50000, 500000)
+        peilgebieden.append({
+            'id': gid, 'xcoord': 100000.0 + 1000 * (i % 100), 'ycoord': 400000.0 + 1000 * (i // 100),
+            'gebiedsnaam': 'peilgebied %d' % i, 'total_area': total,
+            'openwater_area': total * 0.05, 'verhard_area': rng.choice([0, total * 0.1]),
+            'OnverhardSted_area': total * 0.1, 'kas_area': rng.choice([0, 0, total * 0.02]),
+            'OnverhardLand_area': total * 0.6, 'grass_area': total * 0.5, 'nature_area': total * 0.1,
+            'winterPeil': winterpeil, 'zomerPeil': winterpeil + 0.2, 'maxPeil': winterpeil + 0.5,
+            'TOTAFVOPPERVLAK': total, 'AFVCAPHA': 14.0, 'insteek_wg': winterpeil + 1,
+            'maaiveldHgt': dict((k, winterpeil + 0.5 + k * 0.03) for k in range(101)),
+            'maaiveldKassen': winterpeil + 1, 'maaiveldOnv': winterpeil + 1,
+            'maaiveldVerh': winterpeil + 1, 'cfDirect': None,
+            'zuivering': rng.choice(['', 'rwzi_a', 'rwzi_b']),
+            'typeRiool': rng.choice(['GEMENGD', 'GESCHEIDEN', 'VERBETERD']),
+            })
+        for soort in ('STUW', 'GEMAAL'):
+            kunstwerken.append({
+                'id': '%s_%s' % (gid, soort.lower()), 'soort': soort,
+                'vanknoop': gid, 'naarRRKnoop': 'GPG%06d' % (i + 1),
+                'controlType': rng.choice(['VAST', 'AUTO', 'GELIJK']),
+                'kruinHoogte': winterpeil - 0.1, 'kruinBreedte': rng.uniform(1, 5),
+                'gemaalLaag': rng.uniform(1, 100), 'gemaalHoog': rng.uniform(100, 200),
+                'deelVanAfvoer': 100.0})
+    return peilgebieden, kunstwerken
+
+
+def construct_objects(peilgebieden, kunstwerken):
+    """Builds the objects of the rows the way trrrlib.main does, returns
+    the number of objects built."""
+    hard_coded_defaults = trrrlib.HardCodedConfig('default.peilgebied', {
+        'openwater_area': 0.0, 'verhard_area': 0.0, 'onverhardsted_area': 0.0,
+        'onverhardland_area': 0.0, 'kas_area': 0.0})
+    count = 0
+    for row in peilgebieden:
+        peilgebied = trrrlib.Peilgebied(init=row)
+        trrrlib.add_defaults_from_section('peilgebied', peilgebied, trrrlib.settings, 'default.peilgebied')
+        trrrlib.add_defaults_from_section('peilgebied', peilgebied, hard_coded_defaults, 'default.peilgebied')
+        openwater, created = trrrlib.createAreaNodes(peilgebied)
+        count += 2 + len(created)
+    for row in kunstwerken:
+        trrrlib.kunstwerkFromDict(row)
+        count += 1
+    return count
+
+
+def write_objects(output_dir, nodes, edges):
+    """Writes the model the way trrrlib.main writes the network."""
+    pool = trrrlib.createPool(output_dir)
+    trrrlib.startupPool(pool)
+    for node in nodes:
+        node.write(pool)
+    for edge in edges:
+        edge.write(pool)
+    trrrlib.closePool(pool)
+
+
+def output_size(output_dir):
+    return sum(os.path.getsize(os.path.join(output_dir, name))
+               for name in os.listdir(output_dir))
+
+
+def output_digest(output_dir):
+    digest = hashlib.md5()
+    for name in sorted(os.listdir(output_dir)):
+        digest.update(name)
+        digest.update(open(os.path.join(output_dir, name), 'rb').read())
+    return digest.hexdigest()
+
+
+def measure(func, repeat):
+    """Returns the best wall clock time of func over repeat runs."""
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run(scales, repeat, seed, workdir, digest):
+    revision = git_revision()
+    for scale in scales:
+        for computation in ('ernst', 'zeeuw'):
+            trrrlib.settings = settings(computation)
+            nodes, edges = polder(scale, seed)
+            output_dir = os.path.join(workdir, '%s_%s' % (computation, scale))
+            os.mkdir(output_dir)
+            elapsed = measure(lambda: write_objects(output_dir, nodes, edges), repeat)
+            size = output_size(output_dir)
+            objects = len(nodes) + len(edges)
+            result = {
+                'revision': revision,
+                'python': platform.python_version(),
+                'scale': scale,
+                'computation': computation,
+                'operation': 'write_objects',
+                'objects': objects,
+                'megabytes': round(size / 1e6, 3),
+                'seconds': round(elapsed, 6),
+                'objects_per_s': round(objects / elapsed, 1),
+                'mb_per_s': round(size / 1e6 / elapsed, 3),
+                }
+            if digest:
+                result['md5'] = output_digest(output_dir)
+            yield result
+
+            trrrlib.settings = trrrlib.Config(SETTINGS_FILE)
+            trrrlib.settings.computation = computation
+            peilgebieden, kunstwerken = table_rows(scale, seed)
+            objects = construct_objects(peilgebieden, kunstwerken)
+            elapsed = measure(lambda: construct_objects(peilgebieden, kunstwerken), repeat)
+            yield {
+                'revision': revision,
+                'python': platform.python_version(),
+                'scale': scale,
+                'computation': computation,
+                'operation': 'construct_objects',
+                'objects': objects,
+                'seconds': round(elapsed, 6),
+                'objects_per_s': round(objects / elapsed, 1),
+                }
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--scales', default='1,10',
+                      help="comma separated model scales, 1 is %d peilgebieden (default 1,10)" % BASE_COUNT)
+    parser.add_option('--repeat', type='int', default=3,
+                      help="repeats per operation, the best time counts (default 3)")
+    parser.add_option('--seed', type='int', default=1,
+                      help="random seed of the synthetic model (default 1)")
+    parser.add_option('--digest', action='store_true', default=False,
+                      help="add the md5 of the written files to every line")
+    parser.add_option('-o', '--output',
+                      help="append the JSON lines to this file instead of stdout")
+    options, args = parser.parse_args()
+    # only the writing and building are measured, not the debug logging
+    # around them.
+    logging.getLogger('nens.trrrlib').setLevel(logging.WARNING)
+    scales = [int(scale) for scale in options.scales.split(',')]
+    workdir = tempfile.mkdtemp(prefix='trrrlib_benchmark_')
+    if options.output:
+        out = open(options.output, 'a')
+    else:
+        out = sys.stdout
+    try:
+        for result in run(scales, options.repeat, options.seed, workdir, options.digest):
+            out.write(json.dumps(result, sort_keys=True) + '\n')
+            out.flush()
+    finally:
+        if options.output:
+            out.close()
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+# (c) Nelen & Schuurmans. GPL licensed, see LICENSE.txt
+# -*- coding: utf-8 -*-
+"""Regression check for the re-runs of trrrlib.
+
+A conversion into an output directory that holds a previous model reuses
+the peilgebieden whose input did not change (see trrrlib.convertArea).
+This script converts a synthetic polder, changes its rows, converts it
+again into the same directory and compares the files with those of a
+fresh conversion of the changed rows in an empty directory:
+
+    python trrrlib_incremental_check.py --count 60
+
+It prints one line per model and change and exits with status 1 if any
+re-run gives other files than the fresh run, or reuses no peilgebied at
+all.  The logging is set up the way the rural_rr_conversie and
+rural_rrcf_conversie entry points do it.
+"""
+
+import copy
+import logging
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+from optparse import OptionParser
+
+import trrrlib
+
+SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'rr_default_settings.ini')
+
+MODELS = ['RR', 'RR_CF']
+
+
+def table_rows(count, seed):
+    """Returns (peilgebied rows, kunstwerk rows) of a synthetic polder, as
+    nens.gp.get_table would return them.  every third peilgebied is
+    coupled directly to CF koppelpunten, some of them shared."""
+    rng = random.Random(seed)
+    peilgebieden = []
+    kunstwerken = []
+    for i in range(count):
+        gid = 'GPG%05d' % i
+        winterpeil = round(rng.uniform(-5, 0), 2)
+        total = rng.uniform(50, 500)
+        row = {
+            'id': gid, 'xcoord': 100000.0 + 1000 * (i % 50), 'ycoord': 400000.0 + 1000 * (i // 50),
+            'gebiedsnaam': 'peilgebied %d' % i, 'total_area': total,
+            'openwater_area': total * 0.05, 'verhard_area': rng.choice([0, total * 0.1]),
+            'OnverhardSted_area': total * 0.1, 'kas_area': rng.choice([0, 0, total * 0.02]),
+            'OnverhardLand_area': total * 0.6, 'grass_area': total * 0.5, 'nature_area': total * 0.1,
+            'winterPeil': winterpeil, 'zomerPeil': winterpeil + 0.2, 'maxPeil': winterpeil + 0.5,
+            'TOTAFVOPPERVLAK': total, 'AFVCAPHA': 14.0, 'insteek_wg': winterpeil + 1,
+            'maaiveldHgt': dict((k, winterpeil + 0.5 + k * 0.03) for k in range(101)),
+            'maaiveldKassen': winterpeil + 1, 'maaiveldOnv': winterpeil + 1,
+            'maaiveldVerh': winterpeil + 1, 'cfDirect': None,
+            'zuivering': rng.choice(['', 'rwzi_a', 'rwzi_b']),
+            'typeRiool': rng.choice(['GEMENGD', '']),
+            }
+        if i % 3 == 0:
+            row.update({'cfDirect': 1, 'kas_knoop': '', 'verhard_knoop': 'CF_%d' % (i // 6),
+                        'onverhardsted_knoop': ''})
+        peilgebieden.append(row)
+    for i in range(count):
+        if i < count - 1:
+            naar = 'GPG%05d' % (i + 1)
+        else:
+            naar = 'BOUND'
+        kunstwerken.append({
+            'id': 'KW%05d' % i, 'soort': rng.choice(['STUW', 'GEMAAL']),
+            'vanknoop': 'GPG%05d' % i, 'naarRRKnoop': naar, 'naarCFKnoop': 'CF_K%d' % i,
+            'controlType': rng.choice(['VAST', 'AUTO', 'GELIJK']),
+            'kruinHoogte': -1.0, 'kruinBreedte': 2.0, 'gemaalLaag': 10.0, 'gemaalHoog': 20.0,
+            'deelVanAfvoer': 100.0, 'inlet_flow': 1.0, 'boundPeil': -1.0})
+    return peilgebieden, kunstwerken
+
+
+def change_level(peilgebieden, kunstwerken):
+    peilgebieden[5]['winterPeil'] -= 0.1
+
+
+def change_zuivering(peilgebieden, kunstwerken):
+    for row in peilgebieden:
+        if row['zuivering'] == 'rwzi_a':
+            row['zuivering'] = 'rwzi_c'
+            break
+
+
+def cross_threshold(peilgebieden, kunstwerken):
+    for i in (4, 10):
+        row = peilgebieden[i]
+        if row['kas_area']:
+            row['kas_area'] = 0
+        else:
+            row['kas_area'] = row['total_area'] * 0.02
+
+
+def new_koppelpunt(peilgebieden, kunstwerken):
+    peilgebieden[6]['verhard_knoop'] = 'CF_new'
+    peilgebieden[9]['verhard_knoop'] = ''
+
+
+def couple_directly(peilgebieden, kunstwerken):
+    peilgebieden[1].update({'cfDirect': 1, 'kas_knoop': '', 'verhard_knoop': '',
+                            'onverhardsted_knoop': 'CF_0'})
+
+
+def drop_row(peilgebieden, kunstwerken):
+    del peilgebieden[7]
+
+
+def add_row(peilgebieden, kunstwerken):
+    row = copy.deepcopy(peilgebieden[3])
+    row['id'] = 'GPG99999'
+    peilgebieden.insert(12, row)
+
+
+def swap_rows(peilgebieden, kunstwerken):
+    peilgebieden[2], peilgebieden[20] = peilgebieden[20], peilgebieden[2]
+
+
+def change_kunstwerk(peilgebieden, kunstwerken):
+    kunstwerken[3]['vanknoop'] = 'GPG00020'
+    kunstwerken[5]['kruinHoogte'] = -2.0
+    del kunstwerken[8]
+
+
+CHANGES = [change_level, change_zuivering, cross_threshold, new_koppelpunt,
+           couple_directly, drop_row, add_row, swap_rows, change_kunstwerk]
+
+
+def prepare(peilgebieden, kunstwerken):
+    """Returns the trrrlib objects of the rows, with the defaults that
+    trrrlib.main adds."""
+    hard_coded_defaults = trrrlib.HardCodedConfig('default.peilgebied', {
+        'openwater_area': 0.0, 'verhard_area': 0.0, 'onverhardsted_area': 0.0,
+        'onverhardland_area': 0.0, 'kas_area': 0.0})
+    result = []
+    for row in copy.deepcopy(peilgebieden):
+        peilgebied = trrrlib.Peilgebied(init=row)
+        trrrlib.add_defaults_from_section('peilgebied', peilgebied, trrrlib.settings, 'default.peilgebied')
+        trrrlib.add_defaults_from_section('peilgebied', peilgebied, hard_coded_defaults, 'default.peilgebied')
+        result.append(peilgebied)
+    return result, [trrrlib.kunstwerkFromDict(row) for row in copy.deepcopy(kunstwerken)]
+
+
+def convert(output_dir, rows, model):
+    """Converts rows into output_dir the way trrrlib.main does in a fresh
+    process."""
+    trrrlib.sequential.id = 0
+    peilgebieden, kunstwerken = prepare(*rows)
+    if model == 'RR':
+        for kunstwerk in kunstwerken:
+            kunstwerk['cfkoppelknoop'] = None
+    trrrlib.convertNetwork({}, peilgebieden, kunstwerken, model, SETTINGS_FILE, output_dir)
+
+
+def read_output(output_dir):
+    result = {}
+    for name in os.listdir(output_dir):
+        if name != trrrlib.ModelState.file_name:
+            result[name] = open(os.path.join(output_dir, name), 'rb').read()
+    return result
+
+
+class ReuseHandler(logging.Handler):
+    """Keeps the number of peilgebieden reused by the last conversion."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.reused = None
+
+    def emit(self, record):
+        match = re.match(r'(\d+) peilgebieden reused', record.getMessage())
+        if match:
+            self.reused = int(match.group(1))
+
+
+def check(workdir, count, seed, handler):
+    """Yields (model, change, same files, peilgebieden reused)."""
+    for model in MODELS:
+        for change in CHANGES:
+            rows = table_rows(count, seed)
+            incremental = os.path.join(workdir, 'incremental')
+            fresh = os.path.join(workdir, 'fresh')
+            for output_dir in incremental, fresh:
+                shutil.rmtree(output_dir, ignore_errors=True)
+                os.mkdir(output_dir)
+            convert(incremental, rows, model)
+            change(*rows)
+            handler.reused = None
+            convert(incremental, rows, model)
+            reused = handler.reused
+            convert(fresh, rows, model)
+            yield model, change.__name__, read_output(incremental) == read_output(fresh), reused
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('--count', type='int', default=60,
+                      help="peilgebieden in the synthetic polder, at least 21 (default 60)")
+    parser.add_option('--seed', type='int', default=1,
+                      help="random seed of the synthetic polder (default 1)")
+    options, args = parser.parse_args()
+
+    trrrlib.settings = trrrlib.Config(SETTINGS_FILE)
+    trrrlib.settings.computation = 'ernst'
+    # like the entry points: a handler of any level on the 'nens' logger.
+    handler = ReuseHandler()
+    logging.getLogger('nens').addHandler(handler)
+    workdir = tempfile.mkdtemp(prefix='trrrlib_incremental_')
+    failed = 0
+    try:
+        for model, change, same, reused in check(workdir, options.count, options.seed, handler):
+            ok = same and bool(reused)
+            if not ok:
+                failed += 1
+            print '%-6s %-18s %s (%s peilgebieden reused)' % (model, change, ok and 'ok' or 'FAILED', reused)
+    finally:
+        shutil.rmtree(workdir)
+    if failed:
+        print '%d re-runs failed' % failed
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()